@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
+
+Run with an ASGI server, e.g. ``uvicorn eshopping.asgi:application``, to serve
+the async endpoints under /async/ without blocking on remote uploads.
 """
 
 import os
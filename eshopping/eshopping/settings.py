@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -51,6 +53,8 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'oauth2_provider.contrib.rest_framework.OAuth2Authentication',
     ),
+    # Số proxy tin cậy phía trước app: IP dùng để giới hạn tần suất lấy từ X-Forwarded-For thay vì REMOTE_ADDR
+    'NUM_PROXIES': int(os.environ['NUM_PROXIES']) if os.environ.get('NUM_PROXIES') else None,
     # 'DEFAULT_PARSER_CLASSES': (
     #     'rest_framework.parsers.FormParser',
     #     'rest_framework.parsers.MultiPartParser'
@@ -62,18 +66,31 @@ REST_FRAMEWORK = {
 }
 
 MIDDLEWARE = [
+    'shopping.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'shopping.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 
 ]
 CORS_ALLOW_ALL_ORIGINS = True
 
+# Tỉ lệ request được ghi lại số truy vấn / thời gian SQL (độ trễ luôn được ghi), xem /internal/metrics/
+INSTRUMENTATION_SAMPLE_RATE = 1.0 if DEBUG else 0.05
+# Một hình dạng truy vấn lặp lại từ số lần này trở lên trong một request được coi là N+1
+INSTRUMENTATION_N_PLUS_ONE_THRESHOLD = 5
+
+# Ghi lại hình dạng + tần suất truy vấn của mọi kết nối DB (ESHOPPING_WORKLOAD_CAPTURE=1) vào WORKLOAD_CAPTURE_DIR,
+# sau đó chạy manage.py advise_indexes để đề xuất index
+WORKLOAD_CAPTURE = bool(os.environ.get('ESHOPPING_WORKLOAD_CAPTURE'))
+WORKLOAD_CAPTURE_DIR = BASE_DIR / 'workload'
+WORKLOAD_FLUSH_INTERVAL = 30
+
 ROOT_URLCONF = 'eshopping.urls'
 
 MEDIA_ROOT = '%s/shopping/static/' % BASE_DIR
@@ -114,14 +131,149 @@ pymysql.install_as_MySQLdb()
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': 'shopping.backends.mysql_pool',
         'NAME': 'eshopping',
         'USER': 'root',
         'PASSWORD': '123456789',
-        'HOST': ''  # mặc định localhost
+        'HOST': '',  # mặc định localhost
+        # Pool kết nối theo process (xem shopping/backends/pool.py), số liệu ở /internal/db-pool/
+        'POOL': {
+            'ENABLED': True,
+            'SIZE': 10,
+            'MAX_OVERFLOW': 10,
+            'TIMEOUT': 10,
+            'RECYCLE': 1800,
+            'PRE_PING': True,
+        },
     }
 }
 
+# Các alias chỉ đọc trong DATABASES, ví dụ 'replica1': {... 'HOST': 'replica1.db'}
+DATABASE_REPLICAS = []
+
+if os.environ.get('ESHOPPING_SQLITE'):
+    # Chạy local/test bằng SQLite: replica trỏ cùng file với primary, khi test dùng chung DB test với primary
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        },
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'TEST': {'MIRROR': 'default'},
+        },
+    }
+    # manage.py test: TestCase chạy trong transaction chưa commit của default nên mọi truy vấn đi primary; test của
+    # router tự bật replica bằng override_settings
+    DATABASE_REPLICAS = [] if sys.argv[1:2] == ['test'] else ['replica']
+
+DATABASE_ROUTERS = ['shopping.routers.PrimaryReplicaRouter']
+
+# Cache dùng chung giữa các worker: giới hạn tần suất, ghim primary theo user, làm mới cache sản phẩm/lượt thích,
+# phiên bản refdata và nhật ký thay đổi của chỉ mục gợi ý đều dựa vào nó. Không đặt REDIS_URL thì mỗi process có
+# LocMemCache riêng, chỉ đúng khi chạy một process; ngoài DEBUG app ghi cảnh báo khi khởi động (shopping/checks.py)
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
+# Sau khi user ghi dữ liệu, các lần đọc của user đó đi vào primary trong khoảng thời gian này (giây).
+# Trạng thái ghim theo user lưu trong cache nên cần cache dùng chung (Redis/Memcached) khi chạy nhiều worker.
+REPLICA_STICKY_SECONDS = 10
+REPLICA_PIN_COOKIE = 'primary_pin'
+# Các app luôn đọc từ primary (token OAuth vừa cấp phải dùng được ngay)
+REPLICA_EXCLUDED_APPS = ['oauth2_provider']
+
+# Tập id sản phẩm user đã thích được cache (giây), bị xoá khi user thích/bỏ thích
+LIKED_IDS_CACHE_TIMEOUT = 300
+# Cache biểu diễn của từng sản phẩm (giây) cho /products/{id}/ và /products/batch/, và số id tối đa mỗi lần batch
+PRODUCT_CACHE_TIMEOUT = 60
+PRODUCT_BATCH_MAX_IDS = 50
+# Sửa hàng loạt sản phẩm (/products/bulk-update/): số sản phẩm tối đa mỗi request, số dòng mỗi câu UPDATE
+PRODUCT_BULK_UPDATE_MAX_ITEMS = 10000
+PRODUCT_BULK_UPDATE_CHUNK_SIZE = 500
+# Danh mục/màu/kích thước giữ trong bộ nhớ mỗi process; số giây giữa hai lần so phiên bản với cache dùng chung
+REFERENCE_DATA_CHECK_INTERVAL = 5
+# Gợi ý khi gõ (/suggest/): số giây giữa hai lần kiểm tra thay đổi từ process khác, chu kỳ dựng lại toàn bộ
+# chỉ mục (cập nhật điểm phổ biến) và số gợi ý tối đa mỗi request
+TYPEAHEAD_CHECK_INTERVAL = 5
+TYPEAHEAD_REBUILD_SECONDS = 3600
+TYPEAHEAD_MAX_LIMIT = 20
+# Tìm sản phẩm theo kw: tỉ lệ tối thiểu token 3 ký tự của kw phải có trong tên sản phẩm/shop
+SEARCH_MIN_TOKEN_RATIO = 0.6
+# Admin: bảng lớn hơn số dòng này (không lọc) hiển thị số dòng ước lượng, có lọc thì chỉ đếm tới giới hạn này;
+# xuất CSV đọc mỗi lần bấy nhiêu dòng
+ADMIN_EXACT_COUNT_LIMIT = 10000
+ADMIN_EXPORT_CHUNK_SIZE = 2000
+# Xuất đơn hàng (/order/export/, manage.py export_orders): số dòng đọc mỗi lần
+ORDER_EXPORT_CHUNK_SIZE = 2000
+
+# Ảnh resize theo yêu cầu (/images/...): các chiều rộng được phép, thư mục cache trên đĩa và dung lượng tối đa
+IMAGE_WIDTHS = (64, 128, 256, 320, 480, 640, 960, 1280)
+IMAGE_CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR', str(BASE_DIR / 'image_cache'))
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+IMAGE_QUALITY = 80
+
+# Secret HMAC của từng cổng thanh toán cho /payments/webhook/<cổng>/; cổng không có secret bị từ chối
+PAYMENT_WEBHOOK_SECRETS = {
+    gateway: os.environ['PAYMENT_%s_SECRET' % gateway]
+    for gateway in ('MOMO', 'ZALOPAY', 'PAYPAL', 'BANK_TRANSFER') if os.environ.get('PAYMENT_%s_SECRET' % gateway)
+}
+PAYMENT_CALLBACK_BATCH_SIZE = 500
+PAYMENT_CALLBACK_MAX_ATTEMPTS = 5
+
+# Email thông báo đơn hàng. Với Gmail dùng EMAIL_HOST_USER và mật khẩu ứng dụng (App Password) qua biến môi trường;
+# không cấu hình thì email được in ra console
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'smtp.gmail.com')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 587))
+EMAIL_USE_TLS = True
+EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
+ORDER_NOTIFICATION_FROM = EMAIL_HOST_USER or 'no-reply@eshopping.local'
+# Worker send_order_notifications: số lần gửi tối đa, backoff (giây, nhân đôi mỗi lần lỗi) và thời gian giữ một lô
+ORDER_NOTIFICATION_MAX_ATTEMPTS = 5
+ORDER_NOTIFICATION_RETRY_BASE_SECONDS = 30
+ORDER_NOTIFICATION_RETRY_MAX_SECONDS = 3600
+ORDER_NOTIFICATION_LEASE_SECONDS = 300
+# Lưu trữ đơn hàng (manage.py archive_orders): đơn ở các trạng thái này quá số ngày này được chuyển sang bảng
+# lưu trữ, mỗi lô bấy nhiêu đơn, nghỉ bấy nhiêu giây giữa hai lô
+ORDER_ARCHIVE_AFTER_DAYS = 365
+ORDER_ARCHIVE_STATUSES = ('delivered', 'cancelled')
+ORDER_ARCHIVE_BATCH_SIZE = 500
+ORDER_ARCHIVE_PAUSE_SECONDS = 0.5
+# Hàng đợi việc nền (shopping/jobs.py, manage.py run_jobs): số worker, số lần thử mặc định, backoff (giây, nhân
+# đôi mỗi lần lỗi) và thời gian giữ việc đang chạy trước khi worker khác được nhận lại
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BASE_SECONDS = 10
+JOB_RETRY_MAX_SECONDS = 3600
+JOB_LEASE_SECONDS = 300
+
+# Giới hạn tần suất các endpoint ghi (shopping/throttling.py): 'user' theo user (hoặc IP nếu chưa đăng nhập),
+# 'ip' theo IP, 'endpoint' chung cho mọi client; trạng thái nằm trong cache THROTTLE_CACHE dùng chung giữa worker
+THROTTLE_ENABLED = os.environ.get('THROTTLE_ENABLED', '1') != '0'
+THROTTLE_CACHE = 'default'
+THROTTLE_RATES = {
+    'cart': {'user': '30/min', 'ip': '120/min', 'endpoint': '6000/min'},
+    'like': {'user': '60/min', 'ip': '240/min', 'endpoint': '12000/min'},
+    'review': {'user': '10/min', 'ip': '30/min', 'endpoint': '1200/min'},
+    'register': {'ip': '10/hour', 'endpoint': '600/min'},
+    'order': {'user': '10/min', 'ip': '60/min', 'endpoint': '3000/min'},
+    'product': {'user': '30/min', 'ip': '60/min', 'endpoint': '3000/min'},
+    'token': {'user': '10/min', 'ip': '30/min', 'endpoint': '3000/min'},
+}
+
 AUTH_USER_MODEL = 'shopping.User'
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
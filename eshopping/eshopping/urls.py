@@ -18,6 +18,8 @@ from django.urls import path, include, re_path
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework import permissions
+from oauth2_provider.views import TokenView
+from shopping.throttling import throttle_view
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -35,6 +37,8 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('shopping.urls')),
     re_path(r'^ckeditor/', include('ckeditor_uploader.urls')),
+    # Đăng nhập bằng mật khẩu bị giới hạn theo IP và theo tên đăng nhập
+    path('o/token/', throttle_view('token', user_field = 'username')(TokenView.as_view()), name = 'token'),
     path('o/', include('oauth2_provider.urls',
                        namespace = 'oauth2_provider')),
     re_path(r'^swagger(?P<format>\.json|\.yaml)$',
@@ -1,10 +1,102 @@
+import csv
+
 from ckeditor_uploader.widgets import CKEditorUploadingWidget
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.utils import get_fields_from_path
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import IntegerField, Q
+from django.http import StreamingHttpResponse
 from .models import Category, Product, Payment, User, Color, Size, Shop, Business, ShopReview, Like, ProductReview, \
-    Cart, CartDetail, OrderDetail, Order
+    Cart, CartDetail, OrderDetail, Order, PaymentCallback, OrderNotification, ArchivedOrder, ArchivedOrderDetail, \
+    ArchivedPayment, Job, BusinessProfile
+from .images import image_url
+from .jobs import requeue_dead
+from .paginators import EstimatedCountPaginator
+from .renderers import Echo
 from django.utils.html import mark_safe
 from django import forms
 
+SEARCH_LOOKUPS = {'^': 'istartswith', '=': 'iexact', '@': 'search'}
+
+
+def export_chunk_size():
+    return getattr(settings, 'ADMIN_EXPORT_CHUNK_SIZE', 2000)
+
+
+def column_label(model, path):
+    try:
+        return str(model._meta.get_field(path).verbose_name)
+    except FieldDoesNotExist:
+        return path
+
+
+def iter_csv(queryset, fields, chunk_size):
+    # Duyệt theo khoá chính (keyset) từng chunk: mỗi truy vấn chỉ đọc chunk_size dòng kể cả khi xuất hàng triệu dòng
+    writer = csv.writer(Echo())
+    # BOM để Excel mở đúng tiếng Việt
+    yield '\ufeff' + writer.writerow([column_label(queryset.model, f) for f in fields])
+    rows = queryset.order_by('pk').values_list('pk', *fields)
+    last = None
+    while True:
+        chunk = list((rows if last is None else rows.filter(pk__gt = last))[:chunk_size])
+        if not chunk:
+            return
+        last = chunk[-1][0]
+        yield ''.join(writer.writerow(row[1:]) for row in chunk)
+
+
+@admin.action(description = 'Xuất CSV các dòng đã chọn')
+def export_as_csv(modeladmin, request, queryset):
+    fields = modeladmin.get_export_fields()
+    response = StreamingHttpResponse(iter_csv(queryset, fields, export_chunk_size()),
+                                     content_type = 'text/csv; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename="%s.csv"' % queryset.model._meta.model_name
+    return response
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    # Admin cho các bảng có thể lên tới hàng triệu dòng: không COUNT(*) chính xác, khoá ngoại dùng ô nhập id
+    # (raw_id_fields) thay vì dropdown chứa toàn bộ bảng, trang danh sách select_related các cột hiển thị
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+    actions = [export_as_csv]
+    # Các cột xuất CSV (cho phép dạng 'shop__name'); mặc định là các cột của list_display có trong model
+    export_fields = None
+
+    def get_search_results(self, request, queryset, search_term):
+        # Cột số ('=id', '=order__id') chỉ được so sánh bằng khi chuỗi tìm là số: admin mặc định sinh ra
+        # id LIKE '...' không dùng được index. Các cột chuỗi nên khai báo '^' (tiền tố) để dùng index
+        term = search_term.strip()
+        search_fields = self.get_search_fields(request)
+        if not term or not search_fields:
+            return queryset, False
+        condition = Q()
+        for name in search_fields:
+            path = name.lstrip('^=@')
+            field = get_fields_from_path(self.model, path)[-1]
+            if field.is_relation or isinstance(field, IntegerField):
+                if term.isdigit():
+                    condition |= Q(**{path: int(term)})
+            else:
+                condition |= Q(**{'%s__%s' % (path, SEARCH_LOOKUPS.get(name[0], 'icontains')): term})
+        if not condition:
+            return queryset.none(), False
+        return queryset.filter(condition), False
+
+    def get_export_fields(self):
+        if self.export_fields is not None:
+            return list(self.export_fields)
+        fields = []
+        for name in self.list_display:
+            try:
+                field = self.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            fields.append(field.attname if field.is_relation else name)
+        return fields
+
 
 class CategoryForm(forms.ModelForm):
     description = forms.CharField(widget = CKEditorUploadingWidget)
@@ -18,19 +110,29 @@ class CategoryAdmin(admin.ModelAdmin):
     form = CategoryForm
 
 
-class ProductAdmin(admin.ModelAdmin):
-    list_display = ["id", "name", "created_date", "active", "price", "discount", 'quantity', 'thumbnail']
+class ProductAdmin(LargeTableAdmin):
+    list_display = ["id", "name", "created_date", "active", "price", "discount", 'quantity', 'thumbnail', 'category',
+                    'shop']
+    list_select_related = ['category', 'shop']
+    list_filter = ['active']
     readonly_fields = ["product_image"]
+    # '^' tìm theo tiền tố (LIKE 'abc%') để dùng được index product_name
+    search_fields = ['=id', '^name']
+    autocomplete_fields = ['shop']
+    export_fields = ['id', 'name', 'created_date', 'active', 'price', 'discount', 'quantity', 'category__name',
+                     'shop__name']
 
     def product_image(self, product):
         return mark_safe(
-            "<img src='{thumbnail_url}' width='120' />".format(thumbnail_url = product.thumbnail.name))
+            "<img src='{thumbnail_url}' width='120' />".format(thumbnail_url = image_url(product.thumbnail.name, 256)))
 
 
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(LargeTableAdmin):
     list_display = ["id", "first_name", "last_name", "date_joined", "is_active", "username", 'avatar']
     readonly_fields = ["avatar"]
     readonly_fields = ('last_login', 'date_joined')
+    search_fields = ['=id', '^username']
+    export_fields = ['id', 'username', 'first_name', 'last_name', 'email', 'date_joined', 'is_active']
 
     def get_readonly_fields(self, request, obj = None):
         # Nếu request.user không phải là superuser thì readonly_fields sẽ được áp dụng
@@ -39,12 +141,130 @@ class UserAdmin(admin.ModelAdmin):
         return self.readonly_fields
 
 
-class OrderAdmin(admin.ModelAdmin):
-    list_display = ["id"]
+class OrderAdmin(LargeTableAdmin):
+    list_display = ["id", "name", "phone", "email", "total_amount", "status", "status_ship", "created_date", "user"]
+    list_select_related = ['user']
+    list_filter = ['status', 'status_ship']
+    search_fields = ['=id', '^phone', '^email']
+    date_hierarchy = 'created_date'
+    raw_id_fields = ['user']
+
+
+class OrderDetailAdmin(LargeTableAdmin):
+    list_display = ["id", "order", "product", "price", "discount", "quantity", "sizes", "colors"]
+    list_select_related = ['order', 'product', 'sizes', 'colors']
+    search_fields = ['=order__id']
+    raw_id_fields = ['order', 'product']
+
+
+class PaymentAdmin(LargeTableAdmin):
+    list_display = ["id", "order", "user", "payment_method", "payment_status", "total_amount", "created_date"]
+    list_select_related = ['order', 'user']
+    list_filter = ['payment_method', 'payment_status']
+    search_fields = ['=id', '=order__id']
+    raw_id_fields = ['order', 'user']
+
+
+class ArchivedAdmin(LargeTableAdmin):
+    # Dữ liệu lưu trữ chỉ để tra cứu: không thêm/sửa/xoá trong admin
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj = None):
+        return False
+
+    def has_delete_permission(self, request, obj = None):
+        return False
+
+
+class ArchivedOrderAdmin(ArchivedAdmin):
+    list_display = OrderAdmin.list_display + ["archived_date"]
+    list_select_related = ['user']
+    list_filter = ['status']
+    search_fields = ['=id', '^phone', '^email']
+    raw_id_fields = ['user']
+
+
+class ArchivedOrderDetailAdmin(ArchivedAdmin):
+    list_display = OrderDetailAdmin.list_display
+    list_select_related = OrderDetailAdmin.list_select_related
+    search_fields = ['=order__id']
+    raw_id_fields = ['order', 'product']
+
+
+class ArchivedPaymentAdmin(ArchivedAdmin):
+    list_display = PaymentAdmin.list_display
+    list_select_related = ['order', 'user']
+    search_fields = ['=id', '=order__id']
+    raw_id_fields = ['order', 'user']
+
+
+class PaymentCallbackAdmin(LargeTableAdmin):
+    list_display = ["id", "gateway", "event_id", "status", "attempts", "error", "received_date", "processed_date"]
+    list_filter = ['status', 'gateway']
+    search_fields = ['^event_id']
+    readonly_fields = ['received_date', 'processed_date']
+
+
+class OrderNotificationAdmin(LargeTableAdmin):
+    list_display = ["id", "order", "status", "state", "attempts", "next_attempt_date", "last_error", "sent_date"]
+    list_filter = ['state', 'status']
+    search_fields = ['=order__id']
+    raw_id_fields = ['order']
+
+
+class JobAdmin(LargeTableAdmin):
+    list_display = ["id", "queue", "name", "state", "attempts", "max_attempts", "run_at", "created_date",
+                    "finished_date"]
+    list_filter = ['state', 'queue']
+    search_fields = ['^name']
+    readonly_fields = ['created_date', 'finished_date', 'last_error']
+    actions = ['requeue']
+
+    @admin.action(description = 'Đưa lại vào hàng đợi')
+    def requeue(self, request, queryset):
+        count = requeue_dead(ids = list(queryset.values_list('id', flat = True)))
+        self.message_user(request, '%d việc đã được đưa lại vào hàng đợi' % count)
+
+
+class CartAdmin(LargeTableAdmin):
+    list_display = ["id", "user"]
+    list_select_related = ['user']
+    raw_id_fields = ['user']
+
+
+class CartDetailAdmin(LargeTableAdmin):
+    list_display = ["id", "cart", "product", "quantity", "sizes", "colors"]
+    list_select_related = ['cart', 'product', 'sizes', 'colors']
+    search_fields = ['=cart__id']
+    raw_id_fields = ['cart', 'product']
+
+
+class LikeAdmin(LargeTableAdmin):
+    list_display = ["id", "user_id", "product_id", "active", "updated_date"]
+    list_select_related = ['user_id', 'product_id']
+    raw_id_fields = ['user_id', 'product_id']
+
+
+class ProductReviewAdmin(LargeTableAdmin):
+    list_display = ["id", "product", "user", "rating", "active", "created_date"]
+    list_select_related = ['product', 'user']
+    list_filter = ['active', 'rating']
+    search_fields = ['=product__id']
+    raw_id_fields = ['product', 'user', 'parent_comment']
+
+
+class ShopReviewAdmin(LargeTableAdmin):
+    list_display = ["id", "shop", "user", "rating", "created_date"]
+    list_select_related = ['shop', 'user']
+    raw_id_fields = ['shop', 'user', 'parent_comment']
 
 
 class ShopAdmin(admin.ModelAdmin):
     list_display = ["id", "name", "business"]
+    list_select_related = ['business']
+    search_fields = ['^name']
+    raw_id_fields = ['business']
 
 
 class BusinessAdmin(UserAdmin):
@@ -59,19 +279,33 @@ class BusinessAdmin(UserAdmin):
         return self.readonly_fields
 
 
+class BusinessProfileAdmin(admin.ModelAdmin):
+    list_display = ["user", "business_name", "phone", "tax_code", "status", "is_active"]
+    list_filter = ['status', 'is_active']
+    search_fields = ['=user__id', '^business_name']
+    raw_id_fields = ['user']
+
+
 # Register your models here.
 admin.site.register(Category, CategoryAdmin)
 admin.site.register(Product, ProductAdmin)
-admin.site.register(Payment)
+admin.site.register(Payment, PaymentAdmin)
+admin.site.register(PaymentCallback, PaymentCallbackAdmin)
 admin.site.register(User, UserAdmin)
 admin.site.register(Color)
 admin.site.register(Size)
 admin.site.register(Shop, ShopAdmin)
 admin.site.register(Business, BusinessAdmin)
-admin.site.register(ShopReview)
-admin.site.register(Like)
-admin.site.register(ProductReview)
-admin.site.register(Cart)
-admin.site.register(CartDetail)
+admin.site.register(BusinessProfile, BusinessProfileAdmin)
+admin.site.register(ShopReview, ShopReviewAdmin)
+admin.site.register(Like, LikeAdmin)
+admin.site.register(ProductReview, ProductReviewAdmin)
+admin.site.register(Cart, CartAdmin)
+admin.site.register(CartDetail, CartDetailAdmin)
 admin.site.register(Order, OrderAdmin)
-admin.site.register(OrderDetail)
+admin.site.register(OrderDetail, OrderDetailAdmin)
+admin.site.register(OrderNotification, OrderNotificationAdmin)
+admin.site.register(Job, JobAdmin)
+admin.site.register(ArchivedOrder, ArchivedOrderAdmin)
+admin.site.register(ArchivedOrderDetail, ArchivedOrderDetailAdmin)
+admin.site.register(ArchivedPayment, ArchivedPaymentAdmin)
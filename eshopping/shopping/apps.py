@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class ShoppingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shopping'
+
+    def ready(self):
+        from django.conf import settings
+        # đăng ký signal làm mới cache sản phẩm, lượt thích, refdata, chỉ mục gợi ý, token tìm kiếm, ghi outbox
+        # thông báo đơn hàng, các task của hàng đợi việc nền và gắn bộ đếm truy vấn vào mỗi kết nối DB
+        from . import cache, jobs, likes, metrics, refdata, notifications, search, typeahead
+        from .checks import warn_local_caches
+
+        warn_local_caches()
+
+        if getattr(settings, 'WORKLOAD_CAPTURE', False):
+            from . import workload
+
+            workload.install()
@@ -0,0 +1,143 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from . import metrics
+from .models import (Order, OrderDetail, Payment, OrderNotification, ArchivedOrder, ArchivedOrderDetail,
+                     ArchivedPayment)
+
+# Chuyển đơn đã đóng (giao xong/huỷ) quá ORDER_ARCHIVE_AFTER_DAYS ngày cùng dòng sản phẩm và thanh toán sang các
+# bảng Archived*. Mỗi lô là một transaction: chép rồi xoá khỏi bảng gốc, nên dừng giữa chừng (Ctrl-C, deploy) thì
+# lần chạy sau tiếp tục từ các đơn còn lại. Đọc lịch sử/thống kê dùng các hàm bên dưới để gộp cả hai nơi.
+ARCHIVE_MODELS = ((Order, ArchivedOrder), (OrderDetail, ArchivedOrderDetail), (Payment, ArchivedPayment))
+
+logger = logging.getLogger('shopping.archive')
+
+
+def archive_setting(name, default):
+    return getattr(settings, 'ORDER_ARCHIVE_%s' % name, default)
+
+
+def copied_fields(archive_model):
+    return [f.attname for f in archive_model._meta.concrete_fields if f.name != 'archived_date']
+
+
+def cutoff_date(days = None):
+    return timezone.now() - timedelta(days = archive_setting('AFTER_DAYS', 365) if days is None else days)
+
+
+def candidates(cutoff):
+    # created_date dùng index (status, created_date); updated_date loại các đơn vừa đổi trạng thái gần đây.
+    # Đơn còn email thông báo chưa gửi được giữ lại tới khi outbox xử lý xong
+    return Order.objects.filter(status__in = archive_setting('STATUSES', ('delivered', 'cancelled')),
+                                created_date__lt = cutoff, updated_date__lt = cutoff) \
+        .exclude(notifications__state = OrderNotification.DeliveryState.PENDING)
+
+
+def archive_batch(cutoff, batch_size):
+    # Trả về số đơn đã chuyển trong lô
+    with transaction.atomic():
+        queryset = candidates(cutoff).order_by('id')
+        if connection.features.has_select_for_update:
+            # Chạy song song hai tiến trình thì mỗi bên lấy các đơn khác nhau
+            queryset = queryset.select_for_update(skip_locked = connection.features.has_select_for_update_skip_locked)
+        ids = list(queryset.values_list('id', flat = True)[:batch_size])
+        if not ids:
+            return 0
+        for model, archive_model in ARCHIVE_MODELS:
+            lookup = 'id__in' if model is Order else 'order_id__in'
+            fields = copied_fields(archive_model)
+            rows = model.objects.filter(**{lookup: ids}).values(*fields)
+            # ignore_conflicts: dòng đã có trong bảng lưu trữ (chép tay, lần chạy trước) không làm hỏng lô
+            archive_model.objects.bulk_create([archive_model(**row) for row in rows], ignore_conflicts = True)
+        # Xoá theo thứ tự khoá ngoại: thanh toán (PROTECT), dòng sản phẩm (SET_NULL), rồi đơn (kéo theo thông báo)
+        Payment.objects.filter(order_id__in = ids).delete()
+        OrderDetail.objects.filter(order_id__in = ids).delete()
+        Order.objects.filter(id__in = ids).delete()
+    metrics.increment('order_archive.archived', len(ids))
+    return len(ids)
+
+
+def run(cutoff = None, batch_size = None, pause = None, max_batches = None, progress = None):
+    # pause: số giây nghỉ giữa hai lô để không chiếm I/O và khoá của DB chính quá lâu
+    cutoff = cutoff or cutoff_date()
+    batch_size = batch_size or archive_setting('BATCH_SIZE', 500)
+    pause = archive_setting('PAUSE_SECONDS', 0.5) if pause is None else pause
+    total = batches = 0
+    while max_batches is None or batches < max_batches:
+        count = archive_batch(cutoff, batch_size)
+        if not count:
+            break
+        total += count
+        batches += 1
+        if progress is not None:
+            progress(batches, total)
+        if pause:
+            time.sleep(pause)
+    return total
+
+
+def user_orders(queryset, user):
+    # Lịch sử đơn theo ngày tạo: đơn lưu trữ luôn cũ hơn đơn đang dùng nên chỉ cần nối hai danh sách
+    return [queryset(ArchivedOrder.objects.filter(user = user)).order_by('created_date'),
+            queryset(Order.objects.filter(user = user)).order_by('created_date')]
+
+
+def find_order(pk):
+    # Đơn đang dùng hoặc đơn đã lưu trữ, None nếu không có
+    return Order.objects.filter(pk = pk).first() or ArchivedOrder.objects.filter(pk = pk).first()
+
+
+def order_lines(order):
+    model = ArchivedOrderDetail if isinstance(order, ArchivedOrder) else OrderDetail
+    return model.objects.filter(order = order)
+
+
+def order_payment(order_id):
+    return Payment.objects.filter(order = order_id).first() or \
+        ArchivedPayment.objects.filter(order = order_id).first()
+
+
+def order_payments(order_ids, fields, **filters):
+    # Như order_payment() cho nhiều đơn: {order_id: dict các trường}, đơn đã lưu trữ đọc từ ArchivedPayment
+    found = {}
+    for model in (Payment, ArchivedPayment):
+        missing = [pk for pk in order_ids if pk not in found]
+        if not missing:
+            break
+        for row in model.objects.filter(order_id__in = missing, **filters).values('order_id', *fields):
+            found.setdefault(row['order_id'], row)
+    return found
+
+
+def order_totals(statuses):
+    total_amount = order_count = 0
+    for model in (Order, ArchivedOrder):
+        row = model.objects.aggregate(total_amount = Sum('total_amount', filter = Q(status__in = statuses)),
+                                      order_count = Count('id'))
+        total_amount += row['total_amount'] or 0
+        order_count += row['order_count']
+    return total_amount, order_count
+
+
+def orders_by_month():
+    months = {}
+    for model in (ArchivedOrder, Order):
+        rows = model.objects.annotate(month = TruncMonth('created_date')).values('month') \
+            .annotate(total_amount = Sum('total_amount', filter = ~Q(status = 'cancelled')),
+                      total_orders = Count('id', filter = ~Q(status = 'cancelled')),
+                      canceled_orders = Count('id', filter = Q(status = 'cancelled'))).order_by('month')
+        for row in rows:
+            merged = months.setdefault(row['month'], {'month': row['month'], 'total_amount': None,
+                                                      'total_orders': 0, 'canceled_orders': 0})
+            if row['total_amount'] is not None:
+                merged['total_amount'] = (merged['total_amount'] or 0) + row['total_amount']
+            merged['total_orders'] += row['total_orders']
+            merged['canceled_orders'] += row['canceled_orders']
+    return [months[month] for month in sorted(months)]
@@ -0,0 +1,199 @@
+import asyncio
+import io
+import json
+import logging
+import math
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from cloudinary import uploader
+from django.db import transaction
+from django.http import HttpResponse
+from rest_framework import exceptions, permissions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .models import Product, Shop
+from .perms import IsBusiness
+from .renderers import dumps
+from .serializers import ProductSerializer, UserSerializer, BusinessSerializer, OrderSerializer
+from .views import create_order, add_product_options
+from . import refdata, throttling
+
+# Các view async cho những endpoint chờ I/O từ xa (upload Cloudinary). Chạy dưới ASGI
+# (uvicorn eshopping.asgi:application): trong lúc chờ mạng worker vẫn phục vụ request khác, các lời gọi
+# từ xa của cùng một request chạy song song; ORM được đẩy sang thread bằng sync_to_async.
+
+logger = logging.getLogger('shopping.async_views')
+
+
+def json_response(data, status_code = status.HTTP_200_OK):
+    return HttpResponse(dumps(data), content_type = 'application/json', status = status_code)
+
+
+def async_api_view(*methods):
+    # Tương tự @api_view của DRF cho view async: kiểm tra method, bỏ CSRF (xác thực bằng token)
+    # và trả lỗi APIException dưới dạng JSON
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return json_response({'detail': 'Method "%s" not allowed.' % request.method},
+                                     status.HTTP_405_METHOD_NOT_ALLOWED)
+            try:
+                return await view(request, *args, **kwargs)
+            except exceptions.APIException as e:
+                response = json_response(e.detail if isinstance(e.detail, (dict, list)) else {'detail': e.detail},
+                                         e.status_code)
+                if isinstance(e, exceptions.Throttled) and e.wait:
+                    response['Retry-After'] = str(math.ceil(e.wait))
+                return response
+
+        # csrf_exempt của Django 4.1 bọc view thành hàm sync nên chỉ gán cờ
+        wrapper.csrf_exempt = True
+        return wrapper
+
+    return decorator
+
+
+def _authenticate(request, permission_classes):
+    # OAuth2Authentication đọc cả body (request.POST) nên Request cần parser; DRF gán lại POST/FILES đã parse
+    # vào HttpRequest nên view vẫn đọc được form
+    drf_request = Request(request, parsers = [parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+                          authenticators = [auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    user = request.user = drf_request.user
+    for permission in permission_classes:
+        if not permission().has_permission(request, None):
+            if not user.is_authenticated:
+                raise exceptions.NotAuthenticated()
+            raise exceptions.PermissionDenied()
+    return user
+
+
+async def authenticate(request, permission_classes = ()):
+    # Xác thực và kiểm tra quyền trong cùng một lần chuyển sang thread
+    return await sync_to_async(_authenticate)(request, permission_classes)
+
+
+async def throttle(request, scope, kinds = throttling.KINDS, charge = True):
+    # Cùng scope và khoá với ThrottledActionsMixin của endpoint DRF tương ứng, nên gọi bản async không vượt được
+    # giới hạn. Chỉ đọc/ghi cache, không dùng DB
+    bucket = throttling.BucketThrottle(scope, kinds, charge)
+    if not await sync_to_async(bucket.allow_request, thread_sensitive = False)(request, None):
+        raise exceptions.Throttled(bucket.wait())
+
+
+async def throttled_user(request, scope, permission_classes):
+    # Như ThrottledActionsMixin: xem trước theo IP/endpoint (không trừ lượt) để request bị chặn không tốn truy vấn
+    # token OAuth, xác thực, rồi trừ lượt ở mọi bucket
+    await throttle(request, scope, throttling.PRE_AUTH_KINDS, charge = False)
+    user = await authenticate(request, permission_classes)
+    await throttle(request, scope)
+    return user
+
+
+async def upload(file):
+    # Upload là I/O mạng thuần, không dùng DB nên chạy ở thread pool chung (thread_sensitive = False)
+    # để nhiều upload có thể chạy cùng lúc
+    if file is None:
+        return None
+    response = await sync_to_async(uploader.upload, thread_sensitive = False)(file)
+    return response['url']
+
+
+def form_data(request):
+    data = request.POST.copy()
+    data.update(request.FILES)
+    return data
+
+
+def json_data(request):
+    try:
+        return json.loads(request.body or b'{}')
+    except ValueError as e:
+        raise exceptions.ParseError('JSON parse error - %s' % e)
+
+
+def validated(serializer):
+    serializer.is_valid(raise_exception = True)
+    return serializer
+
+
+def copy_file(file):
+    # Cùng một file được lưu vào model và upload song song, mỗi bên đọc một bản riêng
+    if file is None:
+        return None
+    file.seek(0)
+    content = io.BytesIO(file.read())
+    content.name = file.name
+    file.seek(0)
+    return content
+
+
+@async_api_view('POST')
+async def create_product(request):
+    user = await throttled_user(request, 'product', [permissions.IsAuthenticated, IsBusiness])
+    data = form_data(request)
+
+    def prepare():
+        validated(ProductSerializer(data = data))
+        try:
+            category = refdata.instance('categories', int(data.get('category')))
+            shop = Shop.objects.get(business = user.id)
+        except (Shop.DoesNotExist, TypeError, ValueError):
+            category = None
+        if category is None:
+            raise exceptions.ValidationError({'message': 'Danh mục hoặc shop không tồn tại'})
+        return category, shop
+
+    # Chỉ upload ảnh khi dữ liệu hợp lệ, nếu không ảnh đã upload lên Cloudinary sẽ không thuộc sản phẩm nào
+    category, shop = await sync_to_async(prepare)()
+    thumbnail = await upload(request.FILES.get('thumbnail'))
+
+    def save():
+        with transaction.atomic():
+            product = Product.objects.create(name = data.get('name'), quantity = data.get('quantity'),
+                                             price = data.get('price'), discount = data.get('discount'),
+                                             category = category, thumbnail = thumbnail or '', shop = shop,
+                                             description = data.get('description'))
+            add_product_options(product, data.getlist('sizes'), data.getlist('colors'))
+        return ProductSerializer(product, context = {'request': request}).data
+
+    return json_response(await sync_to_async(save)(), status.HTTP_201_CREATED)
+
+
+async def register(request, serializer_class):
+    await throttle(request, 'register')
+    serializer = await sync_to_async(validated)(serializer_class(data = form_data(request),
+                                                                 context = {'request': request}))
+    # Băm mật khẩu + ghi DB chạy song song với upload avatar lên Cloudinary
+    user, avatar_url = await asyncio.gather(sync_to_async(serializer.save)(),
+                                            upload(copy_file(request.FILES.get('avatar'))))
+    data = await sync_to_async(lambda: serializer_class(user, context = {'request': request,
+                                                                         'avatar_url': avatar_url}).data)()
+    return json_response(data, status.HTTP_201_CREATED)
+
+
+@async_api_view('POST')
+async def register_user(request):
+    return await register(request, UserSerializer)
+
+
+@async_api_view('POST')
+async def register_business(request):
+    return await register(request, BusinessSerializer)
+
+
+@async_api_view('POST')
+async def place_order(request):
+    # Đọc body trước khi xác thực, OAuth2Authentication sẽ đọc lại từ bản đã cache
+    data = json_data(request)
+    user = await throttled_user(request, 'order', [permissions.IsAuthenticated])
+    serializer = await sync_to_async(validated)(OrderSerializer(data = data, context = {'request': request}))
+
+    def save():
+        # Email xác nhận được ghi vào outbox cùng transaction tạo đơn, worker send_order_notifications gửi sau
+        order = create_order(user, serializer.validated_data)
+        return OrderSerializer(order, context = {'request': request}).data
+
+    return json_response(await sync_to_async(save)(), status.HTTP_201_CREATED)
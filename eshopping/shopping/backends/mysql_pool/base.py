@@ -0,0 +1,62 @@
+from django.db.backends.mysql import base as mysql_base
+
+from ..pool import get_pool
+
+
+def _connect(conn_params):
+    def connect():
+        connection = mysql_base.Database.connect(**conn_params)
+        # Như backend mysql của Django: chỉ bỏ encoder bytes khi đó là bản giữ chỗ (bytes) của mysqlclient cũ
+        if connection.encoders.get(bytes) is bytes:
+            connection.encoders.pop(bytes)
+        return connection
+
+    return connect
+
+
+def _ping(connection):
+    connection.ping(reconnect = False)
+
+
+class DatabaseWrapper(mysql_base.DatabaseWrapper):
+    # Backend MySQL lấy kết nối từ pool của process thay vì mở kết nối mới cho mỗi request.
+    # Cấu hình qua khoá POOL trong DATABASES: ENABLED, SIZE, MAX_OVERFLOW, TIMEOUT, RECYCLE, PRE_PING.
+    def pool_options(self):
+        return self.settings_dict.get('POOL') or {}
+
+    def pool_enabled(self):
+        return self.pool_options().get('ENABLED', True)
+
+    def get_pool(self, conn_params):
+        return get_pool(self.alias, self.pool_options(), _connect(conn_params), ping = _ping)
+
+    def get_new_connection(self, conn_params):
+        if not self.pool_enabled():
+            return super().get_new_connection(conn_params)
+        self._pool = self.get_pool(conn_params)
+        return self._pool.checkout()
+
+    def init_connection_state(self):
+        # Kết nối lấy lại từ pool đã được khởi tạo (sql_mode, isolation level) ở lần mở đầu tiên
+        if getattr(self.connection, '_pool_initialized', False):
+            return
+        super().init_connection_state()
+        self.connection._pool_initialized = True
+
+    def _close(self):
+        pool = getattr(self, '_pool', None)
+        if pool is None:
+            return super()._close()
+        self._pool = None
+        connection = self.connection
+        if self.in_atomic_block:
+            # Đóng giữa transaction: Django vẫn giữ self.connection nên không được trả về pool
+            pool.discard(connection)
+            return
+        try:
+            if not self.autocommit:
+                connection.rollback()
+        except Exception:
+            pool.discard(connection)
+            return
+        pool.release(connection)
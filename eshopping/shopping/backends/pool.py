@@ -0,0 +1,192 @@
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# Mốc (ms) của histogram thời gian checkout
+CHECKOUT_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class ConnectionPool:
+    # Pool kết nối theo process, dùng chung giữa các thread.
+    # size: số kết nối giữ lại khi rảnh, max_overflow: số kết nối được mở thêm khi pool cạn,
+    # timeout: thời gian chờ tối đa khi đã mở đủ size + max_overflow kết nối,
+    # recycle: tuổi thọ tối đa (giây) của một kết nối, pre_ping: kiểm tra kết nối trước khi giao ra.
+    def __init__(self, connect, size = 5, max_overflow = 10, timeout = 30, recycle = 3600, pre_ping = True,
+                 ping = None, close = None):
+        self._connect = connect
+        self._ping = ping
+        self._close = close or (lambda conn: conn.close())
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._created = {}
+        self._opened = 0
+        self._in_use = 0
+        self._waiting = 0
+
+        self.checkouts = 0
+        self.connects = 0
+        self.timeouts = 0
+        self.discarded = 0
+        self.checkout_time_total = 0.0
+        self.checkout_time_max = 0.0
+        self.checkout_histogram = [0] * (len(CHECKOUT_BUCKETS) + 1)
+
+    def checkout(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        conn = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._opened < self.size + self.max_overflow:
+                    self._opened += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout('Connection pool exhausted (%d in use)' % self._in_use)
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._in_use += 1
+
+        if conn is not None and not self._is_healthy(conn):
+            self._discard(conn, keep_slot = True)
+            conn = None
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._opened -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._created[id(conn)] = time.monotonic()
+                self.connects += 1
+
+        self._record_checkout(time.monotonic() - start)
+        return conn
+
+    def release(self, conn):
+        with self._cond:
+            self._in_use -= 1
+            keep = len(self._idle) < self.size and not self._is_expired(conn)
+            if keep:
+                self._idle.append(conn)
+                self._cond.notify()
+        if not keep:
+            self._discard(conn)
+
+    def discard(self, conn):
+        # Trả lại một kết nối đang dùng nhưng không còn tin cậy được (lỗi giữa transaction, mất kết nối...)
+        with self._cond:
+            self._in_use -= 1
+        self._discard(conn)
+
+    def close_idle(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            checkouts = self.checkouts
+            return {
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'opened': self._opened,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'checkouts': checkouts,
+                'connects': self.connects,
+                'timeouts': self.timeouts,
+                'discarded': self.discarded,
+                'checkout_ms_avg': self.checkout_time_total * 1000 / checkouts if checkouts else 0,
+                'checkout_ms_max': self.checkout_time_max * 1000,
+                'checkout_ms_histogram': dict(zip([str(b) for b in CHECKOUT_BUCKETS] + ['+Inf'],
+                                                  self.checkout_histogram)),
+            }
+
+    def _is_expired(self, conn):
+        created = self._created.get(id(conn))
+        return created is None or (self.recycle is not None and time.monotonic() - created > self.recycle)
+
+    def _is_healthy(self, conn):
+        if self._is_expired(conn):
+            return False
+        if self.pre_ping and self._ping is not None:
+            try:
+                self._ping(conn)
+            except Exception:
+                return False
+        return True
+
+    def _discard(self, conn, keep_slot = False):
+        # keep_slot: slot được dùng lại ngay cho kết nối mới nên không giảm số kết nối đang mở
+        with self._cond:
+            self._created.pop(id(conn), None)
+            self.discarded += 1
+            if not keep_slot:
+                self._opened -= 1
+                self._cond.notify()
+        try:
+            self._close(conn)
+        except Exception:
+            pass
+
+    def _record_checkout(self, elapsed):
+        ms = elapsed * 1000
+        index = len(CHECKOUT_BUCKETS)
+        for i, bound in enumerate(CHECKOUT_BUCKETS):
+            if ms <= bound:
+                index = i
+                break
+        with self._cond:
+            self.checkouts += 1
+            self.checkout_time_total += elapsed
+            self.checkout_time_max = max(self.checkout_time_max, elapsed)
+            self.checkout_histogram[index] += 1
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, options, connect, ping = None):
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is None:
+            pool = ConnectionPool(connect, size = options.get('SIZE', 5),
+                                  max_overflow = options.get('MAX_OVERFLOW', 10),
+                                  timeout = options.get('TIMEOUT', 30),
+                                  recycle = options.get('RECYCLE', 3600),
+                                  pre_ping = options.get('PRE_PING', True),
+                                  ping = ping)
+            _pools[alias] = pool
+        return pool
+
+
+def pool_stats():
+    with _pools_lock:
+        pools = dict(_pools)
+    return {alias: pool.stats() for alias, pool in pools.items()}
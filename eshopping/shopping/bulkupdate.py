@@ -0,0 +1,145 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import metrics, typeahead
+from .cache import invalidate_products
+from .models import Product
+
+# Sửa hàng loạt sản phẩm của một shop (POST /products/bulk-update/), hai dạng:
+#   {"items": [{"id": 1, "price": 90000, "discount": 10}, {"id": 2, "quantity": 0, "active": false}, ...]}
+#   {"filter": {"category": 3}, "set": {"discount": 30}}
+# Quyền sở hữu được kiểm tra một lần cho cả danh sách (một truy vấn id theo shop cho mỗi khối), thay đổi được ghi
+# theo khối id, tất cả trong một transaction: dạng items gom các sản phẩm sửa cùng tập trường, cả nhóm cùng giá trị
+# thì dùng UPDATE thường, khác giá trị thì bulk_update (CASE theo id); dạng filter dùng UPDATE thường. Cache sản phẩm và chỉ mục gợi ý được làm mới một lần sau khi commit.
+# Trường được sửa -> (nhỏ nhất, lớn nhất); active là true/false
+FIELDS = {'price': (0, None), 'discount': (0, 100), 'quantity': (0, None), 'active': None}
+FILTERS = ('category', 'ids', 'active')
+
+
+def bulk_setting(name, default):
+    return getattr(settings, 'PRODUCT_BULK_UPDATE_%s' % name, default)
+
+
+def chunks(values, size):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def clean_values(data):
+    # Trả về (giá trị hợp lệ, lỗi)
+    if not isinstance(data, dict) or not data:
+        return {}, ['Cần ít nhất một trong các trường %s' % ', '.join(FIELDS)]
+    values, errors = {}, []
+    for field, value in data.items():
+        if field not in FIELDS:
+            errors.append('Không sửa được trường %s' % field)
+        elif FIELDS[field] is None:
+            if not isinstance(value, bool):
+                errors.append('%s phải là true hoặc false' % field)
+            values[field] = value
+        else:
+            low, high = FIELDS[field]
+            if not is_int(value) or value < low or (high is not None and value > high):
+                errors.append('%s phải là số nguyên từ %d%s' % (field, low, ' đến %d' % high if high else ''))
+            values[field] = value
+    return values, errors
+
+
+def parse(data):
+    # Trả về (kế hoạch, lỗi); kế hoạch là ('items', {id: giá trị}) hoặc ('filter', bộ lọc, giá trị)
+    max_items = bulk_setting('MAX_ITEMS', 10000)
+    if not isinstance(data, dict):
+        return None, ['Dữ liệu phải là một object JSON']
+    if 'items' in data:
+        items = data['items']
+        if not isinstance(items, list) or not 0 < len(items) <= max_items:
+            return None, ['items phải là danh sách từ 1 đến %d sản phẩm' % max_items]
+        changes, errors = defaultdict(dict), []
+        for i, item in enumerate(items):
+            if not isinstance(item, dict) or not is_int(item.get('id')):
+                errors.append('items[%d]: thiếu id' % i)
+                continue
+            values, item_errors = clean_values({k: v for k, v in item.items() if k != 'id'})
+            errors.extend('items[%d]: %s' % (i, error) for error in item_errors)
+            # Cùng id xuất hiện nhiều lần: thay đổi sau ghi đè thay đổi trước
+            changes[item['id']].update(values)
+        return ('items', dict(changes)), errors
+    if 'filter' in data:
+        filters, errors = {}, []
+        raw = data['filter']
+        if not isinstance(raw, dict) or not raw or set(raw) - set(FILTERS):
+            return None, ['filter phải có ít nhất một trong %s' % ', '.join(FILTERS)]
+        if 'category' in raw:
+            if not is_int(raw['category']):
+                errors.append('category phải là id danh mục')
+            filters['category_id'] = raw['category']
+        if 'ids' in raw:
+            if not isinstance(raw['ids'], list) or not all(is_int(pk) for pk in raw['ids']) \
+                    or len(raw['ids']) > max_items:
+                errors.append('ids phải là danh sách tối đa %d id sản phẩm' % max_items)
+            filters['id__in'] = raw['ids']
+        if 'active' in raw:
+            if not isinstance(raw['active'], bool):
+                errors.append('active phải là true hoặc false')
+            filters['active'] = raw['active']
+        values, value_errors = clean_values(data.get('set'))
+        return ('filter', filters, values), errors + ['set: %s' % error for error in value_errors]
+    return None, ['Cần items hoặc filter + set']
+
+
+def not_owned(shop_id, ids):
+    # Các id không thuộc shop (hoặc không tồn tại)
+    owned = set()
+    for chunk in chunks(sorted(ids), bulk_setting('CHUNK_SIZE', 500)):
+        owned.update(Product.objects.filter(shop_id = shop_id, id__in = chunk).values_list('id', flat = True))
+    return sorted(set(ids) - owned)
+
+
+def apply(shop_id, plan):
+    # Trả về số sản phẩm đã sửa; plan đã qua parse() và kiểm tra quyền sở hữu
+    size = bulk_setting('CHUNK_SIZE', 500)
+    now = timezone.now()
+    # Lọc theo shop cả khi ghi: sản phẩm vừa chuyển shop giữa lúc kiểm tra và lúc ghi không bị sửa
+    owned = Product.objects.filter(shop_id = shop_id)
+    with transaction.atomic():
+        if plan[0] == 'items':
+            changes = plan[1]
+            ids = sorted(changes)
+            fields = set()
+            # bulk_update ghi cùng một tập trường cho mọi dòng: gom các sản phẩm sửa cùng tập trường
+            groups = defaultdict(list)
+            for pk in ids:
+                groups[tuple(sorted(changes[pk]))].append(pk)
+                fields.update(changes[pk])
+            updated = 0
+            for group, pks in groups.items():
+                same = all(changes[pk] == changes[pks[0]] for pk in pks)
+                for chunk in chunks(pks, size):
+                    if same:
+                        # Cùng giá trị cho cả nhóm ("giảm 30% tất cả"): UPDATE thường, không cần CASE theo từng id
+                        updated += owned.filter(id__in = chunk).update(updated_date = now, **changes[pks[0]])
+                    else:
+                        updated += owned.bulk_update([Product(id = pk, updated_date = now, **changes[pk])
+                                                      for pk in chunk], list(group) + ['updated_date'])
+        else:
+            _, filters, values = plan
+            fields = set(values)
+            ids = list(owned.filter(**filters).order_by('id').values_list('id', flat = True))
+            updated = 0
+            for chunk in chunks(ids, size):
+                updated += owned.filter(id__in = chunk).update(updated_date = now, **values)
+        # bulk_update/update không phát post_save: tự làm mới cache sản phẩm và chỉ mục gợi ý (chỉ khi ẩn/hiện
+        # sản phẩm; tên không sửa được qua đây nên token tìm kiếm không đổi)
+        invalidate_products(ids)
+        if 'active' in fields:
+            typeahead.changed_many('product', ids)
+    metrics.increment('product_bulk_update.requests')
+    metrics.increment('product_bulk_update.rows', updated)
+    return updated
@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction, DEFAULT_DB_ALIAS
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Product, Like, ProductReview
+
+# Biểu diễn mặc định (ProductSerializer, không ?fields=/?expand=) của từng sản phẩm, dùng cho retrieve và batch.
+# Bị xoá khi sản phẩm, màu/kích thước, lượt thích hoặc đánh giá của nó thay đổi; thông tin shop/danh mục lồng
+# bên trong chỉ được làm mới khi hết PRODUCT_CACHE_TIMEOUT.
+PRODUCT_CACHE_KEY = 'shopping:product:%s'
+
+
+def product_cache_timeout():
+    return getattr(settings, 'PRODUCT_CACHE_TIMEOUT', 60)
+
+
+def cached_products(ids):
+    # id -> dữ liệu đã cache, chỉ gồm các id có trong cache
+    found = cache.get_many([PRODUCT_CACHE_KEY % pk for pk in ids])
+    return {pk: found[PRODUCT_CACHE_KEY % pk] for pk in ids if PRODUCT_CACHE_KEY % pk in found}
+
+
+def cache_products(items):
+    cache.set_many({PRODUCT_CACHE_KEY % item['id']: item for item in items}, product_cache_timeout())
+
+
+def load_products(ids, serializer_class):
+    # Sản phẩm chưa có trong cache được đọc từ primary (replica có thể chậm hơn lần ghi vừa xoá cache)
+    # trong một số truy vấn cố định rồi đưa vào cache. Không truyền request để luôn ra biểu diễn mặc định.
+    queryset = serializer_class.setup_queryset(Product.objects.using(DEFAULT_DB_ALIAS).filter(active = True,
+                                                                                               id__in = ids))
+    items = serializer_class(queryset, many = True).data
+    cache_products(items)
+    return {item['id']: item for item in items}
+
+
+def invalidate_products(ids):
+    keys = [PRODUCT_CACHE_KEY % pk for pk in ids if pk is not None]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+@receiver(post_save, sender = Product, dispatch_uid = 'shopping.cache.product_saved')
+@receiver(post_delete, sender = Product, dispatch_uid = 'shopping.cache.product_deleted')
+def product_changed(sender, instance, **kwargs):
+    invalidate_products([instance.pk])
+
+
+@receiver(m2m_changed, sender = Product.colors.through, dispatch_uid = 'shopping.cache.product_colors')
+@receiver(m2m_changed, sender = Product.sizes.through, dispatch_uid = 'shopping.cache.product_sizes')
+def product_options_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    invalidate_products((pk_set or ()) if reverse else [instance.pk])
+
+
+@receiver(post_save, sender = Like, dispatch_uid = 'shopping.cache.like_saved')
+@receiver(post_delete, sender = Like, dispatch_uid = 'shopping.cache.like_deleted')
+def like_changed(sender, instance, **kwargs):
+    invalidate_products([instance.product_id_id])
+
+
+@receiver(post_save, sender = ProductReview, dispatch_uid = 'shopping.cache.review_saved')
+@receiver(post_delete, sender = ProductReview, dispatch_uid = 'shopping.cache.review_deleted')
+def review_changed(sender, instance, **kwargs):
+    invalidate_products([instance.product_id])
@@ -0,0 +1,32 @@
+import logging
+
+from django.conf import settings
+from django.core import checks
+
+# Các tính năng chia sẻ trạng thái giữa worker qua cache: giới hạn tần suất, ghim primary theo user, làm mới cache
+# sản phẩm/lượt thích, phiên bản refdata, nhật ký thay đổi của chỉ mục gợi ý. Với cache trong process, mỗi worker
+# có hạn mức riêng (N worker = N lần hạn mức) và thay đổi ở worker này không làm mới cache của worker khác.
+LOCAL_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache')
+
+logger = logging.getLogger('shopping.checks')
+
+
+def local_cache_aliases():
+    aliases = {'default', getattr(settings, 'THROTTLE_CACHE', 'default')}
+    return sorted(alias for alias in aliases if settings.CACHES.get(alias, {}).get('BACKEND') in LOCAL_BACKENDS)
+
+
+def warn_local_caches():
+    # Gọi khi khởi động (apps.ready): chạy nhiều worker mà cache không dùng chung thì ghi cảnh báo
+    if settings.DEBUG:
+        return
+    for alias in local_cache_aliases():
+        logger.warning('Cache "%s" nằm trong từng process: giới hạn tần suất, ghim primary và làm mới cache không '
+                       'đúng khi chạy nhiều worker, cấu hình REDIS_URL', alias)
+
+
+@checks.register(checks.Tags.caches, deploy = True)
+def shared_cache_check(app_configs, **kwargs):
+    return [checks.Warning('Cache "%s" không dùng chung giữa các worker' % alias,
+                           hint = 'Đặt REDIS_URL (hoặc cấu hình CACHES với Redis/Memcached)', id = 'shopping.W001')
+            for alias in local_cache_aliases()]
@@ -0,0 +1,213 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import (Category, Product, User, Color, Size, Shop, Business, Like, ProductReview, Cart, CartDetail,
+                     Order, OrderDetail, Payment)
+
+# Số lượng bản ghi ở scale = 1
+BASE_COUNTS = {
+    'users': 1000,
+    'businesses': 20,
+    'products': 5000,
+    'likes': 20000,
+    'reviews': 10000,
+    'carts': 500,
+    'orders': 2000,
+}
+
+CATEGORIES = ['Áo', 'Quần', 'Váy', 'Giày', 'Túi xách', 'Phụ kiện', 'Đồng hồ', 'Mỹ phẩm', 'Điện thoại', 'Gia dụng']
+COLORS = ['Đỏ', 'Xanh dương', 'Xanh lá', 'Vàng', 'Đen', 'Trắng', 'Hồng', 'Tím', 'Cam', 'Xám']
+SIZES = ['XS', 'S', 'M', 'L', 'XL', 'XXL', '38', '39', '40', '41', '42']
+PRODUCT_NAMES = ['Áo thun', 'Áo sơ mi', 'Áo khoác', 'Quần jean', 'Quần short', 'Váy liền', 'Chân váy', 'Giày sneaker',
+                 'Giày cao gót', 'Dép', 'Túi tote', 'Balo', 'Ví da', 'Mũ lưỡi trai', 'Kính mát', 'Đồng hồ',
+                 'Son môi', 'Kem chống nắng', 'Ốp lưng', 'Tai nghe', 'Nồi chiên', 'Bình giữ nhiệt']
+ADJECTIVES = ['cao cấp', 'basic', 'oversize', 'unisex', 'hàn quốc', 'thể thao', 'công sở', 'mùa hè', 'vintage',
+              'chính hãng', 'giá rẻ', 'local brand']
+COMMENTS = ['Sản phẩm tốt', 'Giao hàng nhanh', 'Đúng mô tả', 'Chất lượng tạm ổn', 'Không giống hình',
+            'Sẽ ủng hộ tiếp', 'Đóng gói cẩn thận', 'Hơi nhỏ so với size']
+BATCH_SIZE = 1000
+
+
+def scaled_counts(scale = 1.0, **overrides):
+    counts = {name: max(1, int(value * scale)) for name, value in BASE_COUNTS.items()}
+    counts.update({name: value for name, value in overrides.items() if value is not None})
+    return counts
+
+
+def _next_id(model):
+    # bulk_create không trả về khoá chính trên MySQL nên tự cấp id liên tiếp
+    return (model.objects.aggregate(m = Max('id'))['m'] or 0) + 1
+
+
+def _bulk(model, objects):
+    model.objects.bulk_create(objects, batch_size = BATCH_SIZE)
+    return objects
+
+
+class DataGenerator:
+    def __init__(self, counts, seed = None, log = None):
+        self.counts = counts
+        self.random = random.Random(seed)
+        self.log = log or (lambda message: None)
+        self.now = timezone.now()
+
+    def run(self):
+        with transaction.atomic():
+            self.reference_data()
+            self.users()
+            self.businesses()
+            self.products()
+            self.likes()
+            self.reviews()
+            self.carts()
+            self.orders()
+        return self.counts
+
+    def past(self, days = 365):
+        return self.now - timedelta(seconds = self.random.randint(0, days * 24 * 3600))
+
+    def reference_data(self):
+        for name in ['User', 'Business']:
+            Group.objects.get_or_create(name = name)
+        self.categories = [Category.objects.get_or_create(name = name)[0] for name in CATEGORIES]
+        self.colors = [Color.objects.get_or_create(name = name)[0] for name in COLORS]
+        self.sizes = [Size.objects.get_or_create(name = name)[0] for name in SIZES]
+
+    def users(self):
+        password = make_password('password123')
+        start = _next_id(User)
+        self.user_ids = list(range(start, start + self.counts['users']))
+        _bulk(User, [User(id = pk, username = 'user%d' % pk, password = password, email = 'user%d@example.com' % pk,
+                          first_name = 'Khách', last_name = str(pk), is_active = True, date_joined = self.past())
+                     for pk in self.user_ids])
+        group = Group.objects.get(name = 'User')
+        _bulk(User.groups.through, [User.groups.through(user_id = pk, group_id = group.id) for pk in self.user_ids])
+        self.log('users: %d' % len(self.user_ids))
+
+    def businesses(self):
+        # Business kế thừa nhiều bảng từ User nên không bulk_create được, số lượng nhỏ nên tạo từng bản ghi
+        password = make_password('password123')
+        group = Group.objects.get(name = 'Business')
+        start = _next_id(User)
+        self.shops = []
+        for pk in range(start, start + self.counts['businesses']):
+            business = Business.objects.create(id = pk, username = 'business%d' % pk, password = password,
+                                               business_name = 'Doanh nghiệp %d' % pk, address = 'TP.HCM',
+                                               phone = '09%08d' % pk, tax_code = '03%08d' % pk,
+                                               status = 'confirmed', is_active = True)
+            business.groups.add(group)
+            self.shops.append(Shop(name = 'Shop %d' % pk, business = business, email = 'shop%d@example.com' % pk,
+                                   phone = '08%08d' % pk, address = 'TP.HCM'))
+        start = _next_id(Shop)
+        for i, shop in enumerate(self.shops):
+            shop.id = start + i
+        _bulk(Shop, self.shops)
+        self.log('businesses/shops: %d' % len(self.shops))
+
+    def products(self):
+        start = _next_id(Product)
+        products = []
+        for pk in range(start, start + self.counts['products']):
+            price = self.random.randint(5, 500) * 1000
+            products.append(Product(id = pk, name = '%s %s %d' % (self.random.choice(PRODUCT_NAMES),
+                                                                  self.random.choice(ADJECTIVES), pk),
+                                    quantity = self.random.randint(0, 500), price = price,
+                                    discount = self.random.choice([0, 0, 0, 5, 10, 20, 30, 50]),
+                                    thumbnail = 'shopping/2023/03/product-%d.jpg' % self.random.randint(1, 4),
+                                    category = self.random.choice(self.categories),
+                                    shop = self.random.choice(self.shops),
+                                    description = '<p>Mô tả sản phẩm %d</p>' % pk))
+        _bulk(Product, products)
+        self.products = products
+
+        color_links, size_links = [], []
+        for product in products:
+            for color in self.random.sample(self.colors, self.random.randint(1, 4)):
+                color_links.append(Product.colors.through(product_id = product.id, color_id = color.id))
+            for size in self.random.sample(self.sizes, self.random.randint(1, 4)):
+                size_links.append(Product.sizes.through(product_id = product.id, size_id = size.id))
+        _bulk(Product.colors.through, color_links)
+        _bulk(Product.sizes.through, size_links)
+        self.log('products: %d' % len(products))
+
+    def likes(self):
+        pairs = set()
+        target = min(self.counts['likes'], len(self.user_ids) * len(self.products))
+        while len(pairs) < target:
+            pairs.add((self.random.choice(self.user_ids), self.random.choice(self.products).id))
+        _bulk(Like, [Like(user_id_id = user_id, product_id_id = product_id, active = self.random.random() > 0.1)
+                     for user_id, product_id in pairs])
+        self.log('likes: %d' % len(pairs))
+
+    def reviews(self):
+        start = _next_id(ProductReview)
+        reviews = [ProductReview(id = pk, user_id = self.random.choice(self.user_ids),
+                                 product = self.random.choice(self.products), rating = self.random.randint(1, 5),
+                                 comment = self.random.choice(COMMENTS))
+                   for pk in range(start, start + self.counts['reviews'])]
+        _bulk(ProductReview, reviews)
+        # Khoảng 20% đánh giá có phản hồi
+        replies = [ProductReview(user_id = self.random.choice(self.user_ids), product_id = review.product_id,
+                                 parent_comment = review, rating = 0, comment = 'Cảm ơn bạn đã ủng hộ shop')
+                   for review in reviews if self.random.random() < 0.2]
+        _bulk(ProductReview, replies)
+        self.log('reviews: %d (+%d replies)' % (len(reviews), len(replies)))
+
+    def _line(self, product):
+        return {
+            'product': product,
+            'sizes': self.random.choice(self.sizes),
+            'colors': self.random.choice(self.colors),
+            'quantity': self.random.randint(1, 3),
+        }
+
+    def carts(self):
+        start = _next_id(Cart)
+        user_ids = self.random.sample(self.user_ids, min(self.counts['carts'], len(self.user_ids)))
+        carts = _bulk(Cart, [Cart(id = start + i, user_id = user_id) for i, user_id in enumerate(user_ids)])
+        details = []
+        for cart in carts:
+            for product in self.random.sample(self.products, self.random.randint(1, 5)):
+                details.append(CartDetail(cart = cart, **self._line(product)))
+        _bulk(CartDetail, details)
+        self.log('carts: %d (%d lines)' % (len(carts), len(details)))
+
+    def orders(self):
+        start = _next_id(Order)
+        statuses = [choice for choice, _ in Order.STATUS_CHOICES]
+        orders, lines, payments = [], [], []
+        for pk in range(start, start + self.counts['orders']):
+            user_id = self.random.choice(self.user_ids)
+            order_lines = [OrderDetail(order_id = pk, price = product.price, discount = product.discount,
+                                       **self._line(product))
+                           for product in self.random.sample(self.products, self.random.randint(1, 5))]
+            for line in order_lines:
+                line.product_name, line.product_thumbnail = line.product.name, str(line.product.thumbnail)
+                line.shop_id, line.shop_name = line.product.shop_id, line.product.shop.name
+                line.size_name, line.color_name = line.sizes.name, line.colors.name
+            total = sum(line.price * (100 - line.discount) // 100 * line.quantity for line in order_lines)
+            status = self.random.choice(statuses)
+            orders.append(Order(id = pk, user_id = user_id, name = 'Khách %d' % user_id,
+                                email = 'user%d@example.com' % user_id, phone = '09%08d' % user_id,
+                                address = 'Quận %d, TP.HCM' % self.random.randint(1, 12), total_amount = total,
+                                status = status,
+                                status_ship = self.random.choice([c for c, _ in Order.SHIPPING_CHOICES])))
+            payments.append(Payment(order_id = pk, user_id = user_id, total_amount = total,
+                                    payment_method = self.random.choice(Payment.PaymentMethod.values),
+                                    payment_status = Payment.PaymentStatus.IS_SUCCESS
+                                    if status in ['paid', 'shipped', 'delivered'] else Payment.PaymentStatus.IS_FAIL))
+            lines.extend(order_lines)
+        _bulk(Order, orders)
+        # created_date là auto_now_add nên cập nhật lại để đơn hàng trải đều trong năm
+        for order in orders:
+            order.created_date = self.past()
+        Order.objects.bulk_update(orders, ['created_date'], batch_size = BATCH_SIZE)
+        _bulk(OrderDetail, lines)
+        _bulk(Payment, payments)
+        self.log('orders: %d (%d lines, %d payments)' % (len(orders), len(lines), len(payments)))
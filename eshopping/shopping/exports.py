@@ -0,0 +1,233 @@
+import csv
+import re
+import zipfile
+from datetime import date, datetime, time
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import ArchivedOrderDetail, ArchivedPayment, Order, OrderDetail, Payment
+from .renderers import Echo
+
+# Xuất đơn hàng theo từng dòng sản phẩm (OrderDetail) kèm thông tin đơn và thanh toán, dạng CSV hoặc XLSX.
+# Dữ liệu được đọc theo khoá chính từng chunk (mỗi chunk một truy vấn dòng + một truy vấn thanh toán) và ghi ra
+# ngay, nên bộ nhớ không phụ thuộc số dòng và response bắt đầu trả dữ liệu ngay, không bị timeout khi xuất lâu.
+# Đơn đã lưu trữ (shopping/archive.py) được đọc tiếp sau đơn đang hoạt động, cùng cột và cùng bộ lọc.
+COLUMNS = [
+    ('order_id', 'Mã đơn'),
+    ('order__created_date', 'Ngày đặt'),
+    ('order__status', 'Trạng thái'),
+    ('order__status_ship', 'Giao hàng'),
+    ('order__name', 'Người đặt'),
+    ('order__email', 'Email'),
+    ('order__phone', 'Điện thoại'),
+    ('order__address', 'Địa chỉ'),
+    ('order__total_amount', 'Tổng đơn'),
+    ('shop_id', 'Mã shop'),
+    ('shop_name', 'Shop'),
+    ('product_id', 'Mã sản phẩm'),
+    ('product_name', 'Sản phẩm'),
+    ('size_name', 'Kích thước'),
+    ('color_name', 'Màu'),
+    ('price', 'Đơn giá'),
+    ('discount', 'Giảm giá (%)'),
+    ('quantity', 'Số lượng'),
+]
+PAYMENT_COLUMNS = [('payment_method', 'Thanh toán'), ('payment_status', 'Trạng thái thanh toán')]
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+STATUSES = [value for value, _ in Order.STATUS_CHOICES]
+# (bảng dòng đơn, bảng thanh toán): bảng đang hoạt động trước, bảng lưu trữ sau. Lưu trữ giữ nguyên khoá chính
+# và chỉ chuyển đơn từ bảng đầu sang bảng sau, nên đơn được lưu trữ trong lúc xuất không bị thiếu (có thể lặp lại)
+SOURCES = [(OrderDetail, Payment), (ArchivedOrderDetail, ArchivedPayment)]
+
+
+def export_chunk_size():
+    return getattr(settings, 'ORDER_EXPORT_CHUNK_SIZE', 2000)
+
+
+def headers():
+    return [label for _, label in COLUMNS + PAYMENT_COLUMNS]
+
+
+def parse_filters(params):
+    # params: dict-like (query string hoặc tuỳ chọn của lệnh); trả về (bộ lọc, lỗi)
+    filters, errors = {}, {}
+    shops = [s for s in str(params.get('shop') or '').split(',') if s]
+    if shops:
+        if all(s.isdigit() for s in shops):
+            filters['shops'] = [int(s) for s in shops]
+        else:
+            errors['shop'] = 'Mã shop phải là số'
+    for name in ('from', 'to'):
+        value = params.get(name)
+        if value:
+            try:
+                filters[name] = value if isinstance(value, date) else parse_date(value)
+            except ValueError:
+                filters[name] = None
+            if filters[name] is None:
+                errors[name] = 'Ngày phải có dạng YYYY-MM-DD'
+    statuses = [s for s in str(params.get('status') or '').split(',') if s]
+    if statuses:
+        if set(statuses) <= set(STATUSES):
+            filters['statuses'] = statuses
+        else:
+            errors['status'] = 'Trạng thái phải thuộc %s' % STATUSES
+    return filters, errors
+
+
+def line_queryset(filters, model = OrderDetail):
+    queryset = model.objects.filter(order__isnull = False)
+    if 'shops' in filters:
+        # Shop lúc đặt hàng (snapshot trên dòng đơn), không phải shop hiện tại của sản phẩm
+        queryset = queryset.filter(shop_id__in = filters['shops'])
+    # Khoảng ngày tính theo múi giờ của site, 'to' bao gồm cả ngày cuối
+    tz = timezone.get_current_timezone()
+    if filters.get('from'):
+        queryset = queryset.filter(order__created_date__gte = datetime.combine(filters['from'], time.min, tz))
+    if filters.get('to'):
+        queryset = queryset.filter(order__created_date__lte = datetime.combine(filters['to'], time.max, tz))
+    if filters.get('statuses'):
+        queryset = queryset.filter(order__status__in = filters['statuses'])
+    return queryset
+
+
+def iter_rows(filters, chunk_size = None):
+    # Sinh từng chunk (danh sách dòng) theo thứ tự khoá chính của từng bảng trong SOURCES
+    chunk_size = chunk_size or export_chunk_size()
+    fields = [name for name, _ in COLUMNS]
+    for line_model, payment_model in SOURCES:
+        rows = line_queryset(filters, line_model).order_by('pk').values_list('pk', *fields)
+        last = None
+        while True:
+            chunk = list((rows if last is None else rows.filter(pk__gt = last))[:chunk_size])
+            if not chunk:
+                break
+            last = chunk[-1][0]
+            # Mỗi đơn thường chỉ có một Payment; đọc riêng để dòng sản phẩm không bị nhân bản khi có nhiều Payment
+            payments = {}
+            for order_id, method, payment_status in payment_model.objects.filter(
+                    order_id__in = {row[1] for row in chunk}).order_by('id').values_list(
+                    'order_id', 'payment_method', 'payment_status'):
+                payments[order_id] = (method, payment_status)
+            # Tên sản phẩm, mã và tên shop, kích thước, màu là snapshot lúc đặt hàng (shopping/snapshots.py)
+            yield [list(row[1:]) + list(payments.get(row[1], (None, None))) for row in chunk]
+
+
+def iter_csv(filters, chunk_size = None):
+    writer = csv.writer(Echo())
+    # BOM để Excel mở đúng tiếng Việt
+    yield ('\ufeff' + writer.writerow(headers())).encode('utf-8')
+    for chunk in iter_rows(filters, chunk_size):
+        yield ''.join(writer.writerow([format_value(v) for v in row]) for row in chunk).encode('utf-8')
+
+
+def format_value(value):
+    if isinstance(value, datetime):
+        return timezone.localtime(value).strftime('%Y-%m-%d %H:%M:%S') if timezone.is_aware(value) \
+            else value.strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+
+# XLSX là file zip gồm vài file XML. zipfile ghi được vào stream không seek (dùng data descriptor) nên sheet được
+# nén và trả ra dần theo từng chunk; ô chữ dùng inline string để không phải giữ bảng sharedStrings trong bộ nhớ.
+XLSX_PARTS = {
+    '[Content_Types].xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>',
+    '_rels/.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>',
+    'xl/workbook.xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Orders" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>',
+    'xl/_rels/workbook.xml.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>',
+}
+SHEET_HEAD = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+              '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+SHEET_TAIL = '</sheetData></worksheet>'
+# Ký tự điều khiển không được phép trong XML
+INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+class ChunkBuffer:
+    # Đích ghi của zipfile: gom các byte đã nén để generator lấy ra sau mỗi chunk
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def xlsx_cell(value):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, bool):
+        return '<c t="b"><v>%d</v></c>' % value
+    if isinstance(value, (int, float)):
+        return '<c><v>%s</v></c>' % value
+    text = INVALID_XML_CHARS.sub('', str(format_value(value)))
+    return '<c t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>' % escape(text)
+
+
+def xlsx_row(values):
+    return '<row>%s</row>' % ''.join(xlsx_cell(v) for v in values)
+
+
+def iter_xlsx(filters, chunk_size = None):
+    buffer = ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_PARTS.items():
+            archive.writestr(name, content)
+        # force_zip64: kích thước sheet chưa biết trước và có thể vượt 4GB
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64 = True) as sheet:
+            sheet.write((SHEET_HEAD + xlsx_row(headers())).encode('utf-8'))
+            for chunk in iter_rows(filters, chunk_size):
+                sheet.write(''.join(xlsx_row(row) for row in chunk).encode('utf-8'))
+                data = buffer.take()
+                if data:
+                    yield data
+            sheet.write(SHEET_TAIL.encode('utf-8'))
+    yield buffer.take()
+
+
+def iter_export(fmt, filters, chunk_size = None):
+    return iter_xlsx(filters, chunk_size) if fmt == 'xlsx' else iter_csv(filters, chunk_size)
+
+
+def export_filename(fmt):
+    return 'orders-%s.%s' % (timezone.localtime().strftime('%Y%m%d-%H%M%S'), fmt)
@@ -0,0 +1,234 @@
+import hashlib
+import os
+import tempfile
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponseBadRequest, HttpResponseNotModified
+from django.urls import reverse
+from django.views.decorators.http import require_GET
+from PIL import Image, ImageOps
+
+from . import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ khoá trong process
+    fcntl = None
+
+# Ảnh sản phẩm/avatar theo chiều rộng và định dạng yêu cầu: /images/<đường dẫn trong MEDIA_ROOT>?w=320&fmt=webp.
+# Ảnh đã resize được lưu trên đĩa (IMAGE_CACHE_DIR), khoá theo hash nội dung ảnh gốc + tham số, và bị xoá theo
+# thứ tự dùng lâu nhất khi tổng dung lượng vượt IMAGE_CACHE_MAX_BYTES. File upload không bao giờ bị ghi đè nên
+# URL được cache lâu dài ở trình duyệt/CDN.
+FORMATS = {'webp': ('WEBP', 'image/webp'), 'jpeg': ('JPEG', 'image/jpeg'), 'png': ('PNG', 'image/png')}
+SOURCE_FORMATS = {'JPEG': 'jpeg', 'PNG': 'png', 'WEBP': 'webp'}
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def allowed_widths():
+    return getattr(settings, 'IMAGE_WIDTHS', (64, 128, 256, 320, 480, 640, 960, 1280))
+
+
+def source_dirs():
+    return getattr(settings, 'IMAGE_SOURCE_DIRS', ('shopping/', 'avatar/'))
+
+
+def cache_dir():
+    return str(getattr(settings, 'IMAGE_CACHE_DIR', os.path.join(settings.BASE_DIR, 'image_cache')))
+
+
+def cache_max_bytes():
+    return getattr(settings, 'IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+
+
+def image_quality():
+    return getattr(settings, 'IMAGE_QUALITY', 80)
+
+
+def image_url(name, width):
+    # URL ảnh đã resize cho giá trị của ImageField: ảnh trên Cloudinary dùng transformation của Cloudinary
+    name = str(name or '')
+    if name.startswith(('http://', 'https://')):
+        if '/upload/' in name:
+            return name.replace('/upload/', '/upload/w_%d,c_limit,f_auto/' % width, 1)
+        return name
+    return '%s?w=%d' % (reverse('resized-image', args = [name]), width)
+
+
+def source_path(name):
+    root = os.path.realpath(settings.MEDIA_ROOT)
+    path = os.path.realpath(os.path.join(root, name))
+    if not path.startswith(root + os.sep) or not name.startswith(tuple(source_dirs())) or not os.path.isfile(path):
+        raise Http404
+    return path
+
+
+@lru_cache(maxsize = 4096)
+def _digest(path, mtime_ns, size):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def source_digest(path):
+    # Hash nội dung chỉ tính lại khi file đổi (mtime/kích thước)
+    st = os.stat(path)
+    return _digest(path, st.st_mtime_ns, st.st_size)
+
+
+def variant_key(digest, width, fmt):
+    return hashlib.sha256(('%s:%d:%s:%d' % (digest, width, fmt, image_quality())).encode()).hexdigest()
+
+
+def variant_path(key, fmt):
+    return os.path.join(cache_dir(), key[:2], '%s.%s' % (key, fmt))
+
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+class VariantLock:
+    # Chỉ một request resize cho mỗi biến thể: khoá theo key trong process và flock trên file giữa các worker
+    def __init__(self, key):
+        self.key = key
+        self.path = os.path.join(cache_dir(), key[:2], '%s.lock' % key)
+        self.file = None
+        os.makedirs(os.path.dirname(self.path), exist_ok = True)
+
+    def __enter__(self):
+        with _locks_guard:
+            lock, users = _locks.get(self.key, (None, 0))
+            lock = lock or threading.Lock()
+            _locks[self.key] = (lock, users + 1)
+        lock.acquire()
+        if fcntl is not None:
+            self.file = open(self.path, 'a')
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+        with _locks_guard:
+            lock, users = _locks[self.key]
+            if users == 1:
+                del _locks[self.key]
+            else:
+                _locks[self.key] = (lock, users - 1)
+        lock.release()
+
+
+def resize(path, width, fmt, target):
+    # Ghi ra file tạm cùng thư mục rồi os.replace: request khác không bao giờ đọc phải file đang ghi dở
+    image_format = FORMATS[fmt][0]
+    with Image.open(path) as image:
+        # JPEG được giải mã thẳng ở tỉ lệ nhỏ hơn (1/2, 1/4, 1/8) khi ảnh gốc lớn hơn nhiều so với kích thước cần
+        image.draft('RGB', (width, max(1, image.height * width // image.width)))
+        image = ImageOps.exif_transpose(image)
+        if image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        if image_format == 'JPEG' and image.mode != 'RGB':
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+            image = image.convert('RGBA')
+        options = {'optimize': True} if image_format == 'PNG' else {'quality': image_quality()}
+        buffer = tempfile.NamedTemporaryFile(delete = False, dir = os.path.dirname(target), suffix = '.tmp')
+        try:
+            with buffer:
+                image.save(buffer, image_format, **options)
+            os.replace(buffer.name, target)
+        except Exception:
+            os.unlink(buffer.name)
+            raise
+
+
+def evict(keep = None, limit = None):
+    # Xoá file dùng lâu nhất (mtime được cập nhật mỗi lần đọc) tới khi tổng dung lượng còn 90% giới hạn;
+    # keep: file vừa resize, không bao giờ bị xoá ngay
+    limit = cache_max_bytes() if limit is None else limit
+    entries = []
+    total = 0
+    for sub in os.scandir(cache_dir()):
+        if not sub.is_dir():
+            continue
+        for entry in os.scandir(sub.path):
+            if entry.name.endswith(('.lock', '.tmp')) or entry.path == keep:
+                continue
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+    if total <= limit:
+        return 0
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= limit * 0.9:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            continue
+        lock = os.path.splitext(path)[0] + '.lock'
+        if os.path.exists(lock):
+            os.unlink(lock)
+        total -= size
+        removed += 1
+    metrics.increment('image_cache.evicted', removed)
+    return removed
+
+
+def get_variant(name, width, fmt = None):
+    # Trả về (đường dẫn file, định dạng, key); resize nếu chưa có trong cache
+    path = source_path(name)
+    if fmt is None:
+        with Image.open(path) as image:
+            fmt = SOURCE_FORMATS.get(image.format, 'png')
+    key = variant_key(source_digest(path), width, fmt)
+    cached = variant_path(key, fmt)
+    if os.path.exists(cached):
+        metrics.increment('image_cache.hit')
+    else:
+        with VariantLock(key):
+            # Request chờ khoá dùng luôn kết quả của request đã resize trước đó
+            if os.path.exists(cached):
+                metrics.increment('image_cache.hit')
+            else:
+                metrics.increment('image_cache.miss')
+                resize(path, width, fmt, cached)
+                evict(keep = cached)
+                return cached, fmt, key
+    try:
+        os.utime(cached)
+    except FileNotFoundError:  # vừa bị evict ở process khác
+        return get_variant(name, width, fmt)
+    return cached, fmt, key
+
+
+@require_GET
+def resized_image(request, name):
+    try:
+        width = int(request.GET.get('w', ''))
+    except ValueError:
+        return HttpResponseBadRequest('w phải là một trong %s' % list(allowed_widths()))
+    fmt = request.GET.get('fmt') or None
+    if width not in allowed_widths() or (fmt is not None and fmt not in FORMATS):
+        # Chỉ nhận các kích thước/định dạng cố định để số biến thể trong cache có giới hạn
+        return HttpResponseBadRequest('w phải là một trong %s, fmt là một trong %s' % (list(allowed_widths()),
+                                                                                   list(FORMATS)))
+    path, fmt, key = get_variant(name, width, fmt)
+    etag = '"%s"' % key
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+    else:
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:  # worker khác vừa evict
+            file = open(get_variant(name, width, fmt)[0], 'rb')
+        response = FileResponse(file, content_type = FORMATS[fmt][1])
+    response['ETag'] = etag
+    response['Cache-Control'] = CACHE_CONTROL
+    return response
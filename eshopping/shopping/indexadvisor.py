@@ -0,0 +1,221 @@
+import re
+from collections import OrderedDict
+
+from django.apps import apps
+from django.db import connections, models
+
+# Tham chiếu cột dạng "bảng"."cột" hoặc alias."cột" (U0."product_id"), MySQL dùng dấu `
+_COLUMN = r'(?:[`"](?P<table>\w+)[`"]|(?P<alias>\w+))\.[`"](?P<column>\w+)[`"]'
+_PREDICATE = re.compile(_COLUMN + r'\s*(?P<op>=|IN\b|>=|<=|>|<|BETWEEN\b|LIKE\b|IS\b)', re.I)
+# Lọc boolean trên SQLite/MySQL được sinh ra dạng ("shopping_product"."active" AND ...)
+# (không tính đối số hàm SUM("...") và vế phải của phép so sánh = ("shopping_product"."id"))
+_BARE_BOOLEAN = re.compile(r'(?:WHERE|AND|OR|(?<![=<>]\s)(?<![=<>\w])\()\s*' + _COLUMN + r'\s*(?=AND\b|OR\b|\))',
+                           re.I)
+_TABLE_ALIAS = re.compile(r'(?:FROM|JOIN)\s+[`"](?P<table>\w+)[`"](?:\s+(?:AS\s+)?(?P<alias>(?!ON\b|WHERE\b|INNER\b|LEFT\b|'
+                          r'ORDER\b|GROUP\b|LIMIT\b)\w+))?', re.I)
+_ORDER_BY = re.compile(r'ORDER BY\s+(?P<terms>.+?)(?:\s+LIMIT\b|\s+OFFSET\b|\)|$)', re.I | re.S)
+_ORDER_TERM = re.compile(_COLUMN + r'(?:\s+(?:ASC|DESC))?', re.I)
+# Vế phải là một cột khác: điều kiện JOIN, đã được index khoá ngoại phục vụ. Trong subquery tương quan
+# (U0."product_id" = ("shopping_product"."id")) vế phải cố định với mỗi dòng ngoài nên vẫn tính là so sánh bằng
+_JOIN_OPERAND = re.compile(r'\s*\(?\s*' + _COLUMN.replace('?P<', '?P<rhs_'))
+
+EQUALITY = ('=', 'IN', 'IS')
+RANGE = ('>=', '<=', '>', '<', 'BETWEEN', 'LIKE')
+
+
+def model_for_table(table):
+    for model in apps.get_models():
+        if model._meta.db_table == table:
+            return model
+    return None
+
+
+def field_for_column(model, column):
+    for field in model._meta.concrete_fields:
+        if field.column == column:
+            return field
+    return None
+
+
+class QueryPattern:
+    # Các cột được lọc bằng (equality), lọc theo khoảng (range) và sắp xếp (order) của từng bảng trong một câu SQL
+    def __init__(self, sql, params = ()):
+        self.sql = sql
+        self.params = params
+        self.aliases = []
+        self.tables = OrderedDict()
+        self.parse()
+
+    def table_entry(self, table):
+        return self.tables.setdefault(table, {'equality': [], 'range': [], 'order': []})
+
+    def resolve(self, match):
+        # Các subquery của Django đều đặt alias U0, U1...: lấy định nghĩa alias gần nhất phía trước
+        if match.group('table'):
+            return match.group('table')
+        table = None
+        for position, alias, aliased in self.aliases:
+            if position > match.start():
+                break
+            if alias == match.group('alias'):
+                table = aliased
+        return table
+
+    def parse(self):
+        for match in _TABLE_ALIAS.finditer(self.sql):
+            if match.group('alias'):
+                self.aliases.append((match.start(), match.group('alias'), match.group('table')))
+            self.table_entry(match.group('table'))
+        like_params = iter([p for p in self.params if isinstance(p, str)])
+        for match in _PREDICATE.finditer(self.sql):
+            table, column, op = self.resolve(match), match.group('column'), match.group('op').upper()
+            if table is None or (match.group('table') and _JOIN_OPERAND.match(self.sql, match.end())):
+                continue
+            entry = self.table_entry(table)
+            if op == 'LIKE':
+                # LIKE '%abc%' không dùng được index, chỉ LIKE 'abc%' mới là range
+                pattern = next(like_params, '')
+                if pattern.startswith('%'):
+                    continue
+            kind = 'equality' if op in EQUALITY else 'range'
+            if column not in entry[kind]:
+                entry[kind].append(column)
+        for match in _BARE_BOOLEAN.finditer(self.sql):
+            table = self.resolve(match)
+            if table is not None and match.group('column') not in self.table_entry(table)['equality']:
+                self.table_entry(table)['equality'].append(match.group('column'))
+        for order in _ORDER_BY.finditer(self.sql):
+            for match in _ORDER_TERM.finditer(self.sql, order.start('terms'), order.end('terms')):
+                table = self.resolve(match)
+                if table is not None and match.group('column') not in self.table_entry(table)['order']:
+                    self.table_entry(table)['order'].append(match.group('column'))
+
+    def candidate_columns(self, table, pk = None):
+        # Trả về (cột so sánh bằng, cột đi sau): các cột so sánh bằng đứng trước theo thứ tự bất kỳ (xếp theo tên
+        # để các truy vấn giống nhau gộp được), sau đó là một cột range hoặc các cột ORDER BY.
+        # Lọc theo khoá chính thì đã tối ưu; khoá chính ở cuối bị bỏ vì index phụ nào cũng đã chứa nó
+        entry = self.tables.get(table)
+        if not entry or pk in entry['equality']:
+            return [], []
+        equality = sorted(entry['equality'])
+        tail = [c for c in entry['order'] if c not in equality]
+        if not tail:
+            tail = [c for c in entry['range'] if c not in equality][:1]
+        while tail and tail[-1] == pk:
+            tail.pop()
+        return equality, tail
+
+
+def explain(alias, sql, params):
+    # Trả về (các dòng kế hoạch dạng chuỗi, bảng bị quét toàn bộ, có sắp xếp tạm hay không)
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            rows = [row[-1] for row in cursor.fetchall()]
+            scans = [m.group(1) for m in (re.match(r'SCAN (?:TABLE )?(\w+)', row) for row in rows)
+                     if m and 'USING' not in m.string.upper()]
+            sorts = any('TEMP B-TREE' in row for row in rows)
+        else:
+            cursor.execute('EXPLAIN ' + sql, params)
+            columns = [c[0] for c in cursor.description]
+            records = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            rows = ['%s type=%s key=%s rows=%s %s' % (r.get('table'), r.get('type'), r.get('key'), r.get('rows'),
+                                                      r.get('Extra') or '') for r in records]
+            scans = [r.get('table') for r in records if r.get('type') == 'ALL']
+            sorts = any('filesort' in (r.get('Extra') or '') for r in records)
+    return rows, [connection.introspection.identifier_converter(s) for s in scans], sorts
+
+
+def existing_indexes(alias, table):
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+    return [c['columns'] for c in constraints.values() if c['columns'] and (c['index'] or c['primary_key']
+                                                                           or c['unique'])]
+
+
+def is_covered(equality, tail, indexes):
+    # Đã có index bắt đầu bằng các cột so sánh bằng (thứ tự bất kỳ) rồi đến đúng các cột đi sau
+    size = len(equality)
+    return any(set(index[:size]) == set(equality) and list(index[size:size + len(tail)]) == list(tail)
+               for index in indexes)
+
+
+class Proposal:
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+        self.weight_ms = 0.0
+        self.count = 0
+        self.shapes = []
+        self.scan = False
+        self.sort = False
+        self.index = models.Index(fields = fields, name = '')
+        self.index.set_name_with_model(model)
+
+    def meta_snippet(self):
+        return "models.Index(fields = [%s], name = '%s')" % (', '.join("'%s'" % f for f in self.fields),
+                                                            self.index.name)
+
+
+def advise(shapes, top = 20, min_columns = 1):
+    # shapes: kết quả của workload.load(). Trả về (báo cáo từng hình dạng, danh sách Proposal theo trọng số)
+    heaviest = sorted(shapes.items(), key = lambda item: item[1]['total_ms'], reverse = True)[:top]
+    proposals = OrderedDict()
+    report = []
+    index_cache = {}
+    for shape, entry in heaviest:
+        alias = entry.get('alias') or 'default'
+        pattern = QueryPattern(entry['sql'], entry.get('params') or ())
+        try:
+            plan, scans, sort = explain(alias, entry['sql'], entry.get('params') or ())
+        except Exception as e:  # câu mẫu có thể không chạy lại được (bảng tạm, tham số không còn hợp lệ)
+            plan, scans, sort = ['EXPLAIN failed: %s' % e], [], False
+        item = {'shape': shape, 'count': entry['count'], 'total_ms': entry['total_ms'], 'plan': plan,
+                'proposals': []}
+        report.append(item)
+        for table in pattern.tables:
+            model = model_for_table(table)
+            if model is None:
+                continue
+            equality, tail = pattern.candidate_columns(table, model._meta.pk.column)
+            columns = equality + tail
+            if len(columns) < min_columns:
+                continue
+            if (alias, table) not in index_cache:
+                index_cache[(alias, table)] = existing_indexes(alias, table)
+            if is_covered(equality, tail, index_cache[(alias, table)]):
+                continue
+            fields = [field_for_column(model, column) for column in columns]
+            if any(field is None for field in fields):
+                continue
+            key = (model._meta.label, tuple(field.name for field in fields))
+            proposal = proposals.get(key)
+            if proposal is None:
+                proposal = proposals[key] = Proposal(model, [field.name for field in fields])
+            proposal.weight_ms += entry['total_ms']
+            proposal.count += entry['count']
+            proposal.shapes.append(shape)
+            proposal.scan = proposal.scan or table in scans
+            proposal.sort = proposal.sort or (sort and bool(pattern.tables[table]['order']))
+            item['proposals'].append(proposal)
+    return report, merge_prefixes(sorted(proposals.values(), key = lambda p: p.weight_ms, reverse = True))
+
+
+def merge_prefixes(proposals):
+    # Bỏ đề xuất là tiền tố của một đề xuất khác trên cùng model: index dài hơn phục vụ được cả hai
+    kept = []
+    for proposal in proposals:
+        wider = [other for other in proposals if other is not proposal and other.model is proposal.model
+                 and len(other.fields) > len(proposal.fields)
+                 and other.fields[:len(proposal.fields)] == proposal.fields]
+        if wider:
+            target = wider[0]
+            target.weight_ms += proposal.weight_ms
+            target.count += proposal.count
+            target.shapes.extend(proposal.shapes)
+            target.scan = target.scan or proposal.scan
+            continue
+        kept.append(proposal)
+    return sorted(kept, key = lambda p: p.weight_ms, reverse = True)
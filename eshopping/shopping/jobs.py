@@ -0,0 +1,152 @@
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+
+from . import metrics
+from .models import Job
+
+# Hàng đợi việc chạy nền nằm ngay trong DB, không cần broker. enqueue() ghi một dòng Job trong transaction hiện tại
+# nên việc chỉ tồn tại (và chỉ được chạy) khi transaction của request commit. Worker run_jobs nhận các việc tới hạn
+# theo lô: trên MySQL bằng SELECT ... FOR UPDATE SKIP LOCKED, trên SQLite bằng UPDATE có điều kiện cho từng việc.
+# Việc đang chạy được giữ bằng lease (run_at lùi JOB_LEASE_SECONDS): worker chết giữa chừng thì việc tự tới hạn lại.
+# Lỗi thì thử lại theo backoff, quá max_attempts thì chuyển sang DEAD; việc xong bị xoá để bảng luôn nhỏ.
+# Một việc có thể chạy lại (thử lại, lease hết hạn) nên task phải idempotent.
+# Outbox thông báo đơn (notifications.py) và callback thanh toán (payments.py) không chạy qua hàng đợi này: mỗi dòng
+# OrderNotification/PaymentCallback đã là một việc có trạng thái riêng và là lịch sử gửi/áp dụng, được nhận theo lô
+# để gửi trên một kết nối SMTP và áp dụng cả lô callback trong một transaction. Chuyển sang Job sẽ ghi thêm một
+# dòng Job cho mỗi dòng outbox và tách lô thành từng việc riêng.
+TASKS = {}
+
+logger = logging.getLogger('shopping.jobs')
+
+
+def job_setting(name, default):
+    return getattr(settings, 'JOB_%s' % name, default)
+
+
+def task(name = None, queue = 'default', max_attempts = None):
+    # @task(): đăng ký hàm làm task; module chứa task phải được import khi khởi động (apps.ready)
+    def register(func):
+        task_name = name or '%s.%s' % (func.__module__, func.__name__)
+        TASKS[task_name] = (func, queue, max_attempts)
+        func.task_name = task_name
+        return func
+
+    return register
+
+
+def enqueue(name, args = (), kwargs = None, run_at = None, delay = None, queue = None, max_attempts = None):
+    # name: tên task hoặc hàm đã đăng ký; delay (giây) hoặc run_at để hẹn giờ chạy
+    name = getattr(name, 'task_name', name)
+    if name not in TASKS:
+        raise ValueError('Task chưa được đăng ký: %s' % name)
+    _, default_queue, default_max_attempts = TASKS[name]
+    if run_at is None:
+        run_at = timezone.now() + timedelta(seconds = delay or 0)
+    job = Job.objects.create(queue = queue or default_queue, name = name,
+                             payload = {'args': list(args), 'kwargs': kwargs or {}}, run_at = run_at,
+                             max_attempts = max_attempts or default_max_attempts or job_setting('MAX_ATTEMPTS', 5))
+    metrics.increment('jobs.enqueued')
+    return job
+
+
+def retry_delay(attempts):
+    # Backoff nhân đôi mỗi lần lỗi, lệch ngẫu nhiên ±20% để các việc cùng lỗi không tới hạn lại cùng lúc
+    base = job_setting('RETRY_BASE_SECONDS', 10)
+    delay = min(base * 2 ** (attempts - 1), job_setting('RETRY_MAX_SECONDS', 3600))
+    return timedelta(seconds = delay * random.uniform(0.8, 1.2))
+
+
+def due_jobs(queues, now):
+    # Việc đang chờ tới hạn và việc đang chạy đã hết lease
+    return Job.objects.filter(queue__in = queues, state__in = [Job.JobState.PENDING, Job.JobState.RUNNING],
+                              run_at__lte = now).order_by('run_at')
+
+
+def claim(queues, batch_size):
+    now = timezone.now()
+    lease = now + timedelta(seconds = job_setting('LEASE_SECONDS', 300))
+    claimed = {'state': Job.JobState.RUNNING, 'run_at': lease, 'attempts': F('attempts') + 1}
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            # Nhiều worker chạy song song: mỗi worker bỏ qua các dòng worker khác đang nhận
+            ids = list(due_jobs(queues, now).select_for_update(skip_locked = True)
+                       .values_list('id', flat = True)[:batch_size])
+            if ids:
+                Job.objects.filter(id__in = ids).update(**claimed)
+    else:
+        # Không có SKIP LOCKED (SQLite): nhận từng việc bằng UPDATE có điều kiện trên run_at cũ, worker khác đã
+        # nhận trước thì run_at đã đổi và UPDATE không khớp dòng nào
+        ids = [pk for pk, run_at in due_jobs(queues, now).values_list('id', 'run_at')[:batch_size]
+               if Job.objects.filter(id = pk, run_at = run_at).update(**claimed)]
+    if not ids:
+        return []
+    return list(Job.objects.filter(id__in = ids).order_by('id'))
+
+
+def run_job(job):
+    # Trả về 'succeeded', 'retried' hoặc 'dead'. Chỉ ghi kết quả khi việc vẫn thuộc lease của worker này (run_at
+    # không đổi): lease đã hết và worker khác nhận lại thì để worker đó ghi
+    mine = Job.objects.filter(id = job.id, run_at = job.run_at)
+    try:
+        if job.attempts > job.max_attempts:
+            # Worker chết khi đang chạy việc này nhiều lần liền: không chạy thêm
+            raise RuntimeError('Hết lease quá %d lần' % job.max_attempts)
+        if job.name not in TASKS:
+            raise LookupError('Task chưa được đăng ký: %s' % job.name)
+        TASKS[job.name][0](*job.payload.get('args', []), **job.payload.get('kwargs', {}))
+    except Exception as e:
+        logger.warning('Việc %s (%s) lỗi lần %d: %s', job.pk, job.name, job.attempts, e)
+        now = timezone.now()
+        error = traceback.format_exc()[-4000:]
+        if job.attempts >= job.max_attempts:
+            mine.update(state = Job.JobState.DEAD, last_error = error, finished_date = now)
+            return 'dead'
+        mine.update(state = Job.JobState.PENDING, last_error = error, run_at = now + retry_delay(job.attempts))
+        return 'retried'
+    mine.delete()
+    return 'succeeded'
+
+
+def process_batch(queues = ('default',), batch_size = 10):
+    # Trả về số việc đã nhận và thống kê kết quả
+    jobs = claim(queues, batch_size)
+    stats = {}
+    for job in jobs:
+        result = run_job(job)
+        stats[result] = stats.get(result, 0) + 1
+    for name, value in stats.items():
+        metrics.increment('jobs.%s' % name, value)
+    return len(jobs), stats
+
+
+def depth():
+    # Độ sâu từng hàng đợi: số việc chờ, đã tới hạn, đang chạy, DEAD và số giây việc tới hạn lâu nhất đã phải chờ
+    now = timezone.now()
+    pending, running = Q(state = Job.JobState.PENDING), Q(state = Job.JobState.RUNNING)
+    rows = Job.objects.values('queue').annotate(
+        pending = Count('id', filter = pending), due = Count('id', filter = pending & Q(run_at__lte = now)),
+        running = Count('id', filter = running), dead = Count('id', filter = Q(state = Job.JobState.DEAD)),
+        oldest_due = Min('run_at', filter = pending & Q(run_at__lte = now))).order_by('queue')
+    result = {}
+    for row in rows:
+        oldest = row.pop('oldest_due')
+        row['lag_seconds'] = round((now - oldest).total_seconds(), 1) if oldest else 0
+        result[row.pop('queue')] = row
+    return result
+
+
+def requeue_dead(ids = None, queue = None):
+    # Đưa các việc DEAD (đã sửa lỗi) về hàng đợi với số lần thử mới
+    queryset = Job.objects.filter(state = Job.JobState.DEAD)
+    if ids is not None:
+        queryset = queryset.filter(id__in = ids)
+    if queue is not None:
+        queryset = queryset.filter(queue = queue)
+    return queryset.update(state = Job.JobState.PENDING, attempts = 0, run_at = timezone.now(), finished_date = None)
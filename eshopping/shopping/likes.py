@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, When, Value
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache import invalidate_products
+from .models import Like
+
+LIKED_CACHE_KEY = 'shopping:liked:%s'
+
+
+def liked_cache_timeout():
+    return getattr(settings, 'LIKED_IDS_CACHE_TIMEOUT', 300)
+
+
+def liked_product_ids(user):
+    # Tập id sản phẩm user đang thích: một truy vấn cho cả trang danh sách, cache theo user tới khi user bấm thích
+    key = LIKED_CACHE_KEY % user.pk
+    ids = cache.get(key)
+    if ids is None:
+        ids = set(Like.objects.filter(user_id = user, active = True).values_list('product_id', flat = True))
+        cache.set(key, ids, liked_cache_timeout())
+    return ids
+
+
+def invalidate_liked(user_id):
+    # Xoá sau khi commit để request khác không nạp lại trạng thái cũ vào cache trong lúc transaction chưa xong
+    transaction.on_commit(lambda: cache.delete(LIKED_CACHE_KEY % user_id))
+
+
+def toggle_like(user, product):
+    # Ràng buộc unique (user_id, product_id) đảm bảo mỗi cặp chỉ có một dòng: bấm đúp cùng lúc thì get_or_create
+    # của request thua sẽ đọc lại dòng vừa tạo. Đảo trạng thái bằng một câu UPDATE nên không mất lượt bấm nào,
+    # sau đó đọc lại trạng thái thật của dòng.
+    like, created = Like.objects.get_or_create(user_id = user, product_id = product)
+    if not created:
+        Like.objects.filter(pk = like.pk).update(
+            active = Case(When(active = True, then = Value(False)), default = Value(True)),
+            updated_date = timezone.now())
+        like.refresh_from_db(fields = ['active', 'updated_date'])
+        # UPDATE không phát signal nên tự xoá cache tổng lượt thích của sản phẩm
+        invalidate_products([like.product_id_id])
+    invalidate_liked(user.pk)
+    return like
+
+
+@receiver(post_save, sender = Like, dispatch_uid = 'shopping.likes.saved')
+@receiver(post_delete, sender = Like, dispatch_uid = 'shopping.likes.deleted')
+def like_changed(sender, instance, **kwargs):
+    invalidate_liked(instance.user_id_id)
@@ -0,0 +1,73 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import migrations
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.writer import MigrationWriter
+
+from shopping import workload
+from shopping.indexadvisor import advise
+
+
+class Command(BaseCommand):
+    help = ('Đọc workload đã capture (ESHOPPING_WORKLOAD_CAPTURE=1), chạy EXPLAIN cho các hình dạng truy vấn '
+            'nặng nhất, đề xuất index ghép và (tuỳ chọn) sinh migration')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default = None, help = 'Thư mục capture, mặc định WORKLOAD_CAPTURE_DIR')
+        parser.add_argument('--top', type = int, default = 20, help = 'Số hình dạng truy vấn nặng nhất được xét')
+        parser.add_argument('--min-columns', type = int, default = 2,
+                            help = 'Chỉ đề xuất index có ít nhất số cột này (index 1 cột thường đã có từ FK)')
+        parser.add_argument('--write-migration', action = 'store_true',
+                            help = 'Ghi migration AddIndex cho các đề xuất vào shopping/migrations')
+        parser.add_argument('--name', default = 'workload_indexes', help = 'Tên migration')
+        parser.add_argument('--reset', action = 'store_true', help = 'Xoá workload đã capture rồi thoát')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            workload.reset(options['dir'])
+            self.stdout.write('Đã xoá workload')
+            return
+        shapes = workload.load(options['dir'])
+        if not shapes:
+            raise CommandError('Chưa có workload, hãy chạy server hoặc bench_api với ESHOPPING_WORKLOAD_CAPTURE=1')
+
+        report, proposals = advise(shapes, options['top'], options['min_columns'])
+        total_ms = sum(entry['total_ms'] for entry in shapes.values())
+        self.stdout.write('%d hình dạng truy vấn, tổng %.0f ms\n' % (len(shapes), total_ms))
+        for item in report:
+            self.stdout.write('%6.1f%% %7d x %s' % (100 * item['total_ms'] / total_ms if total_ms else 0,
+                                                   item['count'], item['shape'][:160]))
+            for line in item['plan']:
+                self.stdout.write('         plan: %s' % line)
+
+        if not proposals:
+            self.stdout.write(self.style.SUCCESS('\nKhông có index nào cần thêm cho workload này'))
+            return
+        self.stdout.write('\nĐề xuất (thêm vào Meta.indexes của model):')
+        for proposal in proposals:
+            flags = ', '.join(flag for flag, on in [('full scan', proposal.scan), ('filesort', proposal.sort)] if on)
+            self.stdout.write('  %s: %s  # %.0f ms, %d truy vấn, %d hình dạng%s' % (
+                proposal.model.__name__, proposal.meta_snippet(), proposal.weight_ms, proposal.count,
+                len(proposal.shapes), ' [%s]' % flags if flags else ''))
+
+        if options['write_migration']:
+            self.write_migration(proposals, options['name'])
+
+    def write_migration(self, proposals, name):
+        loader = MigrationLoader(None, ignore_no_migrations = True)
+        leaves = loader.graph.leaf_nodes('shopping')
+        number = int(leaves[0][1].split('_')[0]) + 1 if leaves else 1
+        migration = migrations.Migration('%04d_%s' % (number, name), 'shopping')
+        migration.dependencies = leaves
+        # Model của app khác (auth, oauth2_provider) không sửa được Meta nên chỉ được in ra
+        migration.operations = [migrations.AddIndex(model_name = p.model._meta.model_name, index = p.index)
+                                for p in proposals if p.model._meta.app_label == 'shopping']
+        if not migration.operations:
+            self.stdout.write('Không có đề xuất nào thuộc app shopping, không ghi migration')
+            return
+        writer = MigrationWriter(migration)
+        with open(writer.path, 'w') as f:
+            f.write(writer.as_string())
+        self.stdout.write(self.style.SUCCESS('Đã ghi %s' % os.path.relpath(writer.path)))
+        self.stdout.write('Nhớ thêm các index trên vào Meta.indexes của model để makemigrations không xoá chúng')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from shopping import archive
+
+
+class Command(BaseCommand):
+    help = 'Chuyển đơn đã giao/huỷ lâu ngày cùng dòng sản phẩm và thanh toán sang bảng lưu trữ, theo từng lô'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type = int, default = None, help = 'Mặc định ORDER_ARCHIVE_AFTER_DAYS')
+        parser.add_argument('--batch-size', type = int, default = None)
+        parser.add_argument('--pause', type = float, default = None, help = 'Số giây nghỉ giữa hai lô')
+        parser.add_argument('--max-batches', type = int, default = None, help = 'Dừng sau bấy nhiêu lô')
+        parser.add_argument('--dry-run', action = 'store_true', help = 'Chỉ đếm số đơn sẽ được chuyển')
+
+    def handle(self, *args, **options):
+        cutoff = archive.cutoff_date(options['days'])
+        if options['dry_run']:
+            self.stdout.write('%d đơn tạo trước %s sẽ được lưu trữ' % (archive.candidates(cutoff).count(), cutoff))
+            return
+        total = archive.run(cutoff, options['batch_size'], options['pause'], options['max_batches'],
+                            progress = lambda batches, count: self.stdout.write('lô %d: %d đơn' % (batches, count)))
+        self.stdout.write('Đã lưu trữ %d đơn tạo trước %s' % (total, cutoff))
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shopping import search
+from shopping.textnorm import search_key
+
+
+class Command(BaseCommand):
+    help = 'Tính search_key và token tìm kiếm cho sản phẩm/shop theo từng chunk (sau migration hoặc bulk_create)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type = int, default = 1000)
+        parser.add_argument('--pause', type = float, default = 0.0, help = 'Số giây nghỉ giữa hai chunk')
+        parser.add_argument('--all', action = 'store_true',
+                            help = 'Ghi lại token cho mọi dòng, kể cả dòng đã có search_key đúng')
+
+    def handle(self, *args, **options):
+        for kind, model in search.MODELS.items():
+            rows = model.objects.order_by('pk').values_list('pk', 'name', 'search_key')
+            last, updated = None, 0
+            while True:
+                chunk = list((rows if last is None else rows.filter(pk__gt = last))[:options['chunk_size']])
+                if not chunk:
+                    break
+                last = chunk[-1][0]
+                changed = [(pk, search_key(name)) for pk, name, key in chunk
+                           if options['all'] or key != search_key(name)]
+                if changed:
+                    with transaction.atomic():
+                        model.objects.bulk_update([model(pk = pk, search_key = key) for pk, key in changed],
+                                                  ['search_key'])
+                        search.write_tokens(kind, changed)
+                    updated += len(changed)
+                if options['pause']:
+                    time.sleep(options['pause'])
+            self.stdout.write('%s: cập nhật %d dòng' % (kind, updated))
@@ -0,0 +1,251 @@
+import json
+import random
+import secrets
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.utils import timezone
+from oauth2_provider.models import AccessToken, Application
+
+from shopping.models import Category, Product, User
+
+# Kịch bản -> trọng số (tỉ lệ request)
+SCENARIOS = {
+    'product_list': 35,
+    'product_list_filtered': 15,
+    'product_detail': 20,
+    'product_reviews': 8,
+    'add_to_cart': 10,
+    'cart_detail': 8,
+    'order_create': 7,
+    'order_history': 6,
+    'stats': 5,
+}
+SORT_FIELDS = ['name', '-name', 'price', '-price', '-created_date']
+
+
+class InProcessTransport:
+    # Gọi thẳng Django qua test Client, không cần chạy server
+    def __init__(self):
+        self.client = Client(HTTP_HOST = 'localhost')
+
+    def request(self, method, path, token = None, data = None, multipart = False):
+        extra = {'HTTP_AUTHORIZATION': 'Bearer %s' % token} if token else {}
+        if method == 'GET':
+            response = self.client.get(path, data, **extra)
+        elif multipart:
+            response = self.client.post(path, data, **extra)
+        else:
+            response = self.client.post(path, json.dumps(data), content_type = 'application/json', **extra)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response.status_code
+
+    def close(self):
+        connections.close_all()
+
+
+class HttpTransport:
+    def __init__(self, base_url):
+        import requests
+
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def request(self, method, path, token = None, data = None, multipart = False):
+        headers = {'Authorization': 'Bearer %s' % token} if token else {}
+        url = self.base_url + path
+        if method == 'GET':
+            response = self.session.get(url, params = data, headers = headers)
+        elif multipart:
+            response = self.session.post(url, data = data, headers = headers)
+        else:
+            response = self.session.post(url, json = data, headers = headers)
+        return response.status_code
+
+    def close(self):
+        self.session.close()
+
+
+class Command(BaseCommand):
+    help = 'Chạy benchmark tải cho các endpoint chính và ghi kết quả (throughput, p50/p95/p99) ra file JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default = None,
+                            help = 'Gọi qua HTTP tới server đang chạy; mặc định gọi trực tiếp trong process')
+        parser.add_argument('--concurrency', type = int, default = 8)
+        parser.add_argument('--duration', type = float, default = 30, help = 'Số giây chạy benchmark')
+        parser.add_argument('--users', type = int, default = 50, help = 'Số user dùng để đăng nhập')
+        parser.add_argument('--seed', type = int, default = None)
+        parser.add_argument('--label', default = '')
+        parser.add_argument('--output', default = 'bench_results.json',
+                            help = 'File JSON, mỗi lần chạy được thêm vào cuối danh sách')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.prepare(options['users'])
+
+        results = defaultdict(list)
+        statuses = defaultdict(lambda: defaultdict(int))
+        lock = threading.Lock()
+        deadline = time.perf_counter() + options['duration']
+        names = list(SCENARIOS)
+        weights = [SCENARIOS[name] for name in names]
+
+        def worker(index):
+            rnd = random.Random(self.random.random())
+            transport = HttpTransport(options['base_url']) if options['base_url'] else InProcessTransport()
+            local = defaultdict(list)
+            local_status = defaultdict(lambda: defaultdict(int))
+            try:
+                while time.perf_counter() < deadline:
+                    name = rnd.choices(names, weights)[0]
+                    start = time.perf_counter()
+                    try:
+                        code = getattr(self, 'scenario_%s' % name)(transport, rnd)
+                    except Exception:
+                        code = 'error'
+                    local[name].append(time.perf_counter() - start)
+                    local_status[name][str(code)] += 1
+            finally:
+                transport.close()
+            with lock:
+                for name, values in local.items():
+                    results[name].extend(values)
+                    for code, count in local_status[name].items():
+                        statuses[name][code] += count
+
+        threads = [threading.Thread(target = worker, args = (i,)) for i in range(options['concurrency'])]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        report = self.build_report(results, statuses, elapsed, options)
+        self.print_report(report)
+        self.save(report, options['output'])
+
+    def prepare(self, user_count):
+        self.product_ids = list(Product.objects.filter(active = True).values_list('id', flat = True)[:5000])
+        if not self.product_ids:
+            raise CommandError('Chưa có dữ liệu, hãy chạy: manage.py seed_data')
+        self.category_ids = list(Category.objects.values_list('id', flat = True))
+        self.product_options = {}
+        for product in Product.objects.filter(id__in = self.product_ids[:500]).prefetch_related('colors', 'sizes'):
+            colors = [c.id for c in product.colors.all()]
+            sizes = [s.id for s in product.sizes.all()]
+            if colors and sizes:
+                self.product_options[product.id] = (product.price, product.discount, colors, sizes)
+
+        # Cấp sẵn access token cho một nhóm user để gọi các endpoint cần đăng nhập
+        application, _ = Application.objects.get_or_create(
+            name = 'bench', defaults = {'client_type': Application.CLIENT_CONFIDENTIAL,
+                                        'authorization_grant_type': Application.GRANT_PASSWORD})
+        users = list(User.objects.filter(is_active = True, business__isnull = True).order_by('id')[:user_count])
+        expires = timezone.now() + timedelta(days = 1)
+        tokens = [AccessToken(user = user, application = application, token = secrets.token_urlsafe(30),
+                              expires = expires, scope = 'read write') for user in users]
+        AccessToken.objects.bulk_create(tokens)
+        self.tokens = [t.token for t in tokens]
+
+    def scenario_product_list(self, transport, rnd):
+        return transport.request('GET', '/products/', data = {'page': rnd.randint(1, 5)})
+
+    def scenario_product_list_filtered(self, transport, rnd):
+        params = {'kw': rnd.choice(['áo', 'quần', 'giày', 'túi', 'basic']),
+                  'min_price': rnd.choice([0, 50000, 100000]), 'max_price': rnd.choice([200000, 500000]),
+                  'sort_by': rnd.choice(SORT_FIELDS)}
+        if self.category_ids:
+            params['category'] = rnd.choice(self.category_ids)
+        return transport.request('GET', '/products/', data = params)
+
+    def scenario_product_detail(self, transport, rnd):
+        return transport.request('GET', '/products/%d/' % rnd.choice(self.product_ids), token = rnd.choice(self.tokens))
+
+    def scenario_product_reviews(self, transport, rnd):
+        return transport.request('GET', '/products/%d/list-review/' % rnd.choice(self.product_ids))
+
+    def scenario_add_to_cart(self, transport, rnd):
+        product_id, (_, _, colors, sizes) = rnd.choice(list(self.product_options.items()))
+        return transport.request('POST', '/products/%d/add-to-cart/' % product_id, token = rnd.choice(self.tokens),
+                                 data = {'quantity': 1, 'color': rnd.choice(colors), 'size': rnd.choice(sizes)},
+                                 multipart = True)
+
+    def scenario_cart_detail(self, transport, rnd):
+        return transport.request('GET', '/cart/cart-detail/', token = rnd.choice(self.tokens))
+
+    def scenario_order_create(self, transport, rnd):
+        lines = []
+        for product_id, (price, discount, colors, sizes) in rnd.sample(list(self.product_options.items()), 2):
+            lines.append({'product': product_id, 'price': price, 'discount': discount, 'quantity': 1,
+                          'colors': rnd.choice(colors), 'sizes': rnd.choice(sizes)})
+        total = sum(line['price'] * (100 - line['discount']) // 100 for line in lines)
+        data = {'name': 'Bench', 'email': 'bench@example.com', 'phone': '0900000000', 'address': 'TP.HCM',
+                'total_amount': total, 'payment_method': 'COD', 'payment_status': 'FAIL', 'order_details': lines}
+        return transport.request('POST', '/order/', token = rnd.choice(self.tokens), data = data)
+
+    def scenario_order_history(self, transport, rnd):
+        return transport.request('GET', '/order/get-user-order/', token = rnd.choice(self.tokens))
+
+    def scenario_stats(self, transport, rnd):
+        return transport.request('GET', '/stats/stats-count/', token = rnd.choice(self.tokens))
+
+    def build_report(self, results, statuses, elapsed, options):
+        def summary(values):
+            values = sorted(values)
+
+            def pct(p):
+                return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 2)
+
+            return {'requests': len(values), 'rps': round(len(values) / elapsed, 2),
+                    'p50_ms': pct(0.5), 'p95_ms': pct(0.95), 'p99_ms': pct(0.99)}
+
+        all_values = [v for values in results.values() for v in values]
+        return {
+            'label': options['label'],
+            'commit': self.git_commit(),
+            'timestamp': timezone.now().isoformat(),
+            'mode': options['base_url'] or 'in-process',
+            'concurrency': options['concurrency'],
+            'duration_s': round(elapsed, 2),
+            'total': summary(all_values) if all_values else {},
+            'scenarios': {name: dict(summary(values), status = dict(statuses[name]))
+                          for name, values in sorted(results.items())},
+        }
+
+    def git_commit(self):
+        try:
+            return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text = True,
+                                           stderr = subprocess.DEVNULL).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def print_report(self, report):
+        self.stdout.write('commit=%s mode=%s concurrency=%d duration=%ss' % (
+            report['commit'], report['mode'], report['concurrency'], report['duration_s']))
+        rows = list(report['scenarios'].items()) + [('TOTAL', report['total'])]
+        for name, row in rows:
+            if not row:
+                continue
+            self.stdout.write('%-24s %7d req %8.1f req/s  p50=%8.2f  p95=%8.2f  p99=%8.2f ms  %s' % (
+                name, row['requests'], row['rps'], row['p50_ms'], row['p95_ms'], row['p99_ms'],
+                row.get('status', '')))
+
+    def save(self, report, path):
+        try:
+            with open(path) as f:
+                runs = json.load(f)
+        except (OSError, ValueError):
+            runs = []
+        runs.append(report)
+        with open(path, 'w') as f:
+            json.dump(runs, f, indent = 2, ensure_ascii = False)
+        self.stdout.write('Đã ghi kết quả vào %s' % path)
@@ -0,0 +1,169 @@
+import asyncio
+import io
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.testing import ApplicationCommunicator
+from django.core.asgi import get_asgi_application
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.client import encode_multipart, BOUNDARY, MULTIPART_CONTENT
+from django.utils import timezone
+from oauth2_provider.models import AccessToken, Application
+from PIL import Image
+
+from shopping.models import Business, Category, Product, Shop
+
+# wsgi: view đồng bộ trên một worker WSGI đồng bộ (mỗi lúc một request),
+# sync: cùng view đó chạy dưới ASGI (Django cấp một thread cho mỗi request),
+# async: view async, upload chạy trên thread pool chung còn event loop không bị chặn
+ENDPOINTS = {
+    'wsgi': '/products/',
+    'sync': '/products/',
+    'async': '/async/products/',
+}
+NAME_PREFIX = 'bench-async-'
+
+
+def thumbnail_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = ('Đo số request tạo sản phẩm (upload ảnh chậm) một worker xử lý được cùng lúc, '
+            'so sánh view đồng bộ /products/ (WSGI và ASGI) với view async /async/products/')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type = int, default = 40)
+        parser.add_argument('--concurrency', type = int, default = 20, help = 'Số request gửi đồng thời')
+        parser.add_argument('--upload-latency', type = float, default = 0.5,
+                            help = 'Thời gian giả lập cho mỗi lần upload Cloudinary (giây)')
+        parser.add_argument('--mode', choices = list(ENDPOINTS) + ['all'], default = 'all')
+
+    def handle(self, *args, **options):
+        business, category = self.prepare()
+        token = self.issue_token(business)
+        latency = options['upload_latency']
+
+        def slow_upload(file, **kwargs):
+            # Giả lập Cloudinary: chỉ chờ mạng, không tốn CPU
+            time.sleep(latency)
+            return {'url': 'https://res.cloudinary.com/bench/image/upload/%s.png' % secrets.token_hex(4)}
+
+        modes = list(ENDPOINTS) if options['mode'] == 'all' else [options['mode']]
+        try:
+            with mock.patch('cloudinary.uploader.upload', side_effect = slow_upload):
+                for mode in modes:
+                    if mode == 'wsgi':
+                        report = self.run_wsgi(ENDPOINTS[mode], token, category, options)
+                    else:
+                        report = asyncio.run(self.run(ENDPOINTS[mode], token, category, options))
+                    self.print_report(mode, report)
+        finally:
+            Product.objects.filter(name__startswith = NAME_PREFIX).delete()
+            AccessToken.objects.filter(token = token).delete()
+
+    def prepare(self):
+        shop = Shop.objects.filter(business__status = 'confirmed', business__is_active = True,
+                                   business__groups__name = 'Business').select_related('business').first()
+        category = Category.objects.first()
+        if shop is None or category is None:
+            raise CommandError('Chưa có doanh nghiệp có shop, hãy chạy: manage.py seed_data')
+        return Business.objects.get(pk = shop.business_id), category
+
+    def issue_token(self, business):
+        application, _ = Application.objects.get_or_create(
+            name = 'bench', defaults = {'client_type': Application.CLIENT_CONFIDENTIAL,
+                                        'authorization_grant_type': Application.GRANT_PASSWORD})
+        return AccessToken.objects.create(user = business, application = application,
+                                          token = secrets.token_urlsafe(30), scope = 'read write',
+                                          expires = timezone.now() + timedelta(hours = 1)).token
+
+    def payload(self, i, category, thumbnail):
+        return {'name': '%s%d' % (NAME_PREFIX, i), 'quantity': 1, 'price': 1000, 'discount': 0,
+                'category': category.id, 'colors': ['Đỏ'], 'sizes': ['M'],
+                'thumbnail': SimpleUploadedFile('thumb.png', thumbnail, content_type = 'image/png')}
+
+    def run_wsgi(self, path, token, category, options):
+        client = Client(HTTP_HOST = 'localhost')
+        thumbnail = thumbnail_bytes()
+        latencies, statuses = [], {}
+        started = time.perf_counter()
+        for i in range(options['requests']):
+            start = time.perf_counter()
+            status = client.post(path, self.payload(i, category, thumbnail),
+                                 HTTP_AUTHORIZATION = 'Bearer %s' % token).status_code
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+        return {'elapsed': time.perf_counter() - started, 'latencies': sorted(latencies), 'statuses': statuses,
+                'peak_threads': threading.active_count()}
+
+    async def run(self, path, token, category, options):
+        # Toàn bộ request chạy trên một event loop, tương đương một worker uvicorn
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers = options['concurrency']))
+        application = get_asgi_application()
+        semaphore = asyncio.Semaphore(options['concurrency'])
+        latencies, statuses = [], {}
+        thumbnail = thumbnail_bytes()
+        peak_threads = threading.active_count()
+        done = asyncio.Event()
+
+        async def sample_threads():
+            nonlocal peak_threads
+            while not done.is_set():
+                peak_threads = max(peak_threads, threading.active_count())
+                await asyncio.sleep(0.01)
+
+        async def one(i):
+            body = encode_multipart(BOUNDARY, self.payload(i, category, thumbnail))
+            async with semaphore:
+                start = time.perf_counter()
+                status = await self.request(application, path, token, body)
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        sampler = asyncio.ensure_future(sample_threads())
+        started = time.perf_counter()
+        await asyncio.gather(*[one(i) for i in range(options['requests'])])
+        elapsed = time.perf_counter() - started
+        done.set()
+        await sampler
+        return {'elapsed': elapsed, 'latencies': sorted(latencies), 'statuses': statuses,
+                'peak_threads': peak_threads}
+
+    async def request(self, application, path, token, body):
+        scope = {
+            'type': 'http', 'method': 'POST', 'path': path, 'query_string': b'', 'server': ('localhost', 80),
+            'headers': [(b'host', b'localhost'), (b'content-type', MULTIPART_CONTENT.encode()),
+                        (b'content-length', str(len(body)).encode()),
+                        (b'authorization', ('Bearer %s' % token).encode())],
+        }
+        communicator = ApplicationCommunicator(application, scope)
+        await communicator.send_input({'type': 'http.request', 'body': body})
+        start = await communicator.receive_output(timeout = 600)
+        while True:
+            message = await communicator.receive_output(timeout = 600)
+            if not message.get('more_body'):
+                break
+        return start['status']
+
+    def print_report(self, mode, report):
+        values = report['latencies']
+
+        def pct(p):
+            return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+        # Số request thực sự được xử lý chồng lên nhau = tổng thời gian các request / thời gian chạy
+        overlap = sum(values) / report['elapsed']
+        self.stdout.write('%-5s %-17s %d req in %.2fs  %.1f req/s  p50=%.0fms p95=%.0fms  in-flight~%.1f  '
+                          'threads=%d  %s' % (mode, ENDPOINTS[mode], len(values), report['elapsed'],
+                                              len(values) / report['elapsed'], pct(0.5), pct(0.95), overlap,
+                                              report['peak_threads'], report['statuses']))
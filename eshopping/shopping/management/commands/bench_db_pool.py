@@ -0,0 +1,67 @@
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connection, connections
+from django.test import Client
+
+from shopping.backends.pool import pool_stats
+
+
+class Command(BaseCommand):
+    help = 'So sánh độ trễ request khi có và không có pool kết nối MySQL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default = '/colors/')
+        parser.add_argument('--requests', type = int, default = 200, help = 'Số request cho mỗi thread')
+        parser.add_argument('--concurrency', type = int, default = 4)
+
+    def handle(self, *args, **options):
+        if not hasattr(connection, 'pool_enabled'):
+            raise CommandError("DATABASES['default'] cần dùng ENGINE 'shopping.backends.mysql_pool'")
+
+        db_settings = connections.settings[DEFAULT_DB_ALIAS]
+        original = db_settings.get('POOL')
+        try:
+            for enabled in (False, True):
+                db_settings['POOL'] = dict(original or {}, ENABLED = enabled)
+                latencies, elapsed = self.run(options['path'], options['requests'], options['concurrency'])
+                self.report('pool' if enabled else 'no pool', latencies, elapsed)
+        finally:
+            db_settings['POOL'] = original
+        self.stdout.write('pool: %s' % pool_stats().get(DEFAULT_DB_ALIAS))
+
+    def run(self, path, requests, concurrency):
+        latencies = []
+        lock = threading.Lock()
+
+        def worker():
+            client = Client()
+            local = []
+            for _ in range(requests):
+                start = time.perf_counter()
+                client.get(path)
+                # Giống như cuối mỗi request thật: CONN_MAX_AGE = 0 nên kết nối bị đóng (hoặc trả về pool)
+                close_old_connections()
+                local.append(time.perf_counter() - start)
+            connections.close_all()
+            with lock:
+                latencies.extend(local)
+
+        threads = [threading.Thread(target = worker) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return latencies, time.perf_counter() - start
+
+    def report(self, name, latencies, elapsed):
+        latencies.sort()
+
+        def pct(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        self.stdout.write('%-8s %7.1f req/s  mean=%6.2f ms  p50=%6.2f ms  p95=%6.2f ms  p99=%6.2f ms' % (
+            name, len(latencies) / elapsed, statistics.mean(latencies) * 1000, pct(0.5), pct(0.95), pct(0.99)))
@@ -0,0 +1,72 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from shopping.models import Category, Product, Shop
+from shopping.renderers import iter_json_array, orjson
+from shopping.serializers import ProductSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'So sánh bộ nhớ đỉnh và time-to-first-byte giữa JSONRenderer và StreamingJSONResponse'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type = int, default = 5000)
+        parser.add_argument('--chunk-size', type = int, default = 500)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        try:
+            with transaction.atomic():
+                # Dữ liệu tạm, rollback sau khi đo
+                category = Category.objects.create(name = 'bench-streaming-category')
+                shop = Shop.objects.create(name = 'bench-streaming-shop', email = 'bench@example.com')
+                Product.objects.bulk_create([
+                    Product(name = 'Bench product %d' % i, quantity = 10, price = 100000 + i, discount = i % 50,
+                            thumbnail = 'shopping/bench.jpg', category = category, shop = shop,
+                            description = '<p>%s</p>' % ('x' * 200))
+                    for i in range(rows)
+                ], batch_size = 1000)
+                queryset = ProductSerializer.setup_queryset(Product.objects.filter(shop = shop)).order_by('id')
+
+                self.report('JSONRenderer', *self.measure_buffered(queryset))
+                self.report('Streaming (%s)' % ('orjson' if orjson else 'json'),
+                            *self.measure_streaming(queryset, options['chunk_size']))
+                raise Rollback
+        except Rollback:
+            pass
+
+    def measure_buffered(self, queryset):
+        tracemalloc.start()
+        start = time.perf_counter()
+        body = JSONRenderer().render(ProductSerializer(queryset.all(), many = True).data)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        # Toàn bộ body chỉ gửi được sau khi render xong
+        return elapsed, elapsed, peak, len(body)
+
+    def measure_streaming(self, queryset, chunk_size):
+        tracemalloc.start()
+        start = time.perf_counter()
+        first_byte = None
+        size = 0
+        for part in iter_json_array(queryset.all(), ProductSerializer, chunk_size = chunk_size):
+            if first_byte is None and len(part) > 1:
+                first_byte = time.perf_counter() - start
+            size += len(part)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return first_byte or elapsed, elapsed, peak, size
+
+    def report(self, name, first_byte, elapsed, peak, size):
+        self.stdout.write('%-20s ttfb=%8.1f ms  total=%8.1f ms  peak=%8.1f MiB  body=%d bytes' % (
+            name, first_byte * 1000, elapsed * 1000, peak / 1024 / 1024, size))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shopping import throttling
+
+
+class Command(BaseCommand):
+    help = 'Đo thời gian một lần kiểm tra giới hạn tần suất (nhận và từ chối) với từng loại store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checks', type = int, default = 20000)
+        parser.add_argument('--cache', default = None, help = 'Alias cache dùng chung, mặc định THROTTLE_CACHE')
+
+    def handle(self, *args, **options):
+        checks = options['checks']
+        shared = throttling.shared_store(options['cache'])
+        stores = [('local', throttling.LocalStore()), (type(shared).__name__, shared)]
+        run = time.time_ns()
+        for name, store in stores:
+            # Mỗi lần kiểm tra một khoá khác nhau nên đều được nhận; sau đó dồn vào một khoá có hạn mức 1/ngày
+            allowed = self.measure(store, checks, lambda i: 'bench:allow:%d:%d' % (run, i), 1, 60)
+            rejected = self.measure(store, checks, lambda i: 'bench:reject:%d' % run, 86400, 86400)
+            self.stdout.write('%-12s nhận: %.1f µs/lần   từ chối: %.1f µs/lần' % (name, allowed, rejected))
+
+    def measure(self, store, checks, key, interval, period):
+        start = time.perf_counter()
+        for i in range(checks):
+            store.hit([(key(i), interval, period)])
+        return (time.perf_counter() - start) / checks * 1e6
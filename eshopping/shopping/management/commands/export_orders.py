@@ -0,0 +1,34 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shopping import exports
+
+
+class Command(BaseCommand):
+    help = 'Xuất đơn hàng (mỗi dòng một sản phẩm trong đơn) ra CSV hoặc XLSX, đọc và ghi theo từng chunk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest = 'fmt', choices = list(exports.FORMATS), default = 'csv')
+        parser.add_argument('--output', '-o', help = 'File kết quả, mặc định ghi ra stdout')
+        parser.add_argument('--shop', help = 'Mã shop, nhiều shop cách nhau bởi dấu phẩy')
+        parser.add_argument('--from', dest = 'from', help = 'Từ ngày đặt (YYYY-MM-DD)')
+        parser.add_argument('--to', help = 'Tới ngày đặt (YYYY-MM-DD), bao gồm cả ngày này')
+        parser.add_argument('--status', help = 'Trạng thái đơn, nhiều trạng thái cách nhau bởi dấu phẩy')
+        parser.add_argument('--chunk-size', type = int, default = None)
+
+    def handle(self, *args, **options):
+        filters, errors = exports.parse_filters(options)
+        if errors:
+            raise CommandError('; '.join('%s: %s' % item for item in errors.items()))
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        written = 0
+        try:
+            for data in exports.iter_export(options['fmt'], filters, options['chunk_size']):
+                output.write(data)
+                written += len(data)
+        finally:
+            if options['output']:
+                output.close()
+        if options['output']:
+            self.stderr.write('Đã ghi %d byte vào %s' % (written, options['output']))
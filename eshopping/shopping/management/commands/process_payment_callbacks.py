@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from shopping.payments import process_batch
+
+
+class Command(BaseCommand):
+    help = 'Áp dụng các callback thanh toán đang chờ vào Payment/Order theo lô'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type = int,
+                            default = getattr(settings, 'PAYMENT_CALLBACK_BATCH_SIZE', 500))
+        parser.add_argument('--sleep', type = float, default = 1.0, help = 'Số giây chờ khi không còn callback')
+        parser.add_argument('--once', action = 'store_true', help = 'Xử lý hết callback đang chờ rồi thoát')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            count, stats = process_batch(options['batch_size'])
+            if count:
+                self.stdout.write('%d callback: %s' % (count, ', '.join('%s=%s' % item for item in stats.items())))
+                continue
+            if options['once']:
+                return
+            time.sleep(options['sleep'])
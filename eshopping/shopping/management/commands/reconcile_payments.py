@@ -0,0 +1,130 @@
+import csv
+import sys
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from shopping import archive
+from shopping.models import Payment, ArchivedPayment
+
+# File đối soát của cổng thanh toán (CSV có dòng tiêu đề): order_id, amount, status (SUCCESS/FAIL).
+# File được đọc từng dòng và so với Payment theo từng chunk nên không phải nạp cả file hay cả bảng vào bộ nhớ; chỉ
+# giữ tập order_id đã gặp để sau đó tìm chiều ngược lại: thanh toán thành công trong kỳ đối soát mà file không có.
+# Đơn đã lưu trữ (shopping/archive.py) được so với ArchivedPayment.
+COLUMNS = ('order_id', 'amount', 'status')
+PAYMENT_FIELDS = ('total_amount', 'payment_status', 'created_date')
+
+
+def chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def compare(gateway, rows, window = None):
+    # rows: các dòng (order_id, amount, status) của một chunk; trả về các chênh lệch.
+    # window: [ngày tạo nhỏ nhất, lớn nhất] của các thanh toán khớp, được nới ra theo chunk này
+    payments = archive.order_payments([row[0] for row in rows], PAYMENT_FIELDS, payment_method = gateway)
+    for order_id, amount, status in rows:
+        if order_id not in payments:
+            yield order_id, 'missing_payment', amount, ''
+            continue
+        payment = payments[order_id]
+        if window is not None:
+            window[0] = min(window[0] or payment['created_date'], payment['created_date'])
+            window[1] = max(window[1] or payment['created_date'], payment['created_date'])
+        if amount != payment['total_amount']:
+            yield order_id, 'amount_mismatch', amount, payment['total_amount']
+        elif status != payment['payment_status']:
+            yield order_id, 'status_mismatch', status, payment['payment_status']
+
+
+def unsettled(gateway, seen, start, end, size):
+    # Thanh toán thành công tạo trong [start, end) không có trong file, theo khối khoá chính. Thanh toán FAIL không
+    # có trong file là bình thường (khách bỏ dở trước khi tới cổng) nên không báo
+    success = Payment.PaymentStatus.IS_SUCCESS
+    for model in (Payment, ArchivedPayment):
+        last_id = 0
+        while True:
+            rows = list(model.objects.filter(payment_method = gateway, payment_status = success,
+                                             created_date__gte = start, created_date__lt = end, id__gt = last_id,
+                                             order__isnull = False)
+                        .order_by('id').values_list('id', 'order_id', 'total_amount')[:size])
+            if not rows:
+                break
+            for pk, order_id, amount in rows:
+                if order_id not in seen:
+                    yield order_id, 'missing_settlement', '', amount
+            last_id = rows[-1][0]
+
+
+def day(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError('Ngày không hợp lệ (YYYY-MM-DD): %s' % value)
+
+
+class Command(BaseCommand):
+    help = 'Đối soát file quyết toán của cổng thanh toán với bảng Payment, in ra các dòng chênh lệch (CSV)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help = "Đường dẫn file CSV, '-' để đọc từ stdin")
+        parser.add_argument('--gateway', required = True, choices = Payment.PaymentMethod.values)
+        parser.add_argument('--chunk-size', type = int, default = 1000)
+        # Kỳ đối soát để tìm thanh toán thiếu trong file; mặc định là khoảng ngày tạo của các thanh toán khớp với file
+        parser.add_argument('--since', type = day, help = 'Ngày đầu kỳ quyết toán (YYYY-MM-DD)')
+        parser.add_argument('--until', type = day, help = 'Ngày cuối kỳ quyết toán, tính cả ngày này (YYYY-MM-DD)')
+
+    def parse(self, reader):
+        header = next(reader, None)
+        if header is None or [h.strip().lower() for h in header[:3]] != list(COLUMNS):
+            raise CommandError('Dòng tiêu đề phải là %s' % ','.join(COLUMNS))
+        for line, row in enumerate(reader, start = 2):
+            try:
+                yield int(row[0]), int(row[1]), row[2].strip().upper()
+            except (IndexError, ValueError):
+                self.stderr.write('Bỏ qua dòng %d không hợp lệ: %s' % (line, row))
+
+    def settlement_window(self, options, window):
+        start = end = None
+        if window[0] is not None:
+            start, end = window[0], window[1] + timedelta(microseconds = 1)
+        if options['since']:
+            start = timezone.make_aware(datetime.combine(options['since'], time.min))
+        if options['until']:
+            end = timezone.make_aware(datetime.combine(options['until'] + timedelta(days = 1), time.min))
+        return start, end
+
+    def handle(self, *args, **options):
+        source = sys.stdin if options['file'] == '-' else open(options['file'], newline = '', encoding = 'utf-8-sig')
+        writer = csv.writer(self.stdout)
+        writer.writerow(['order_id', 'issue', 'settlement', 'payment'])
+        totals = {'rows': 0, 'issues': 0}
+        seen = set()
+        window = [None, None]
+        try:
+            for chunk in chunks(self.parse(csv.reader(source)), options['chunk_size']):
+                totals['rows'] += len(chunk)
+                seen.update(row[0] for row in chunk)
+                for issue in compare(options['gateway'], chunk, window):
+                    totals['issues'] += 1
+                    writer.writerow(issue)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+        start, end = self.settlement_window(options, window)
+        if start is None or end is None:
+            self.stderr.write('Không xác định được kỳ đối soát (dùng --since/--until), bỏ qua kiểm tra thanh toán '
+                              'thiếu trong file')
+        else:
+            for issue in unsettled(options['gateway'], seen, start, end, options['chunk_size']):
+                totals['issues'] += 1
+                writer.writerow(issue)
+        self.stderr.write('%(rows)d dòng đối soát, %(issues)d chênh lệch' % totals)
@@ -0,0 +1,86 @@
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from shopping import jobs
+
+
+class Command(BaseCommand):
+    help = 'Chạy các việc nền trong hàng đợi Job bằng N worker song song'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type = int, default = getattr(settings, 'JOB_WORKERS', 4))
+        parser.add_argument('--queue', action = 'append', dest = 'queues',
+                            help = 'Hàng đợi cần chạy, lặp lại để chạy nhiều hàng đợi (mặc định: default)')
+        parser.add_argument('--batch-size', type = int, default = 10, help = 'Số việc mỗi worker nhận một lần')
+        parser.add_argument('--sleep', type = float, default = 1.0, help = 'Số giây chờ khi không còn việc tới hạn')
+        parser.add_argument('--stats-interval', type = float, default = 60.0,
+                            help = 'In độ sâu hàng đợi mỗi bấy nhiêu giây (0: không in)')
+        parser.add_argument('--once', action = 'store_true', help = 'Chạy hết các việc đang tới hạn rồi thoát')
+
+    def handle(self, *args, **options):
+        queues = options['queues'] or ['default']
+        stop = threading.Event()
+        # SIGTERM (deploy, systemd) như Ctrl-C: worker chạy xong lô đang chạy rồi thoát
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        workers = max(1, options['workers'])
+        self.stdout.write('%d worker, hàng đợi: %s' % (workers, ', '.join(queues)))
+        if workers == 1:
+            # Một worker: chạy ngay trong thread chính
+            try:
+                self.work(stop, queues, options)
+            except KeyboardInterrupt:
+                pass
+            return
+        threads = [threading.Thread(target = self.work, args = (stop, queues, options), name = 'job-worker-%d' % i,
+                                    daemon = True) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        last_stats = time.monotonic()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout = 1.0)
+                if options['stats_interval'] and time.monotonic() - last_stats >= options['stats_interval']:
+                    last_stats = time.monotonic()
+                    self.write_depth()
+        except KeyboardInterrupt:
+            self.stdout.write('Đang dừng, chờ các worker chạy xong lô hiện tại...')
+            stop.set()
+            for thread in threads:
+                thread.join()
+        finally:
+            connection.close()
+
+    def work(self, stop, queues, options):
+        try:
+            while not stop.is_set():
+                close_old_connections()
+                try:
+                    count, stats = jobs.process_batch(queues, options['batch_size'])
+                except Exception:
+                    if options['once']:
+                        raise
+                    # Lỗi DB (mất kết nối, deadlock khi nhận việc): thử lại sau, không để worker chết
+                    jobs.logger.exception('Không nhận được việc')
+                    stop.wait(options['sleep'])
+                    continue
+                if count:
+                    self.stdout.write('%s: %d việc: %s' % (threading.current_thread().name, count,
+                                                          ', '.join('%s=%s' % item for item in stats.items())))
+                    continue
+                if options['once']:
+                    return
+                stop.wait(options['sleep'])
+        finally:
+            # Mỗi thread có kết nối DB riêng
+            connection.close()
+
+    def write_depth(self):
+        close_old_connections()
+        for queue, row in jobs.depth().items():
+            self.stdout.write('%s: %s' % (queue, ', '.join('%s=%s' % item for item in row.items())))
@@ -0,0 +1,22 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from shopping.datagen import BASE_COUNTS, DataGenerator, scaled_counts
+
+
+class Command(BaseCommand):
+    help = 'Sinh dữ liệu giả lập (user, shop, sản phẩm, đánh giá, giỏ hàng, đơn hàng...) bằng bulk insert'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type = float, default = 1.0,
+                            help = 'Hệ số nhân cho số lượng mặc định: %s' % BASE_COUNTS)
+        parser.add_argument('--seed', type = int, default = None)
+        for name in BASE_COUNTS:
+            parser.add_argument('--%s' % name, type = int, default = None)
+
+    def handle(self, *args, **options):
+        counts = scaled_counts(options['scale'], **{name: options[name] for name in BASE_COUNTS})
+        DataGenerator(counts, seed = options['seed'], log = self.stdout.write).run()
+        # bulk insert không qua save(): tính khoá tìm kiếm cho sản phẩm/shop vừa sinh
+        call_command('backfill_search_keys', stdout = self.stdout)
+        self.stdout.write(self.style.SUCCESS('Đã sinh dữ liệu: %s' % counts))
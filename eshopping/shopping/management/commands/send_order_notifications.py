@@ -0,0 +1,33 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from shopping.notifications import process_batch
+
+
+class Command(BaseCommand):
+    help = 'Gửi email thông báo đơn hàng trong outbox theo lô trên một kết nối SMTP dùng lại'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type = int, default = 100)
+        parser.add_argument('--sleep', type = float, default = 2.0, help = 'Số giây chờ khi không còn thông báo')
+        parser.add_argument('--once', action = 'store_true', help = 'Gửi hết thông báo đang tới hạn rồi thoát')
+
+    def handle(self, *args, **options):
+        mail_connection = get_connection(fail_silently = False)
+        try:
+            while True:
+                close_old_connections()
+                count, stats = process_batch(mail_connection, options['batch_size'])
+                if count:
+                    self.stdout.write('%d thông báo: %s' % (count, ', '.join('%s=%s' % item for item in stats.items())))
+                    continue
+                # Không còn việc: đóng kết nối SMTP thay vì để server cắt vì để lâu không dùng
+                mail_connection.close()
+                if options['once']:
+                    return
+                time.sleep(options['sleep'])
+        finally:
+            mail_connection.close()
@@ -0,0 +1,199 @@
+import contextvars
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SQL_TIME_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+# Số mẫu truy vấn lặp lại được giữ lại cho mỗi endpoint
+MAX_SHAPES = 10
+
+_IN_LIST = re.compile(r'\((?:%s|\?)(?:\s*,\s*(?:%s|\?))+\)')
+_NUMBER = re.compile(r'\b\d+\b')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+
+
+@lru_cache(maxsize = 4096)
+def query_shape(sql):
+    # Chuẩn hoá câu SQL thành "hình dạng": gộp danh sách IN, bỏ hằng số (LIMIT/OFFSET, literal)
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    return _IN_LIST.sub('(...)', sql)
+
+
+class QueryRecorder:
+    # Đếm số truy vấn, thời gian SQL và số lần lặp lại của từng hình dạng truy vấn
+    def __init__(self, n_plus_one_threshold = 5):
+        self.threshold = n_plus_one_threshold
+        self.count = 0
+        self.time_ms = 0.0
+        self.shapes = Counter()
+        # Các truy vấn của một request async có thể chạy song song trong nhiều thread sync_to_async
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self.lock:
+                self.time_ms += elapsed_ms
+                self.count += 1
+                self.shapes[query_shape(sql)] += 1
+
+    def repeated(self):
+        # Cùng một hình dạng truy vấn chạy nhiều lần trong một request: dấu hiệu N+1
+        return {shape: count for shape, count in self.shapes.items() if count >= self.threshold}
+
+    @contextmanager
+    def capture(self):
+        # Recorder được đặt vào context hiện tại chứ không gắn vào kết nối của thread hiện tại: view async chạy
+        # ORM trong thread của sync_to_async, thread đó nhận bản sao context nên record_query vẫn thấy recorder
+        for conn in connections.all():
+            attach(conn)
+        token = _active.set(self)
+        try:
+            yield self
+        finally:
+            _active.reset(token)
+
+
+_active = contextvars.ContextVar('shopping.metrics.recorder', default = None)
+
+
+def record_query(execute, sql, params, many, context):
+    recorder = _active.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def attach(connection):
+    # Wrapper cố định nằm đầu danh sách: các connection.execute_wrapper() tạm thời pop() phần tử cuối khi thoát
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+@receiver(connection_created, dispatch_uid = 'shopping.metrics.attach')
+def attach_recorder(sender, connection, **kwargs):
+    attach(connection)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def percentile(self, p):
+        # Ước lượng theo cận trên của bucket chứa phân vị p
+        if not self.count:
+            return None
+        target = self.count * p
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return None
+
+    def as_dict(self):
+        labels = [str(b) for b in self.buckets] + ['+Inf']
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 3),
+            'avg': round(self.sum / self.count, 3) if self.count else None,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'buckets': dict(zip(labels, self.counts)),
+        }
+
+
+class EndpointMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.sampled = 0
+        self.n_plus_one = 0
+        self.latency_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.query_count = Histogram(QUERY_COUNT_BUCKETS)
+        self.sql_time_ms = Histogram(SQL_TIME_BUCKETS_MS)
+        self.repeated_shapes = Counter()
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'sampled': self.sampled,
+            'n_plus_one': self.n_plus_one,
+            'latency_ms': self.latency_ms.as_dict(),
+            'query_count': self.query_count.as_dict(),
+            'sql_time_ms': self.sql_time_ms.as_dict(),
+            'repeated_shapes': [{'shape': shape, 'count': count}
+                                for shape, count in self.repeated_shapes.most_common(MAX_SHAPES)],
+        }
+
+
+_lock = threading.Lock()
+_endpoints = {}
+_counters = Counter()
+
+
+def record_request(endpoint, status_code, latency_ms, queries = None):
+    # queries: QueryRecorder của request nếu request được lấy mẫu, None nếu không
+    with _lock:
+        metrics = _endpoints.get(endpoint)
+        if metrics is None:
+            metrics = _endpoints[endpoint] = EndpointMetrics()
+        metrics.requests += 1
+        if status_code >= 500:
+            metrics.errors += 1
+        metrics.latency_ms.observe(latency_ms)
+        if queries is not None:
+            metrics.sampled += 1
+            metrics.query_count.observe(queries.count)
+            metrics.sql_time_ms.observe(queries.time_ms)
+            repeated = queries.repeated()
+            if repeated:
+                metrics.n_plus_one += 1
+                metrics.repeated_shapes.update(repeated)
+                if len(metrics.repeated_shapes) > MAX_SHAPES * 5:
+                    metrics.repeated_shapes = Counter(dict(metrics.repeated_shapes.most_common(MAX_SHAPES)))
+
+
+def increment(name, value = 1):
+    with _lock:
+        _counters[name] += value
+
+
+def snapshot():
+    with _lock:
+        return {
+            'endpoints': {name: metrics.as_dict() for name, metrics in sorted(_endpoints.items())},
+            'counters': dict(_counters),
+        }
+
+
+def reset():
+    with _lock:
+        _endpoints.clear()
+        _counters.clear()
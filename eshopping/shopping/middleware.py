@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import random
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.permissions import SAFE_METHODS
+
+from . import metrics
+from .metrics import QueryRecorder
+from .routers import RouteState, set_route, reset_route, pin_user, sticky_seconds, resolved_user
+
+logger = logging.getLogger('shopping.instrumentation')
+
+
+class HybridMiddleware:
+    # Chạy được cả dưới WSGI lẫn ASGI (giống MiddlewareMixin của Django), để các async view
+    # trong async_views.py không bị ép về một thread đồng bộ
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+
+class ReplicaRoutingMiddleware(HybridMiddleware):
+    # Request đọc (GET/HEAD/OPTIONS) được phép đọc từ replica, request ghi luôn dùng primary.
+    # Sau một request ghi thành công, client được đánh dấu cookie và user được ghim vào primary
+    # trong REPLICA_STICKY_SECONDS giây để luôn đọc được dữ liệu mình vừa ghi.
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state = RouteState(request, use_replica = self.can_use_replica(request))
+        token = set_route(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            reset_route(token)
+        if self.should_pin(request, response):
+            self.pin(request, response)
+        return self.wrap_streaming(response, state)
+
+    async def __acall__(self, request):
+        # Context var được sao chép sang các thread của sync_to_async nên ORM trong view vẫn thấy route
+        state = RouteState(request, use_replica = self.can_use_replica(request))
+        token = set_route(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            reset_route(token)
+        if self.should_pin(request, response):
+            # Lấy user từ session và ghi cache đều là I/O đồng bộ
+            await sync_to_async(self.pin)(request, response)
+        return self.wrap_streaming(response, state)
+
+    def should_pin(self, request, response):
+        return request.method not in SAFE_METHODS and response.status_code < 400
+
+    def wrap_streaming(self, response, state):
+        if response.streaming:
+            response.streaming_content = self.stream_with_route(state, response.streaming_content)
+        return response
+
+    def can_use_replica(self, request):
+        return request.method in SAFE_METHODS and self.cookie_name() not in request.COOKIES
+
+    def pin(self, request, response):
+        response.set_cookie(self.cookie_name(), '1', max_age = sticky_seconds(), httponly = True)
+        user = resolved_user(request)
+        if user is not None and user.is_authenticated:
+            pin_user(user)
+
+    def cookie_name(self):
+        return getattr(settings, 'REPLICA_PIN_COOKIE', 'primary_pin')
+
+    def stream_with_route(self, state, content):
+        # Nội dung streaming được sinh ra sau khi middleware trả về, cần gán lại trạng thái định tuyến cho từng chunk
+        iterator = iter(content)
+        while True:
+            token = set_route(state)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                reset_route(token)
+            yield chunk
+
+
+class InstrumentationMiddleware(HybridMiddleware):
+    # Ghi lại độ trễ của từng action trong viewset (ví dụ ProductViewSet.list). Với các request được lấy mẫu
+    # (INSTRUMENTATION_SAMPLE_RATE) ghi thêm số truy vấn, thời gian SQL và các truy vấn lặp lại (N+1).
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.sample_rate = getattr(settings, 'INSTRUMENTATION_SAMPLE_RATE', 1.0)
+        self.threshold = getattr(settings, 'INSTRUMENTATION_N_PLUS_ONE_THRESHOLD', 5)
+
+    def sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        recorder = None
+        if self.sampled():
+            recorder = QueryRecorder(self.threshold)
+            with recorder.capture():
+                response = self.get_response(request)
+        else:
+            response = self.get_response(request)
+        return self.finish(request, response, start, recorder)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        recorder = None
+        if self.sampled():
+            recorder = QueryRecorder(self.threshold)
+            with recorder.capture():
+                response = await self.get_response(request)
+        else:
+            response = await self.get_response(request)
+        return self.finish(request, response, start, recorder)
+
+    def finish(self, request, response, start, recorder):
+        if response.streaming:
+            response.streaming_content = self.stream_and_record(request, response, response.streaming_content,
+                                                                start, recorder)
+        else:
+            self.record(request, response, start, recorder)
+        return response
+
+    def stream_and_record(self, request, response, content, start, recorder):
+        # Phần lớn truy vấn của response streaming chạy trong lúc sinh nội dung.
+        # content phải được lấy trước khi gán lại streaming_content, nếu không generator sẽ tự đọc chính nó
+        iterator = iter(content)
+        try:
+            while True:
+                if recorder is None:
+                    chunk = next(iterator, None)
+                else:
+                    with recorder.capture():
+                        chunk = next(iterator, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            self.record(request, response, start, recorder)
+
+    def record(self, request, response, start, recorder):
+        latency_ms = (time.perf_counter() - start) * 1000
+        endpoint = endpoint_name(request)
+        metrics.record_request(endpoint, response.status_code, latency_ms, recorder)
+        if recorder is not None:
+            for shape, count in recorder.repeated().items():
+                logger.warning('Possible N+1 in %s: %d x %s', endpoint, count, shape)
+
+
+def endpoint_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unmatched>'
+    func = match.func
+    view_class = getattr(func, 'cls', None) or getattr(func, 'view_class', None)
+    if view_class is None:
+        return match.view_name or getattr(func, '__name__', '<unknown>')
+    actions = getattr(func, 'actions', None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    return '%s.%s' % (view_class.__name__, action)
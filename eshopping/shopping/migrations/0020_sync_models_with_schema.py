@@ -0,0 +1,137 @@
+# Generated by Django 4.1.7 on 2026-10-19 18:33
+
+import ckeditor.fields
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Min, OuterRef, Subquery
+import django.db.models.deletion
+
+# Payment.order từ ManyToMany thành ForeignKey và thêm Order.user, giữ dữ liệu cũ: liên kết payment -> đơn được chép
+# sang cột mới trước khi bỏ bảng trung gian (payment gắn nhiều đơn thì giữ đơn có id nhỏ nhất), user của đơn lấy từ
+# payment của đơn, không có thì từ user có cùng email. Còn đơn không xác định được user thì migration dừng lại để
+# gán tay trước khi Order.user thành NOT NULL.
+# DB đã được sửa tay cho khớp models.py (đã có payment.order_id, order.user_id) thì chỉ ghi nhận migration:
+#   manage.py migrate shopping 0020 --fake
+CHUNK_SIZE = 1000
+
+
+def copy_order_links(apps, schema_editor):
+    Payment = apps.get_model('shopping', 'Payment')
+    Order = apps.get_model('shopping', 'Order')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    through = Payment._meta.get_field('order').remote_field.through
+    links = list(through.objects.values('payment_id').annotate(first_order = Min('order_id'))
+                 .order_by('payment_id').values_list('payment_id', 'first_order'))
+    for i in range(0, len(links), CHUNK_SIZE):
+        Payment.objects.bulk_update([Payment(id = payment_id, order_link_id = order_id)
+                                     for payment_id, order_id in links[i:i + CHUNK_SIZE]], ['order_link'])
+    Order.objects.filter(user__isnull = True).update(user_id = Subquery(
+        Payment.objects.filter(order_link_id = OuterRef('pk')).order_by('id').values('user_id')[:1]))
+    Order.objects.filter(user__isnull = True).update(user_id = Subquery(
+        User.objects.filter(email = OuterRef('email')).order_by('id').values('id')[:1]))
+    missing = Order.objects.filter(user__isnull = True).count()
+    if missing:
+        raise RuntimeError('%d đơn hàng không xác định được user (không có payment, không có user cùng email): gán '
+                           'Order.user cho các đơn này rồi chạy lại migrate' % missing)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopping', '0019_alter_shop_address_alter_shop_email_alter_shop_phone'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='cartdetail',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='orderdetail',
+            unique_together=set(),
+        ),
+        migrations.RemoveField(
+            model_name='business',
+            name='category',
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='status_ship',
+            field=models.CharField(choices=[('normal_delivery', 'Giao hàng tiết kiệm'), ('fast_delivery', 'Giao hàng nhanh')], default='normal_delivery', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='user', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='order_link',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='shopping.order'),
+        ),
+        migrations.RunPython(copy_order_links, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='category',
+            name='description',
+            field=ckeditor.fields.RichTextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='like',
+            name='description',
+            field=ckeditor.fields.RichTextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='description',
+            field=ckeditor.fields.RichTextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('created', 'Created'), ('confirm', 'Confirm'), ('paid', 'Paid'), ('shipped', 'Shipped'), ('delivered', 'Delivered'), ('cancelled', 'Cancelled')], default='created', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='orderdetail',
+            name='description',
+            field=ckeditor.fields.RichTextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='description',
+            field=ckeditor.fields.RichTextField(blank=True, null=True),
+        ),
+        migrations.RemoveField(
+            model_name='payment',
+            name='order',
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='description',
+            field=ckeditor.fields.RichTextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='shop',
+            name='description',
+            field=ckeditor.fields.RichTextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='avatar',
+            field=models.ImageField(upload_to='avatar/'),
+        ),
+        migrations.RenameField(
+            model_name='payment',
+            old_name='order_link',
+            new_name='order',
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='order',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='orders', to='shopping.order'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='user',
+            field=models.ForeignKey(default=None, on_delete=django.db.models.deletion.PROTECT, related_name='user', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
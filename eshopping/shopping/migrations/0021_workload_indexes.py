@@ -0,0 +1,41 @@
+# Generated by Django 4.1.7 on 2026-10-19 18:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopping', '0020_sync_models_with_schema'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cartdetail',
+            index=models.Index(fields=['cart', 'product', 'colors', 'sizes'], name='cartdetail_line'),
+        ),
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(fields=['product_id', 'active'], name='like_product_active'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'created_date'], name='order_user_created'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'created_date'], name='order_status_created'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['active', 'category', 'price'], name='product_active_category_price'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['active', 'category', 'name'], name='product_active_category_name'),
+        ),
+        migrations.AddIndex(
+            model_name='productreview',
+            index=models.Index(fields=['product', 'active', 'created_date'], name='review_product_active_created'),
+        ),
+    ]
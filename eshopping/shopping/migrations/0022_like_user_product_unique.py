@@ -0,0 +1,30 @@
+# Generated by Django 4.1.7 on 2026-10-19 18:56
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def remove_duplicate_likes(apps, schema_editor):
+    # Mỗi cặp (user, sản phẩm) giữ lại dòng được cập nhật gần nhất (trạng thái thích cuối cùng của user)
+    Like = apps.get_model('shopping', 'Like')
+    duplicates = Like.objects.values('user_id', 'product_id').annotate(total = Count('id')).filter(total__gt = 1) \
+        .order_by()
+    for pair in duplicates.iterator():
+        ids = list(Like.objects.filter(user_id = pair['user_id'], product_id = pair['product_id'])
+                   .order_by('-updated_date', '-id').values_list('id', flat = True))
+        Like.objects.filter(id__in = ids[1:]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopping', '0021_workload_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_likes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='like',
+            constraint=models.UniqueConstraint(fields=('user_id', 'product_id'), name='like_user_product_unique'),
+        ),
+    ]
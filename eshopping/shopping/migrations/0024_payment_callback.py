@@ -0,0 +1,35 @@
+# Generated by Django 4.1.7 on 2026-10-19 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopping', '0023_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentCallback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gateway', models.CharField(choices=[('COD', 'Cash on Deliver'), ('PAYPAL', 'Paypal'), ('BANK_TRANSFER', 'Bank Transfer'), ('MOMO', 'Momo'), ('ZALOPAY', 'ZaloPay')], max_length=20)),
+                ('event_id', models.CharField(max_length=255)),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('applied', 'Applied'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.SmallIntegerField(default=0)),
+                ('error', models.CharField(blank=True, default='', max_length=255)),
+                ('received_date', models.DateTimeField(auto_now_add=True)),
+                ('processed_date', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='paymentcallback',
+            index=models.Index(fields=['status', 'id'], name='paymentcallback_status_id'),
+        ),
+        migrations.AddConstraint(
+            model_name='paymentcallback',
+            constraint=models.UniqueConstraint(fields=('event_id', 'gateway'), name='paymentcallback_event_gateway'),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 4.1.7 on 2026-10-19 19:22
+
+import ckeditor.fields
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopping', '0025_order_notification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('description', ckeditor.fields.RichTextField(blank=True, null=True)),
+                ('active', models.BooleanField(default=True)),
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_date', models.DateTimeField()),
+                ('updated_date', models.DateTimeField()),
+                ('name', models.CharField(max_length=255)),
+                ('email', models.EmailField(max_length=255)),
+                ('phone', models.CharField(max_length=10)),
+                ('address', models.CharField(max_length=255)),
+                ('total_amount', models.IntegerField()),
+                ('status', models.CharField(choices=[('created', 'Created'), ('confirm', 'Confirm'), ('paid', 'Paid'), ('shipped', 'Shipped'), ('delivered', 'Delivered'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('status_ship', models.CharField(choices=[('normal_delivery', 'Giao hàng tiết kiệm'), ('fast_delivery', 'Giao hàng nhanh')], max_length=20)),
+                ('archived_date', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='archived_orders', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedPayment',
+            fields=[
+                ('description', ckeditor.fields.RichTextField(blank=True, null=True)),
+                ('active', models.BooleanField(default=True)),
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_date', models.DateTimeField()),
+                ('updated_date', models.DateTimeField()),
+                ('payment_method', models.CharField(choices=[('COD', 'Cash on Deliver'), ('PAYPAL', 'Paypal'), ('BANK_TRANSFER', 'Bank Transfer'), ('MOMO', 'Momo'), ('ZALOPAY', 'ZaloPay')], max_length=255)),
+                ('payment_status', models.CharField(choices=[('FAIL', 'Payment Fail'), ('SUCCESS', 'Payment Success')], max_length=255)),
+                ('total_amount', models.IntegerField()),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='shopping.archivedorder')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='archived_payments', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderDetail',
+            fields=[
+                ('description', ckeditor.fields.RichTextField(blank=True, null=True)),
+                ('active', models.BooleanField(default=True)),
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_date', models.DateTimeField()),
+                ('updated_date', models.DateTimeField()),
+                ('price', models.IntegerField()),
+                ('discount', models.IntegerField()),
+                ('quantity', models.IntegerField()),
+                ('colors', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_lines', to='shopping.color')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_detail', to='shopping.archivedorder')),
+                ('product', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_lines', to='shopping.product')),
+                ('sizes', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_lines', to='shopping.size')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['user', 'created_date'], name='archivedorder_user_created'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['created_date'], name='archivedorder_created'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.1.7 on 2026-10-19 19:27
+
+from django.db import migrations, models
+
+from shopping.search import tokens
+from shopping.textnorm import search_key
+
+CHUNK_SIZE = 1000
+
+
+def backfill_search_keys(apps, schema_editor):
+    # Sản phẩm/shop đã có: tính search_key và token theo khối khoá chính (như lệnh backfill_search_keys)
+    SearchToken = apps.get_model('shopping', 'SearchToken')
+    for kind, name in (('product', 'Product'), ('shop', 'Shop')):
+        model = apps.get_model('shopping', name)
+        last_id = 0
+        while True:
+            rows = [(pk, search_key(value)) for pk, value in
+                    model.objects.filter(id__gt = last_id).order_by('id').values_list('id', 'name')[:CHUNK_SIZE]]
+            if not rows:
+                break
+            model.objects.bulk_update([model(id = pk, search_key = key) for pk, key in rows], ['search_key'])
+            SearchToken.objects.bulk_create([SearchToken(kind = kind, token = token, object_id = pk)
+                                             for pk, key in rows for token in tokens(key)], ignore_conflicts = True)
+            last_id = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopping', '0026_order_archive'),
+    ]
+
+    # Mỗi khối được commit riêng, bảng lớn không bị giữ trong một transaction dài
+    atomic = False
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=10)),
+                ('token', models.CharField(max_length=3)),
+                ('object_id', models.BigIntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='search_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='search_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='searchtoken',
+            index=models.Index(fields=['kind', 'object_id'], name='searchtoken_kind_object'),
+        ),
+        migrations.AddConstraint(
+            model_name='searchtoken',
+            constraint=models.UniqueConstraint(fields=('kind', 'token', 'object_id'), name='searchtoken_kind_token_object'),
+        ),
+        migrations.RunPython(backfill_search_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 4.1.7 on 2026-10-19 19:40
+
+from django.db import migrations, models
+
+CHUNK_SIZE = 1000
+SNAPSHOT_FIELDS = ['product_name', 'product_thumbnail', 'shop_name', 'size_name', 'color_name']
+
+
+def backfill_snapshots(apps, schema_editor):
+    # Dòng đơn cũ lấy thông tin sản phẩm/shop hiện tại (gần nhất với lúc đặt mà còn biết được), theo khối khoá chính;
+    # dòng có sản phẩm đã bị xoá để trống tên
+    sizes = dict(apps.get_model('shopping', 'Size').objects.values_list('id', 'name'))
+    colors = dict(apps.get_model('shopping', 'Color').objects.values_list('id', 'name'))
+    for name in ('OrderDetail', 'ArchivedOrderDetail'):
+        model = apps.get_model('shopping', name)
+        last_id = 0
+        while True:
+            rows = list(model.objects.filter(id__gt = last_id).order_by('id').values_list(
+                'id', 'product__name', 'product__thumbnail', 'product__shop__name', 'sizes_id', 'colors_id')[:CHUNK_SIZE])
+            if not rows:
+                break
+            model.objects.bulk_update([
+                model(id = pk, product_name = product_name or '', product_thumbnail = (thumbnail or '')[:255],
+                      shop_name = shop_name or '', size_name = sizes.get(size_id, '')[:25],
+                      color_name = colors.get(color_id, ''))
+                for pk, product_name, thumbnail, shop_name, size_id, color_id in rows], SNAPSHOT_FIELDS)
+            last_id = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopping', '0028_job_queue'),
+    ]
+
+    # Mỗi khối được commit riêng, bảng lớn không bị giữ trong một transaction dài
+    atomic = False
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorderdetail',
+            name='color_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='archivedorderdetail',
+            name='product_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='archivedorderdetail',
+            name='product_thumbnail',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='archivedorderdetail',
+            name='shop_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='archivedorderdetail',
+            name='size_name',
+            field=models.CharField(blank=True, default='', max_length=25),
+        ),
+        migrations.AddField(
+            model_name='orderdetail',
+            name='color_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='orderdetail',
+            name='product_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='orderdetail',
+            name='product_thumbnail',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='orderdetail',
+            name='shop_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='orderdetail',
+            name='size_name',
+            field=models.CharField(blank=True, default='', max_length=25),
+        ),
+        migrations.RunPython(backfill_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.1.7 on 2026-10-19 19:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+CHUNK_SIZE = 1000
+PROFILE_FIELDS = ['business_name', 'address', 'phone', 'tax_code', 'status']
+
+
+def copy_profiles(apps, schema_editor):
+    # Chép hồ sơ của các doanh nghiệp đã có, theo khối khoá chính
+    Business = apps.get_model('shopping', 'Business')
+    BusinessProfile = apps.get_model('shopping', 'BusinessProfile')
+    last_id = 0
+    while True:
+        rows = list(Business.objects.filter(pk__gt = last_id).order_by('pk')
+                    .values_list('pk', *PROFILE_FIELDS)[:CHUNK_SIZE])
+        if not rows:
+            break
+        BusinessProfile.objects.bulk_create([BusinessProfile(user_id = pk, **dict(zip(PROFILE_FIELDS, values)))
+                                             for pk, *values in rows], ignore_conflicts = True)
+        last_id = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopping', '0029_order_line_snapshots'),
+    ]
+
+    # Mỗi khối được commit riêng
+    atomic = False
+
+    operations = [
+        migrations.CreateModel(
+            name='BusinessProfile',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='business_profile', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('business_name', models.CharField(max_length=255)),
+                ('address', models.CharField(max_length=255)),
+                ('phone', models.CharField(max_length=10)),
+                ('tax_code', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('confirmed', 'Confirmed'), ('unconfirmed', 'Unconfirmed')], default='unconfirmed', max_length=20)),
+            ],
+        ),
+        migrations.RunPython(copy_profiles, migrations.RunPython.noop),
+    ]
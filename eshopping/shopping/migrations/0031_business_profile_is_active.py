@@ -0,0 +1,51 @@
+# Generated by Django 4.1.7 on 2026-10-19 20:05
+
+from django.db import migrations, models
+import shopping.models
+
+CHUNK_SIZE = 1000
+
+
+def copy_inactive_users(apps, schema_editor):
+    # Hồ sơ mới mặc định is_active = True: đánh dấu lại hồ sơ của các tài khoản đã bị khoá, theo khối khoá chính
+    User = apps.get_model('shopping', 'User')
+    BusinessProfile = apps.get_model('shopping', 'BusinessProfile')
+    last_id = 0
+    while True:
+        ids = list(User.objects.filter(pk__gt = last_id, is_active = False).order_by('pk')
+                   .values_list('pk', flat = True)[:CHUNK_SIZE])
+        if not ids:
+            break
+        BusinessProfile.objects.filter(pk__in = ids).update(is_active = False)
+        last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopping', '0030_business_profile'),
+    ]
+
+    # Mỗi khối được commit riêng
+    atomic = False
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='business',
+            managers=[
+                ('objects', shopping.models.UserManager()),
+            ],
+        ),
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', shopping.models.UserManager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='businessprofile',
+            name='is_active',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.RunPython(copy_inactive_users, migrations.RunPython.noop),
+    ]
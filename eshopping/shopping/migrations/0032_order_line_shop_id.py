@@ -0,0 +1,48 @@
+# Generated by Django 4.1.7 on 2026-10-19 20:11
+
+from django.db import migrations, models
+
+CHUNK_SIZE = 1000
+
+
+def backfill_shop_ids(apps, schema_editor):
+    # Như 0029: dòng đơn cũ lấy shop hiện tại của sản phẩm, theo khối khoá chính; sản phẩm đã xoá thì để trống
+    for name in ('OrderDetail', 'ArchivedOrderDetail'):
+        model = apps.get_model('shopping', name)
+        last_id = 0
+        while True:
+            rows = list(model.objects.filter(id__gt = last_id).order_by('id')
+                        .values_list('id', 'product__shop_id')[:CHUNK_SIZE])
+            if not rows:
+                break
+            model.objects.bulk_update([model(id = pk, shop_id = shop_id) for pk, shop_id in rows], ['shop_id'])
+            last_id = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopping', '0031_business_profile_is_active'),
+    ]
+
+    # Mỗi khối được commit riêng, bảng lớn không bị giữ trong một transaction dài
+    atomic = False
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorderdetail',
+            name='shop_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderdetail',
+            name='shop_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_shop_ids, migrations.RunPython.noop),
+        # Tạo index sau khi đã điền xong
+        migrations.AddIndex(
+            model_name='orderdetail',
+            index=models.Index(fields=['shop_id', 'id'], name='orderdetail_shop_id'),
+        ),
+    ]
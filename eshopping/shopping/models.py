@@ -1,15 +1,52 @@
 import datetime
 
-from django.db import models
-from django.contrib.auth.models import AbstractUser, Group, PermissionsMixin
+from django.db import models, transaction
+from django.db.models import OuterRef, Subquery
+from django.contrib.auth.models import AbstractUser, Group, PermissionsMixin, UserManager as AuthUserManager
 from django.core.validators import *
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from ckeditor.fields import RichTextField
 
+from .textnorm import search_key
+
 
 # Create your models here.
 
 
+class SearchKeyMixin(models.Model):
+    # Tên đã bỏ dấu, chữ thường (shopping/search.py): được tính lại mỗi lần save
+    search_key = models.CharField(max_length = 255, blank = True, default = '', editable = False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        key = search_key(self.name)
+        # Giá trị đang có (None nếu cột bị defer): token tìm kiếm chỉ được ghi lại khi tên đổi
+        self._search_key_changed = self.__dict__.get('search_key') != key
+        self.search_key = key
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'search_key'}
+        super().save(*args, **kwargs)
+
+
+class OrderLineSnapshotMixin(models.Model):
+    # Thông tin sản phẩm lúc đặt hàng (shopping/snapshots.py): lịch sử đơn đọc từ đây, không join sang sản phẩm/shop
+    # đang bán và không đổi khi người bán sửa hoặc xoá sản phẩm; giá và khuyến mãi đã nằm trên dòng đơn
+    product_name = models.CharField(max_length = 255, blank = True, default = '')
+    product_thumbnail = models.CharField(max_length = 255, blank = True, default = '')
+    # Mã shop bán dòng này (không phải khoá ngoại): xuất/lọc đơn theo shop không đổi khi sản phẩm chuyển shop
+    shop_id = models.IntegerField(null = True, blank = True)
+    shop_name = models.CharField(max_length = 255, blank = True, default = '')
+    size_name = models.CharField(max_length = 25, blank = True, default = '')
+    color_name = models.CharField(max_length = 255, blank = True, default = '')
+
+    class Meta:
+        abstract = True
+
+
 class BaseModel(models.Model):
     created_date = models.DateTimeField(auto_now_add = True)
     updated_date = models.DateTimeField(auto_now = True)
@@ -20,9 +57,46 @@ class BaseModel(models.Model):
         abstract = True
 
 
+class UserQuerySet(models.QuerySet):
+    # update() không gọi save(): các trường hồ sơ bị đổi (status, is_active...) được chép sang BusinessProfile
+    # trong cùng transaction, kể cả với Business.objects.filter(...).update(status = ...) và action hàng loạt của admin
+    def update(self, **kwargs):
+        fields = [field for field in kwargs if field in Business.PROFILE_FIELDS]
+        if not fields:
+            return super().update(**kwargs)
+        with transaction.atomic(using = self.db):
+            ids = list(self.values_list('pk', flat = True))
+            rows = super().update(**kwargs)
+            sync_profiles(ids, fields, using = self.db, apps = self.model._meta.apps)
+        return rows
+
+
+class UserManager(AuthUserManager.from_queryset(UserQuerySet)):
+    pass
+
+
 class User(AbstractUser):
     avatar = models.ImageField(upload_to = "avatar/")
 
+    objects = UserManager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_is_active = instance.__dict__.get('is_active')
+        return instance
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        # Khoá/mở tài khoản qua User (UserAdmin, API user) cũng phải tới hồ sơ doanh nghiệp, chỉ khi is_active đổi;
+        # Business.save() tự chép
+        update_fields = kwargs.get('update_fields')
+        if (type(self) is User and not adding and self.is_active != getattr(self, '_loaded_is_active', None)
+                and (update_fields is None or 'is_active' in update_fields)):
+            BusinessProfile.objects.filter(pk = self.pk).update(is_active = self.is_active)
+        self._loaded_is_active = self.is_active
+
 
 
 class Category(BaseModel):
@@ -39,7 +113,7 @@ class Category(BaseModel):
 
 
 # Sản phẩm:  Tên sản phẩm, số lượng, thumnail sản phẩm, giá cả, khuyến mãi, kích thước, màu sắc( nếu có), loại sản phẩm(fk), cửa hàng(fk)
-class Product(BaseModel):
+class Product(SearchKeyMixin, BaseModel):
     name = models.CharField(max_length = 255, null = False)
     quantity = models.IntegerField(validators = [MinValueValidator(0)], null = False)
     thumbnail = models.ImageField(upload_to = "shopping/%Y/%m", default = None)
@@ -55,6 +129,16 @@ class Product(BaseModel):
     def __str__(self):
         return self.name
 
+    class Meta:
+        # Index theo workload đo được (manage.py advise_indexes): danh sách sản phẩm lọc active + danh mục,
+        # sắp xếp theo giá hoặc tên
+        indexes = [
+            models.Index(fields = ['active', 'category', 'price'], name = 'product_active_category_price'),
+            models.Index(fields = ['active', 'category', 'name'], name = 'product_active_category_name'),
+            # Tìm theo tiền tố tên trong admin
+            models.Index(fields = ['name'], name = 'product_name'),
+        ]
+
 
 # Màu sắc: Tên màu, mô tả
 class Color(models.Model):
@@ -76,6 +160,16 @@ class Like(BaseModel):
     user_id = models.ForeignKey(User, on_delete = models.CASCADE, related_name = "liked")
     product_id = models.ForeignKey(Product, on_delete = models.CASCADE, related_name = "liked")
 
+    class Meta:
+        # Mỗi user chỉ có một dòng cho mỗi sản phẩm, thích/bỏ thích là đảo cờ active
+        constraints = [
+            models.UniqueConstraint(fields = ['user_id', 'product_id'], name = 'like_user_product_unique'),
+        ]
+        # Subquery đếm lượt thích của từng sản phẩm trong danh sách
+        indexes = [
+            models.Index(fields = ['product_id', 'active'], name = 'like_product_active'),
+        ]
+
 
 # Doanh nghiệp: Tên doanh nghiệp, địa chỉ kinh doanh, mã số thuế, số điện thoại, loại hàng sẽ bán.
 class Business(User):
@@ -90,11 +184,56 @@ class Business(User):
     tax_code = models.CharField(max_length = 255, null = False)
     status = status = models.CharField(max_length = 20, choices = STATUS_CHOICES, default = 'unconfirmed')
 
+    # Các trường được chép sang BusinessProfile mỗi lần save() và mỗi lần queryset.update()
+    PROFILE_FIELDS = ['business_name', 'address', 'phone', 'tax_code', 'status', 'is_active']
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not set(update_fields) & set(self.PROFILE_FIELDS):
+            return
+        values = {field: getattr(self, field) for field in self.PROFILE_FIELDS}
+        if adding or not BusinessProfile.objects.filter(pk = self.pk).update(**values):
+            BusinessProfile.objects.create(user_id = self.pk, **values)
+
     class Meta:
         verbose_name = 'Business'
         verbose_name_plural = 'Business'
 
 
+# Bản sao hồ sơ doanh nghiệp không qua kế thừa nhiều bảng: khoá chính là id user nên kiểm tra quyền doanh nghiệp và
+# xác thực business của shop chỉ đọc một dòng theo khoá chính (user.business_profile, select_related được), không
+# join shopping_user với shopping_business. Business.save(), User.save() và UserQuerySet.update() ghi đồng bộ; ghi
+# thẳng bằng SQL thì chạy lại sync_profiles().
+class BusinessProfile(models.Model):
+    user = models.OneToOneField(User, primary_key = True, related_name = 'business_profile',
+                                on_delete = models.CASCADE)
+    business_name = models.CharField(max_length = 255, null = False)
+    address = models.CharField(max_length = 255, null = False)
+    phone = models.CharField(max_length = 10, null = False)
+    tax_code = models.CharField(max_length = 255, null = False)
+    status = models.CharField(max_length = 20, choices = Business.STATUS_CHOICES, default = 'unconfirmed')
+    is_active = models.BooleanField(default = True)
+
+    def __str__(self):
+        return self.business_name
+
+
+PROFILE_SYNC_CHUNK = 1000
+
+
+def sync_profiles(ids, fields, using = None, apps = None):
+    # Chép lại các trường hồ sơ từ Business cho các user trong ids, mỗi khối một câu UPDATE với subquery tương quan.
+    # apps: registry của model gọi tới (model lịch sử trong migration dùng đúng các bảng lúc đó)
+    apps = apps or Business._meta.apps
+    business, profile = apps.get_model('shopping', 'Business'), apps.get_model('shopping', 'BusinessProfile')
+    ids = sorted(ids)
+    values = {field: Subquery(business.objects.filter(pk = OuterRef('pk')).values(field)[:1]) for field in fields}
+    for start in range(0, len(ids), PROFILE_SYNC_CHUNK):
+        profile.objects.using(using).filter(pk__in = ids[start:start + PROFILE_SYNC_CHUNK]).update(**values)
+
+
 # -	Đơn hàng: họ tên, email, số điện thoại của người đặt hàng, địa chỉ giao hàng, trạng thái đơn hàng, ngày đặt đơn
 class Order(BaseModel):
     STATUS_CHOICES = (
@@ -123,9 +262,47 @@ class Order(BaseModel):
     def __str__(self):
         return "Đơn hàng số " + str(self.id)
 
+    class Meta:
+        # Lịch sử đơn của người dùng và thống kê theo trạng thái
+        indexes = [
+            models.Index(fields = ['user', 'created_date'], name = 'order_user_created'),
+            models.Index(fields = ['status', 'created_date'], name = 'order_status_created'),
+            # Admin: date_hierarchy và tìm theo tiền tố số điện thoại/email
+            models.Index(fields = ['created_date'], name = 'order_created'),
+            models.Index(fields = ['phone'], name = 'order_phone'),
+            models.Index(fields = ['email'], name = 'order_email'),
+        ]
+
+
+# Outbox email thông báo đơn hàng: được ghi cùng transaction với thay đổi trạng thái đơn (mỗi đơn + trạng thái
+# một dòng), worker send_order_notifications gửi theo lô
+class OrderNotification(models.Model):
+    class DeliveryState(models.TextChoices):
+        PENDING = 'pending', _('Pending')
+        SENT = 'sent', _('Sent')
+        FAILED = 'failed', _('Failed')
+
+    order = models.ForeignKey(Order, on_delete = models.CASCADE, related_name = 'notifications')
+    status = models.CharField(max_length = 20, choices = Order.STATUS_CHOICES)
+    state = models.CharField(max_length = 20, choices = DeliveryState.choices, default = DeliveryState.PENDING)
+    attempts = models.SmallIntegerField(default = 0)
+    next_attempt_date = models.DateTimeField(default = timezone.now)
+    last_error = models.CharField(max_length = 255, blank = True, default = '')
+    created_date = models.DateTimeField(auto_now_add = True)
+    sent_date = models.DateTimeField(null = True, blank = True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields = ['order', 'status'], name = 'ordernotification_order_status'),
+        ]
+        # Worker lấy các thông báo đang chờ đã tới hạn gửi
+        indexes = [
+            models.Index(fields = ['state', 'next_attempt_date'], name = 'ordernotification_due'),
+        ]
+
 
 # -	Chi tiết đơn hàng: Tên sản phẩm, giá sản phẩm, khuyến mãi( nếu có), số lượng sản phẩm, màu sắc, kích thước( nếu có), đơn hàng(fk)
-class OrderDetail(BaseModel):
+class OrderDetail(OrderLineSnapshotMixin, BaseModel):
     product = models.ForeignKey(Product, on_delete = models.SET_NULL, null = True)
     order = models.ForeignKey(Order, on_delete = models.SET_NULL, null = True, related_name = "order_detail")
     price = models.IntegerField(validators = [MinValueValidator(0)], null = False)
@@ -136,6 +313,21 @@ class OrderDetail(BaseModel):
                                default = 1)
     quantity = models.IntegerField(validators = [MinValueValidator(0)], null = False)
 
+    def save(self, *args, **kwargs):
+        # Dòng mới chưa có snapshot (tạo lẻ qua serializer, admin): chụp từ sản phẩm hiện tại. Tạo đơn dùng
+        # snapshots.fill cho cả đơn trước khi bulk_create
+        if self._state.adding and not self.product_name and self.product_id is not None:
+            from .snapshots import fill
+
+            fill([self])
+        super().save(*args, **kwargs)
+
+    class Meta:
+        # Xuất đơn theo shop (shopping/exports.py) duyệt theo khoá chính trong các shop được chọn
+        indexes = [
+            models.Index(fields = ['shop_id', 'id'], name = 'orderdetail_shop_id'),
+        ]
+
 
 # Thanh toán: Số tiền thanh toán, phương thức thanh toán, trạng thái thanh toán, đơn hàng(fk)
 
@@ -160,8 +352,89 @@ class Payment(BaseModel):
     total_amount = models.IntegerField(validators = [MinValueValidator(0)], null = False)
 
 
+# Callback của cổng thanh toán: được lưu ngay khi nhận (mỗi sự kiện của một cổng chỉ một dòng), worker
+# process_payment_callbacks cập nhật Payment/Order theo lô
+class PaymentCallback(models.Model):
+    class CallbackStatus(models.TextChoices):
+        PENDING = 'pending', _('Pending')
+        APPLIED = 'applied', _('Applied')
+        FAILED = 'failed', _('Failed')
+
+    gateway = models.CharField(max_length = 20, choices = Payment.PaymentMethod.choices)
+    event_id = models.CharField(max_length = 255)
+    payload = models.JSONField()
+    status = models.CharField(max_length = 20, choices = CallbackStatus.choices, default = CallbackStatus.PENDING)
+    attempts = models.SmallIntegerField(default = 0)
+    error = models.CharField(max_length = 255, blank = True, default = '')
+    received_date = models.DateTimeField(auto_now_add = True)
+    processed_date = models.DateTimeField(null = True, blank = True)
+
+    def __str__(self):
+        return '%s %s' % (self.gateway, self.event_id)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields = ['event_id', 'gateway'], name = 'paymentcallback_event_gateway'),
+        ]
+        # Worker lấy các callback đang chờ theo thứ tự nhận
+        indexes = [
+            models.Index(fields = ['status', 'id'], name = 'paymentcallback_status_id'),
+        ]
+
+
+# Lưu trữ: đơn đã giao/huỷ quá ORDER_ARCHIVE_AFTER_DAYS ngày được lệnh archive_orders chuyển sang các bảng dưới
+# (giữ nguyên id và ngày tạo/cập nhật) để bảng đơn hàng đang dùng chỉ còn dữ liệu gần đây. Tên trường và related_name giống bảng gốc
+# nên OrderSerializer/OrderDetailSerializer/PaymentSerializer dùng được cho cả hai
+class ArchivedOrder(BaseModel):
+    id = models.BigIntegerField(primary_key = True)
+    created_date = models.DateTimeField()
+    updated_date = models.DateTimeField()
+    name = models.CharField(max_length = 255)
+    email = models.EmailField(max_length = 255)
+    phone = models.CharField(max_length = 10)
+    address = models.CharField(max_length = 255)
+    total_amount = models.IntegerField()
+    status = models.CharField(max_length = 20, choices = Order.STATUS_CHOICES)
+    status_ship = models.CharField(max_length = 20, choices = Order.SHIPPING_CHOICES)
+    user = models.ForeignKey(User, related_name = 'archived_orders', on_delete = models.PROTECT)
+    archived_date = models.DateTimeField(auto_now_add = True)
+
+    def __str__(self):
+        return "Đơn hàng số " + str(self.id)
+
+    class Meta:
+        indexes = [
+            models.Index(fields = ['user', 'created_date'], name = 'archivedorder_user_created'),
+            models.Index(fields = ['created_date'], name = 'archivedorder_created'),
+        ]
+
+
+class ArchivedOrderDetail(OrderLineSnapshotMixin, BaseModel):
+    id = models.BigIntegerField(primary_key = True)
+    created_date = models.DateTimeField()
+    updated_date = models.DateTimeField()
+    product = models.ForeignKey(Product, on_delete = models.SET_NULL, null = True, related_name = 'archived_lines')
+    order = models.ForeignKey(ArchivedOrder, on_delete = models.CASCADE, related_name = 'order_detail')
+    price = models.IntegerField()
+    discount = models.IntegerField()
+    sizes = models.ForeignKey('size', related_name = 'archived_lines', on_delete = models.CASCADE)
+    colors = models.ForeignKey('color', related_name = 'archived_lines', on_delete = models.CASCADE)
+    quantity = models.IntegerField()
+
+
+class ArchivedPayment(BaseModel):
+    id = models.BigIntegerField(primary_key = True)
+    created_date = models.DateTimeField()
+    updated_date = models.DateTimeField()
+    user = models.ForeignKey(User, related_name = 'archived_payments', on_delete = models.PROTECT)
+    order = models.ForeignKey(ArchivedOrder, related_name = 'orders', on_delete = models.CASCADE)
+    payment_method = models.CharField(max_length = 255, choices = Payment.PaymentMethod.choices)
+    payment_status = models.CharField(max_length = 255, choices = Payment.PaymentStatus.choices)
+    total_amount = models.IntegerField()
+
+
 # -	Cửa hàng: Tên cửa hàng, người tạo cửa hàng(fk)
-class Shop(BaseModel):
+class Shop(SearchKeyMixin, BaseModel):
     name = models.CharField(max_length = 255, null = False)
     business = models.ForeignKey(Business, related_name = "business", on_delete = models.SET_NULL, null = True)
     email = models.EmailField(max_length = 255, default = None)
@@ -172,6 +445,52 @@ class Shop(BaseModel):
         return self.name
 
 
+# Token 3 ký tự của tên sản phẩm/shop đã bỏ dấu (shopping/search.py): tìm theo kw đếm số token trùng qua index
+# (kind, token, object_id) thay vì quét LIKE '%...%' trên cả bảng, sai chính tả vài ký tự vẫn khớp
+class SearchToken(models.Model):
+    kind = models.CharField(max_length = 10)
+    token = models.CharField(max_length = 3)
+    object_id = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields = ['kind', 'token', 'object_id'], name = 'searchtoken_kind_token_object'),
+        ]
+        indexes = [
+            models.Index(fields = ['kind', 'object_id'], name = 'searchtoken_kind_object'),
+        ]
+
+
+# Hàng đợi việc chạy nền (shopping/jobs.py): worker run_jobs nhận các việc tới hạn bằng SELECT ... FOR UPDATE
+# SKIP LOCKED, thử lại theo backoff khi lỗi, quá số lần thử thì chuyển sang DEAD để xem lại trong admin
+class Job(models.Model):
+    class JobState(models.TextChoices):
+        PENDING = 'pending', _('Pending')
+        RUNNING = 'running', _('Running')
+        DEAD = 'dead', _('Dead')
+
+    queue = models.CharField(max_length = 50, default = 'default')
+    name = models.CharField(max_length = 100)
+    payload = models.JSONField(default = dict, blank = True)
+    state = models.CharField(max_length = 20, choices = JobState.choices, default = JobState.PENDING)
+    attempts = models.SmallIntegerField(default = 0)
+    max_attempts = models.SmallIntegerField(default = 5)
+    # Hạn chạy; khi đang chạy là hạn của lease: worker chết giữa chừng thì việc tự tới hạn lại
+    run_at = models.DateTimeField(default = timezone.now)
+    last_error = models.TextField(blank = True, default = '')
+    created_date = models.DateTimeField(auto_now_add = True)
+    finished_date = models.DateTimeField(null = True, blank = True)
+
+    def __str__(self):
+        return '%s #%s' % (self.name, self.pk)
+
+    class Meta:
+        # Worker lấy các việc tới hạn của một hàng đợi
+        indexes = [
+            models.Index(fields = ['queue', 'state', 'run_at'], name = 'job_due'),
+        ]
+
+
 # -	Đánh giá sản phẩm: tiêu đề, nội dung, số sao, ngày đánh giá, sản phẩm, người đánh giá.
 class ProductReview(BaseModel):
     user = models.ForeignKey(User, on_delete = models.SET_NULL, null = True, related_name = "product_reviews")
@@ -182,6 +501,12 @@ class ProductReview(BaseModel):
                                        on_delete = models.CASCADE)
     description = None
 
+    class Meta:
+        # Danh sách đánh giá của sản phẩm (mới nhất trước) và điểm trung bình
+        indexes = [
+            models.Index(fields = ['product', 'active', 'created_date'], name = 'review_product_active_created'),
+        ]
+
 
 # -	Đánh giá cửa hàng: tiêu đề, nội dung, số sao, ngày đánh giá, sản phẩm, người đánh giá.
 class ShopReview(BaseModel):
@@ -209,3 +534,9 @@ class CartDetail(models.Model):
 
     def __str__(self):
         return self.product.name
+
+    class Meta:
+        # Thêm vào giỏ tìm dòng có sẵn theo giỏ, sản phẩm, màu và kích thước
+        indexes = [
+            models.Index(fields = ['cart', 'product', 'colors', 'sizes'], name = 'cartdetail_line'),
+        ]
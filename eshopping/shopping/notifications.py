@@ -0,0 +1,144 @@
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import metrics
+from .models import Shop, Order, OrderNotification
+
+# Email thông báo đơn hàng đi qua outbox: mỗi lần lưu đơn ghi một dòng OrderNotification (đơn + trạng thái) trong
+# cùng transaction, request không chờ gửi email. Worker send_order_notifications nhận các dòng tới hạn theo lô,
+# gửi trên một kết nối SMTP dùng lại và thử lại theo backoff khi lỗi.
+STATUS_MESSAGES = {
+    'confirm': 'đã được xác nhận',
+    'paid': 'đã được thanh toán',
+    'shipped': 'đang được giao',
+    'delivered': 'đã được giao thành công',
+    'cancelled': 'đã bị huỷ',
+}
+
+logger = logging.getLogger('shopping.notifications')
+
+
+def notification_setting(name, default):
+    return getattr(settings, 'ORDER_NOTIFICATION_%s' % name, default)
+
+
+def order_placed_messages(order, shops = None):
+    # Một email xác nhận cho người mua và một email báo đơn mới cho mỗi shop có sản phẩm trong đơn
+    sender = getattr(settings, 'ORDER_NOTIFICATION_FROM', None)
+    messages = []
+    if order.email:
+        messages.append(EmailMessage(
+            subject = 'Xác nhận đơn hàng #%d' % order.id,
+            body = 'Chào %s,\n\nĐơn hàng #%d trị giá %d đã được tạo và sẽ giao tới %s.' % (
+                order.name, order.id, order.total_amount, order.address),
+            from_email = sender, to = [order.email]))
+    if shops is None:
+        shops = Shop.objects.filter(products__orderdetail__order = order).exclude(email = None).distinct()
+    for shop in shops:
+        messages.append(EmailMessage(
+            subject = 'Đơn hàng mới #%d' % order.id,
+            body = 'Shop %s vừa nhận được đơn hàng #%d từ %s (%s).' % (shop.name, order.id, order.name, order.phone),
+            from_email = sender, to = [shop.email]))
+    return messages
+
+
+def order_status_messages(order, status):
+    if not order.email or status not in STATUS_MESSAGES:
+        return []
+    return [EmailMessage(
+        subject = 'Đơn hàng #%d %s' % (order.id, STATUS_MESSAGES[status]),
+        body = 'Chào %s,\n\nĐơn hàng #%d %s.' % (order.name, order.id, STATUS_MESSAGES[status]),
+        from_email = getattr(settings, 'ORDER_NOTIFICATION_FROM', None), to = [order.email])]
+
+
+def batch_messages(notifications):
+    # notification.pk -> danh sách email; shop của tất cả đơn mới trong lô được đọc bằng một truy vấn
+    placed = [n.order_id for n in notifications if n.status == 'created']
+    shops = defaultdict(list)
+    if placed:
+        rows = Shop.objects.filter(products__orderdetail__order__in = placed).exclude(email = None) \
+            .values_list('products__orderdetail__order', 'name', 'email').distinct()
+        for order_id, name, email in rows:
+            shops[order_id].append(Shop(name = name, email = email))
+    return {n.pk: order_placed_messages(n.order, shops[n.order_id]) if n.status == 'created'
+            else order_status_messages(n.order, n.status) for n in notifications}
+
+
+def enqueue_notifications(orders):
+    # Gọi trong transaction thay đổi trạng thái đơn; đơn + trạng thái đã có thông báo thì bỏ qua
+    OrderNotification.objects.bulk_create([OrderNotification(order = order, status = order.status)
+                                           for order in orders], ignore_conflicts = True)
+
+
+@receiver(post_save, sender = Order, dispatch_uid = 'shopping.notifications.order_saved')
+def order_saved(sender, instance, raw = False, **kwargs):
+    if not raw:
+        enqueue_notifications([instance])
+
+
+def retry_delay(attempts):
+    base = notification_setting('RETRY_BASE_SECONDS', 30)
+    return timedelta(seconds = min(base * 2 ** (attempts - 1), notification_setting('RETRY_MAX_SECONDS', 3600)))
+
+
+def claim_due(batch_size):
+    # Đánh dấu lô đang gửi bằng cách lùi hạn gửi ORDER_NOTIFICATION_LEASE_SECONDS: worker chết giữa chừng thì
+    # lô tự tới hạn lại, worker khác không nhận trùng trong lúc đang gửi
+    now = timezone.now()
+    with transaction.atomic():
+        queryset = OrderNotification.objects.filter(state = OrderNotification.DeliveryState.PENDING,
+                                                    next_attempt_date__lte = now).order_by('next_attempt_date')
+        if connection.features.has_select_for_update:
+            queryset = queryset.select_for_update(skip_locked = connection.features.has_select_for_update_skip_locked)
+        ids = list(queryset.values_list('id', flat = True)[:batch_size])
+        if not ids:
+            return []
+        lease = timedelta(seconds = notification_setting('LEASE_SECONDS', 300))
+        OrderNotification.objects.filter(id__in = ids).update(next_attempt_date = now + lease,
+                                                              attempts = F('attempts') + 1)
+    return list(OrderNotification.objects.select_related('order').filter(id__in = ids).order_by('id'))
+
+
+def process_batch(mail_connection, batch_size = 100):
+    notifications = claim_due(batch_size)
+    if not notifications:
+        return 0, {}
+    messages = batch_messages(notifications)
+    max_attempts = notification_setting('MAX_ATTEMPTS', 5)
+    stats = defaultdict(int)
+    for notification in notifications:
+        now = timezone.now()
+        try:
+            # open() không làm gì nếu kết nối đang mở; send_messages không đóng kết nối nó không tự mở
+            mail_connection.open()
+            if messages[notification.pk]:
+                mail_connection.send_messages(messages[notification.pk])
+        except Exception as e:
+            logger.warning('Không gửi được thông báo đơn %s (%s): %s', notification.order_id, notification.status, e)
+            notification.last_error = str(e)[:255]
+            if notification.attempts >= max_attempts:
+                notification.state = OrderNotification.DeliveryState.FAILED
+                stats['failed'] += 1
+            else:
+                notification.next_attempt_date = now + retry_delay(notification.attempts)
+                stats['retried'] += 1
+            # Kết nối có thể đã hỏng, lần gửi sau mở kết nối mới
+            mail_connection.close()
+        else:
+            notification.state = OrderNotification.DeliveryState.SENT
+            notification.sent_date = now
+            notification.last_error = ''
+            stats['sent'] += 1
+    OrderNotification.objects.bulk_update(notifications, ['state', 'sent_date', 'last_error', 'next_attempt_date'])
+    for name, value in stats.items():
+        metrics.increment('order_notifications.%s' % name, value)
+    return len(notifications), dict(stats)
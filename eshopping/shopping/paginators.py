@@ -1,3 +1,7 @@
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections, DatabaseError
+from django.utils.functional import cached_property
 from requests import Response
 from rest_framework import pagination
 
@@ -10,3 +14,47 @@ class CommentPagination(pagination.PageNumberPagination):
     page_size = 10  # Số lượng comment trên mỗi trang
 
 
+def exact_count_limit():
+    return getattr(settings, 'ADMIN_EXACT_COUNT_LIMIT', 10000)
+
+
+def estimated_row_count(model, using):
+    # Số dòng ước lượng từ thống kê của DB (không quét bảng); None nếu DB không có thống kê cho bảng này
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute('SELECT TABLE_ROWS FROM information_schema.TABLES '
+                           'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s', [table])
+        elif connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'sqlite':
+            # sqlite_stat1 chỉ có sau khi chạy ANALYZE; cột stat bắt đầu bằng số dòng của bảng
+            try:
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+            except DatabaseError:
+                return None
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    return estimate if estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    # Paginator cho admin của các bảng lớn: COUNT(*) chính xác phải quét cả bảng ở mỗi trang danh sách.
+    # Không lọc thì dùng số dòng ước lượng khi bảng lớn hơn ADMIN_EXACT_COUNT_LIMIT; có lọc (tìm kiếm,
+    # list_filter) thì chỉ đếm tối đa ADMIN_EXACT_COUNT_LIMIT dòng, các trang sau giới hạn đó không hiển thị
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not hasattr(queryset, 'query'):
+            return super().count
+        limit = exact_count_limit()
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > limit:
+                return estimate
+        return queryset.order_by()[:limit].count()
@@ -0,0 +1,145 @@
+import hashlib
+import hmac
+import json
+import logging
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from . import metrics
+from .models import Payment, PaymentCallback, Order
+from .notifications import enqueue_notifications
+
+# Callback từ cổng thanh toán (MoMo, ZaloPay, PayPal, chuyển khoản). Endpoint chỉ kiểm tra chữ ký, ghi callback
+# bằng một câu INSERT (trùng gateway + event_id thì bỏ qua) rồi trả lời ngay; worker process_payment_callbacks
+# cập nhật Payment/Order theo lô. Body callback đã được chuẩn hoá về dạng
+# {"event_id": ..., "order_id": ..., "amount": ..., "status": "SUCCESS" | "FAIL"}, ký bằng HMAC-SHA256 của
+# toàn bộ body với secret của cổng (header X-Signature, dạng hex).
+SIGNATURE_HEADER = 'X-Signature'
+ONLINE_GATEWAYS = [method for method in Payment.PaymentMethod.values if method != Payment.PaymentMethod.COD]
+# Đơn ở các trạng thái này chuyển sang 'paid' khi thanh toán thành công
+PAYABLE_ORDER_STATUSES = ('created', 'confirm')
+
+logger = logging.getLogger('shopping.payments')
+
+
+def webhook_secret(gateway):
+    return getattr(settings, 'PAYMENT_WEBHOOK_SECRETS', {}).get(gateway)
+
+
+def sign(secret, body):
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def max_attempts():
+    return getattr(settings, 'PAYMENT_CALLBACK_MAX_ATTEMPTS', 5)
+
+
+@csrf_exempt
+@require_POST
+def payment_webhook(request, gateway):
+    gateway = gateway.upper()
+    secret = webhook_secret(gateway)
+    if gateway not in ONLINE_GATEWAYS or not secret:
+        return JsonResponse({'message': 'Cổng thanh toán không hợp lệ'}, status = 404)
+    signature = request.headers.get(SIGNATURE_HEADER, '')
+    if not hmac.compare_digest(sign(secret, request.body), signature):
+        metrics.increment('payment_callbacks.rejected')
+        return JsonResponse({'message': 'Sai chữ ký'}, status = 401)
+    try:
+        payload = json.loads(request.body)
+        event_id = str(payload['event_id'])
+    except (ValueError, KeyError, TypeError):
+        metrics.increment('payment_callbacks.rejected')
+        return JsonResponse({'message': 'Dữ liệu không hợp lệ'}, status = 400)
+    # Cổng gửi lại cùng sự kiện nhiều lần: ràng buộc unique bỏ qua bản trùng, vẫn trả 200 để cổng ngừng gửi lại
+    PaymentCallback.objects.bulk_create([PaymentCallback(gateway = gateway, event_id = event_id, payload = payload)],
+                                        ignore_conflicts = True)
+    metrics.increment('payment_callbacks.received')
+    return JsonResponse({'received': True})
+
+
+def claim_pending(batch_size):
+    queryset = PaymentCallback.objects.filter(status = PaymentCallback.CallbackStatus.PENDING).order_by('id')
+    if connection.features.has_select_for_update:
+        # Nhiều worker chạy song song: mỗi worker bỏ qua các dòng worker khác đang xử lý
+        queryset = queryset.select_for_update(skip_locked = connection.features.has_select_for_update_skip_locked)
+    return list(queryset[:batch_size])
+
+
+def parse_amount(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def apply_callbacks(callbacks):
+    # Áp dụng một lô callback: một truy vấn đọc Payment + Order, mỗi bảng một lần bulk_update
+    now = timezone.now()
+    order_ids = {parse_amount(c.payload.get('order_id')) for c in callbacks} - {None}
+    payments = {p.order_id: p for p in Payment.objects.select_related('order').select_for_update()
+                .filter(order_id__in = order_ids)}
+    changed_payments, changed_orders = {}, {}
+    for callback in callbacks:
+        callback.status, callback.error, callback.processed_date = PaymentCallback.CallbackStatus.FAILED, '', now
+        payment = payments.get(parse_amount(callback.payload.get('order_id')))
+        result = str(callback.payload.get('status', '')).upper()
+        if payment is None:
+            callback.error = 'Không tìm thấy thanh toán của đơn hàng'
+        elif payment.payment_method != callback.gateway:
+            callback.error = 'Đơn hàng thanh toán bằng %s' % payment.payment_method
+        elif parse_amount(callback.payload.get('amount')) != payment.total_amount:
+            callback.error = 'Số tiền %s khác %s' % (callback.payload.get('amount'), payment.total_amount)
+        elif result not in Payment.PaymentStatus.values:
+            callback.error = 'Trạng thái không hợp lệ: %s' % result
+        else:
+            callback.status = PaymentCallback.CallbackStatus.APPLIED
+            # Thành công là trạng thái cuối: callback FAIL đến sau (gửi lại, sai thứ tự) không hạ trạng thái
+            if result == Payment.PaymentStatus.IS_SUCCESS and payment.payment_status != result:
+                payment.payment_status, payment.updated_date = result, now
+                changed_payments[payment.pk] = payment
+                order = payment.order
+                if order.status in PAYABLE_ORDER_STATUSES:
+                    order.status, order.updated_date = 'paid', now
+                    changed_orders[order.pk] = order
+                elif order.status == 'cancelled':
+                    callback.error = 'Đơn đã huỷ nhưng đã được thanh toán'
+    Payment.objects.bulk_update(changed_payments.values(), ['payment_status', 'updated_date'])
+    Order.objects.bulk_update(changed_orders.values(), ['status', 'updated_date'])
+    # bulk_update không phát post_save nên tự ghi thông báo vào outbox trong cùng transaction
+    enqueue_notifications(changed_orders.values())
+    PaymentCallback.objects.bulk_update(callbacks, ['status', 'error', 'processed_date'])
+    return {'applied': sum(c.status == PaymentCallback.CallbackStatus.APPLIED for c in callbacks),
+            'failed': sum(c.status == PaymentCallback.CallbackStatus.FAILED for c in callbacks),
+            'payments': len(changed_payments), 'orders': len(changed_orders)}
+
+
+def process_batch(batch_size = 500):
+    # Trả về số callback đã xử lý và thống kê; lô lỗi được rollback, tăng số lần thử, quá giới hạn thì đánh dấu failed
+    with transaction.atomic():
+        callbacks = claim_pending(batch_size)
+        if not callbacks:
+            return 0, {}
+        ids = [c.pk for c in callbacks]
+        try:
+            with transaction.atomic():
+                stats = apply_callbacks(callbacks)
+        except Exception as e:
+            logger.exception('Không áp dụng được lô callback %s..%s', ids[0], ids[-1])
+            for callback in callbacks:
+                callback.attempts += 1
+                callback.error = str(e)[:255]
+                if callback.attempts >= max_attempts():
+                    callback.status = PaymentCallback.CallbackStatus.FAILED
+                else:
+                    callback.status = PaymentCallback.CallbackStatus.PENDING
+            PaymentCallback.objects.bulk_update(callbacks, ['attempts', 'error', 'status'])
+            return len(callbacks), {'errors': len(callbacks)}
+    for name, value in stats.items():
+        metrics.increment('payment_callbacks.%s' % name, value)
+    return len(callbacks), stats
@@ -1,7 +1,7 @@
 from rest_framework import permissions
 from rest_framework.permissions import BasePermission
 
-from .models import Business, Shop, Product, CartDetail, Cart
+from .models import BusinessProfile, Shop, Product, CartDetail, Cart
 
 
 class ReviewOwner(permissions.IsAuthenticated):
@@ -11,28 +11,25 @@ class ReviewOwner(permissions.IsAuthenticated):
 
 class IsBusiness(BasePermission):
     def has_permission(self, request, view):
-        # Kiểm tra nếu user là doanh nghiệp
-        return request.user.groups.filter(name = 'Business').exists()
+        # Kiểm tra nếu user là doanh nghiệp: một lần đọc BusinessProfile theo khoá chính.
+        # Trước đây là thành viên nhóm 'Business'; nay là mọi tài khoản Business (có hồ sơ), kể cả doanh nghiệp tạo
+        # trong admin chưa được thêm vào nhóm, còn user thường được thêm vào nhóm thì không còn qua
+        return BusinessProfile.objects.filter(pk = request.user.id).exists()
 
 
 class IsBusinessOwner(permissions.IsAuthenticated):
     def has_permission(self, request, view):
         if request.method == 'PUT' or request.method == 'DELETE' or request.method == 'PATCH':  # chỉ kiểm tra khi request là PUT
-            business = Business.objects.get(id = request.user.id)
-            shop_id = view.kwargs.get('pk')  # lấy id sản phẩm từ url
-            shop = Shop.objects.get(pk = shop_id)
-            return shop.business == business  # kiểm tra user có phải là người tạo sản phẩm hay không
+            shop_id = view.kwargs.get('pk')  # lấy id shop từ url
+            # kiểm tra user có phải là chủ shop hay không, một truy vấn theo khoá chính
+            return Shop.objects.filter(pk = shop_id, business_id = request.user.id).exists()
         return True  # cho phép các request khác (GET, POST)
 
 
 class IsShopOwner(permissions.IsAuthenticated):
     def has_permission(self, request, view):
         if request.method == 'PUT' or request.method == 'DELETE' or request.method == 'PATCH':
-            user = request.user
-            business = Business.objects.get(id = user.id)
-            shop = Shop.objects.get(business = business.id)
             product_id = view.kwargs.get('pk')  # lấy id sản phẩm từ url
-            product = Product.objects.get(pk = product_id)
-            return product.shop == shop.id
+            return Product.objects.filter(pk = product_id, shop__business_id = request.user.id).exists()
         return True
 
@@ -0,0 +1,150 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Category, Color, Size
+
+# Dữ liệu tham chiếu (danh mục, màu, kích thước) gần như không đổi nên mỗi process giữ một bản trong bộ nhớ.
+# Mỗi lần ghi tăng bộ đếm phiên bản trong cache dùng chung; process khác so phiên bản định kỳ
+# (REFERENCE_DATA_CHECK_INTERVAL giây) và nạp lại khi khác. Phiên bản cũng là ETag của các endpoint danh sách.
+VERSION_CACHE_KEY = 'shopping:refdata:version'
+MODELS = {'categories': Category, 'colors': Color, 'sizes': Size}
+FIELDS = {'categories': ('id', 'name', 'active'), 'colors': ('id', 'name'), 'sizes': ('id', 'name')}
+
+
+def check_interval():
+    return getattr(settings, 'REFERENCE_DATA_CHECK_INTERVAL', 5)
+
+
+def shared_version():
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        # Cache dùng chung mới khởi động hoặc bị xoá: mọi process sẽ thấy phiên bản khác và nạp lại
+        cache.add(VERSION_CACHE_KEY, int(time.time() * 1000), None)
+        version = cache.get(VERSION_CACHE_KEY)
+    return version
+
+
+class Snapshot:
+    def __init__(self, version):
+        self.version = version
+        self.rows = {}
+        self.ids_by_name = {}
+        for kind, model in MODELS.items():
+            rows = list(model.objects.order_by('id').values(*FIELDS[kind]))
+            self.rows[kind] = {row['id']: row for row in rows}
+            names = {}
+            for row in rows:
+                # Tên màu/kích thước không unique: dùng dòng có id nhỏ nhất như get_or_create cũ
+                names.setdefault(row['name'], row['id'])
+            self.ids_by_name[kind] = names
+        self.checked_at = time.monotonic()
+
+
+_snapshot = None
+_lock = threading.Lock()
+
+
+def snapshot(force = False):
+    # force: luôn nạp lại, không so phiên bản (dữ liệu trên DB đã có dòng mà bản nhớ chưa có)
+    global _snapshot
+    current = _snapshot
+    now = time.monotonic()
+    if current is not None and not force:
+        if now - current.checked_at < check_interval():
+            return current
+        elif shared_version() == current.version:
+            current.checked_at = now
+            return current
+    with _lock:
+        if _snapshot is current:
+            # Đọc phiên bản trước khi đọc dữ liệu: lần ghi xen giữa sẽ làm lần kiểm tra sau nạp lại
+            _snapshot = Snapshot(shared_version())
+        return _snapshot
+
+
+def reset():
+    global _snapshot
+    _snapshot = None
+
+
+def row(kind, pk):
+    # Id chưa có trong bản nhớ nhưng có trên DB (vừa được tạo ở process khác hoặc bằng bulk_create) thì nạp lại.
+    # Id không tồn tại chỉ tốn một truy vấn theo khoá chính, không nạp lại cả bảng
+    if pk is None:
+        return None
+    found = snapshot().rows[kind].get(pk)
+    if found is None and MODELS[kind].objects.filter(pk = pk).exists():
+        found = snapshot(force = True).rows[kind].get(pk)
+    return found
+
+
+def rows(kind):
+    return list(snapshot().rows[kind].values())
+
+
+def instance(kind, pk):
+    # Model chưa truy vấn DB, dùng để gán khoá ngoại
+    data = row(kind, pk)
+    if data is None:
+        return None
+    obj = MODELS[kind](**data)
+    obj._state.adding = False
+    return obj
+
+
+def resolve_names(kind, names):
+    # Tên -> id theo đúng thứ tự. Tên chưa có trong bản nhớ được kiểm tra lại trên DB (có thể vừa được process
+    # khác tạo), chỉ các tên thật sự mới được thêm bằng một lần bulk_create
+    names = list(dict.fromkeys(name for name in names if name))
+    known = snapshot().ids_by_name[kind]
+    new = [name for name in names if name not in known]
+    if new:
+        model = MODELS[kind]
+        found = names_to_ids(model, new)
+        missing = [name for name in new if name not in found]
+        if missing:
+            model.objects.bulk_create([model(name = name) for name in missing])
+            # MySQL không trả id sau bulk_create nên đọc lại theo tên
+            found.update(names_to_ids(model, missing))
+            bump()
+        known = {**known, **found}
+    return [known[name] for name in names]
+
+
+def names_to_ids(model, names):
+    ids = {}
+    for pk, name in model.objects.filter(name__in = names).order_by('id').values_list('id', 'name'):
+        ids.setdefault(name, pk)
+    return ids
+
+
+def bump():
+    # Gọi sau khi ghi: chờ commit rồi tăng phiên bản dùng chung và bỏ bản nhớ của process này
+    def apply():
+        try:
+            cache.incr(VERSION_CACHE_KEY)
+        except ValueError:
+            shared_version()
+        reset()
+
+    transaction.on_commit(apply)
+
+
+def etag(kind):
+    return '"%s-%s"' % (kind, snapshot().version)
+
+
+@receiver(post_save, sender = Category, dispatch_uid = 'shopping.refdata.category_saved')
+@receiver(post_delete, sender = Category, dispatch_uid = 'shopping.refdata.category_deleted')
+@receiver(post_save, sender = Color, dispatch_uid = 'shopping.refdata.color_saved')
+@receiver(post_delete, sender = Color, dispatch_uid = 'shopping.refdata.color_deleted')
+@receiver(post_save, sender = Size, dispatch_uid = 'shopping.refdata.size_saved')
+@receiver(post_delete, sender = Size, dispatch_uid = 'shopping.refdata.size_deleted')
+def reference_changed(sender, **kwargs):
+    bump()
@@ -0,0 +1,71 @@
+import itertools
+import json
+
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # orjson là tuỳ chọn, không có thì dùng json của thư viện chuẩn
+    orjson = None
+
+STREAM_CHUNK_SIZE = 500
+
+_encoder = JSONEncoder()
+
+
+class Echo:
+    # csv.writer ghi vào đây và nhận lại dòng đã định dạng để trả thẳng cho StreamingHttpResponse
+    def write(self, value):
+        return value
+
+
+def dumps(data):
+    # Trả về bytes, dùng orjson nếu có; các kiểu orjson không hỗ trợ được chuyển qua JSONEncoder của DRF
+    if orjson is not None:
+        return orjson.dumps(data, default = _encoder.default)
+    return json.dumps(data, cls = JSONEncoder, ensure_ascii = False, separators = (',', ':')).encode('utf-8')
+
+
+def iter_json_array(queryset, serializer_class, context = None, chunk_size = STREAM_CHUNK_SIZE):
+    # Duyệt queryset theo từng chunk bằng iterator(), serialize từng chunk và sinh ra các mảnh của một mảng JSON.
+    # queryset có thể là danh sách queryset, được nối tiếp nhau trong cùng một mảng
+    yield b'['
+    first = True
+    chunk = []
+    querysets = queryset if isinstance(queryset, (list, tuple)) else [queryset]
+
+    def encode(rows):
+        data = serializer_class(rows, many = True, context = context or {}).data
+        return b','.join(dumps(item) for item in data)
+
+    for obj in itertools.chain.from_iterable(q.iterator(chunk_size = chunk_size) for q in querysets):
+        chunk.append(obj)
+        if len(chunk) >= chunk_size:
+            yield (b'' if first else b',') + encode(chunk)
+            first = False
+            chunk = []
+    if chunk:
+        yield (b'' if first else b',') + encode(chunk)
+    yield b']'
+
+
+class StreamingJSONResponse(StreamingHttpResponse):
+    def __init__(self, queryset, serializer_class, context = None, chunk_size = STREAM_CHUNK_SIZE, status = 200):
+        super().__init__(iter_json_array(queryset, serializer_class, context, chunk_size),
+                         content_type = 'application/json', status = status)
+
+
+class StreamingListMixin:
+    # Trả về danh sách không phân trang dưới dạng luồng JSON thay vì dựng toàn bộ list rồi render một lần
+    stream_chunk_size = STREAM_CHUNK_SIZE
+
+    def stream_list(self, queryset, serializer_class = None):
+        return StreamingJSONResponse(queryset, serializer_class or self.get_serializer_class(),
+                                     context = self.get_serializer_context(), chunk_size = self.stream_chunk_size)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.paginator is not None:
+            return super().list(request, *args, **kwargs)
+        return self.stream_list(queryset)
@@ -0,0 +1,88 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject, empty
+
+# Trạng thái định tuyến của request hiện tại, do ReplicaRoutingMiddleware gán.
+# Ngoài request (command, worker, shell) mặc định mọi truy vấn đều đi vào primary.
+_route = ContextVar('replica_route', default = None)
+
+PIN_CACHE_KEY = 'replica-pin:%s'
+
+
+def replica_aliases():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def sticky_seconds():
+    return getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+
+
+def pin_user(user):
+    # Sau khi user ghi dữ liệu, các lần đọc của user đó đi vào primary trong REPLICA_STICKY_SECONDS giây
+    cache.set(PIN_CACHE_KEY % user.pk, True, sticky_seconds())
+
+
+def resolved_user(request):
+    user = request.__dict__.get('user')
+    if isinstance(user, SimpleLazyObject):
+        # Chưa xác thực xong thì chưa biết user là ai, không được ép đánh giá ở đây
+        user = None if user._wrapped is empty else user._wrapped
+    return user
+
+
+class RouteState:
+    def __init__(self, request, use_replica):
+        self.request = request
+        self.use_replica = use_replica
+        self._user_checked = False
+
+    def check_user_pin(self):
+        if self._user_checked or not self.use_replica:
+            return
+        user = resolved_user(self.request)
+        if user is None:
+            return
+        # Chỉ kiểm tra cache một lần cho mỗi request, khi DRF đã xác thực xong user
+        self._user_checked = True
+        if user.is_authenticated and cache.get(PIN_CACHE_KEY % user.pk):
+            self.use_replica = False
+
+    def read_alias(self):
+        self.check_user_pin()
+        aliases = replica_aliases()
+        if self.use_replica and aliases:
+            return random.choice(aliases)
+        return 'default'
+
+
+def get_route():
+    return _route.get()
+
+
+def set_route(state):
+    return _route.set(state)
+
+
+def reset_route(token):
+    _route.reset(token)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _route.get()
+        if state is None or model._meta.app_label in getattr(settings, 'REPLICA_EXCLUDED_APPS', []):
+            return 'default'
+        return state.read_alias()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replica là bản sao của primary nên quan hệ giữa các object luôn hợp lệ
+        return True
+
+    def allow_migrate(self, db, app_label, model_name = None, **hints):
+        return db not in replica_aliases()
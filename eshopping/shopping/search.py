@@ -0,0 +1,80 @@
+import math
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Product, Shop, SearchToken
+from .textnorm import fold, search_key
+
+# Tìm sản phẩm theo kw không phân biệt dấu: "ao thun" và "áo thun" cho cùng kết quả. Product/Shop có cột
+# search_key (tên đã bỏ dấu, được tính khi save) và các dòng SearchToken là token 3 ký tự của search_key, được
+# ghi lại khi tên đổi. Một sản phẩm khớp kw khi có đủ SEARCH_MIN_TOKEN_RATIO số token của kw trong tên sản phẩm
+# hoặc tên shop; đếm qua index (kind, token, object_id) nên không phải quét cả bảng. Khác với icontains trước đây,
+# kw là một phần giữa từ thì không đủ token (kw "hun" không khớp "thun": token đầu từ "  h", " hu" không có).
+MODELS = {'product': Product, 'shop': Shop}
+
+
+def min_token_ratio():
+    return getattr(settings, 'SEARCH_MIN_TOKEN_RATIO', 0.6)
+
+
+def tokens(key):
+    # Token 3 ký tự của từng từ, thêm khoảng trắng hai đầu để đầu từ được tính: "ao" -> "  a", " ao", "ao "
+    found = set()
+    for word in key.split():
+        padded = '  %s ' % word
+        found.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return found
+
+
+def write_tokens(kind, objects):
+    # objects: danh sách (id, search_key); token cũ của các id này bị thay hết
+    ids = [pk for pk, _ in objects]
+    SearchToken.objects.filter(kind = kind, object_id__in = ids).delete()
+    SearchToken.objects.bulk_create([SearchToken(kind = kind, token = token, object_id = pk)
+                                     for pk, key in objects for token in tokens(key)], ignore_conflicts = True)
+
+
+def matching_ids(kind, kw):
+    # Subquery id các dòng khớp kw
+    grams = tokens(fold(kw))
+    needed = max(1, math.ceil(len(grams) * min_token_ratio()))
+    return SearchToken.objects.filter(kind = kind, token__in = grams).values('object_id') \
+        .annotate(matches = Count('id')).filter(matches__gte = needed).values('object_id')
+
+
+def product_filter(kw):
+    # Một subquery UNION hai tập id (khớp tên sản phẩm, thuộc shop khớp tên) thay cho OR hai điều kiện IN: OR làm
+    # DB không dùng được index nào cho cả hai vế và phải quét bảng sản phẩm
+    by_shop = Product.objects.filter(shop_id__in = matching_ids('shop', kw)).values('id')
+    return Q(id__in = matching_ids('product', kw).union(by_shop))
+
+
+def saved(kind, instance, created):
+    if getattr(instance, '_search_key_changed', True):
+        if created:
+            SearchToken.objects.bulk_create([SearchToken(kind = kind, token = token, object_id = instance.pk)
+                                             for token in tokens(instance.search_key)], ignore_conflicts = True)
+        else:
+            write_tokens(kind, [(instance.pk, instance.search_key)])
+
+
+@receiver(post_save, sender = Product, dispatch_uid = 'shopping.search.product_saved')
+def product_saved(sender, instance, created, raw = False, **kwargs):
+    if not raw:
+        saved('product', instance, created)
+
+
+@receiver(post_save, sender = Shop, dispatch_uid = 'shopping.search.shop_saved')
+def shop_saved(sender, instance, created, raw = False, **kwargs):
+    if not raw:
+        saved('shop', instance, created)
+
+
+@receiver(post_delete, sender = Product, dispatch_uid = 'shopping.search.product_deleted')
+@receiver(post_delete, sender = Shop, dispatch_uid = 'shopping.search.shop_deleted')
+def deleted(sender, instance, **kwargs):
+    kind = 'product' if sender is Product else 'shop'
+    SearchToken.objects.filter(kind = kind, object_id = instance.pk).delete()
@@ -1,10 +1,183 @@
+from collections.abc import Mapping
+
 import cloudinary
-from django.db.models import Sum, Avg
+from django.db.models import Sum, Avg, Count, OuterRef, Subquery, IntegerField, FloatField, Prefetch
+from django.db.models.functions import Coalesce
 from rest_framework import serializers
 from rest_framework.serializers import ModelSerializer
-from .models import (Category, Product, Payment, User, Color, Size, Shop, Business,
+from .models import (Category, Product, Payment, User, Color, Size, Shop, Business, BusinessProfile,
                      ShopReview, Like, ProductReview, Cart, CartDetail, Order, OrderDetail)
 from django.contrib.auth.models import Group
+from .likes import liked_product_ids
+from . import refdata, snapshots
+
+
+def query_param_set(request, name):
+    # ?fields=id,name,price -> {'id', 'name', 'price'}; None nếu request không truyền tham số này
+    if request is None:
+        return None
+    value = request.GET.get(name)
+    if value is None:
+        return None
+    return {v.strip() for v in value.split(',') if v.strip()}
+
+
+class DynamicFieldsMixin:
+    # ?fields= giữ lại các field được liệt kê, ?expand= chỉ mở rộng các quan hệ lồng nhau được liệt kê,
+    # các quan hệ còn lại trả về khoá chính. Không truyền tham số thì giữ nguyên biểu diễn mặc định.
+    expandable_fields = ()
+    # Các field chỉ mở rộng khi được liệt kê rõ trong ?expand=
+    collapsed_by_default = ()
+    # field -> select_related (str) hoặc Prefetch / hàm trả về Prefetch (có thể là tuple nhiều giá trị),
+    # chỉ áp dụng khi field được mở rộng
+    related_fields = {}
+    # field -> prefetch_related, áp dụng khi field được yêu cầu (kể cả khi chỉ trả về khoá chính)
+    prefetch_fields = {}
+    # field -> hàm trả về dict annotation dùng cho field đó
+    annotated_fields = {}
+    # Cột nặng sẽ được defer khi ?fields= không yêu cầu
+    deferred_fields = ()
+
+    def __init__(self, *args, **kwargs):
+        requested = kwargs.pop('fields', None)
+        expand = kwargs.pop('expand', None)
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if requested is None:
+            requested = query_param_set(request, 'fields')
+        if expand is None:
+            expand = query_param_set(request, 'expand')
+        self.apply_field_selection(requested, expand)
+
+    @classmethod
+    def is_expanded(cls, name, expand):
+        if expand is None:
+            return name not in cls.collapsed_by_default
+        return name in expand
+
+    def get_expanded_field(self, name):
+        return None
+
+    def apply_field_selection(self, requested, expand):
+        if requested is not None:
+            for name in list(self.fields):
+                if name not in requested and not self.fields[name].write_only:
+                    self.fields.pop(name)
+        for name in self.expandable_fields:
+            if name not in self.fields:
+                continue
+            if self.is_expanded(name, expand):
+                field = self.get_expanded_field(name)
+                if field is not None:
+                    self.fields[name] = field
+            elif name not in self.collapsed_by_default:
+                field = self.fields[name]
+                if hasattr(field, 'collapsed'):
+                    self.fields[name] = field.collapsed()
+                    continue
+                source = field.source if field.source != name else None
+                self.fields[name] = serializers.PrimaryKeyRelatedField(
+                    read_only = True, many = isinstance(field, serializers.ListSerializer), source = source)
+
+    @classmethod
+    def setup_queryset(cls, queryset, request = None, fields = None, expand = None):
+        if fields is None:
+            fields = query_param_set(request, 'fields')
+        if expand is None:
+            expand = query_param_set(request, 'expand')
+
+        def wanted(name):
+            return fields is None or name in fields
+
+        for name, lookups in cls.related_fields.items():
+            if not wanted(name) or not cls.is_expanded(name, expand):
+                continue
+            for lookup in lookups if isinstance(lookups, (list, tuple)) else [lookups]:
+                if isinstance(lookup, str):
+                    queryset = queryset.select_related(lookup)
+                else:
+                    queryset = queryset.prefetch_related(lookup() if callable(lookup) else lookup)
+        for name, lookup in cls.prefetch_fields.items():
+            if wanted(name):
+                queryset = queryset.prefetch_related(lookup)
+        for name, annotations in cls.annotated_fields.items():
+            if wanted(name):
+                queryset = queryset.annotate(**annotations())
+        if fields is not None:
+            deferred = [name for name in cls.deferred_fields if name not in fields]
+            if deferred:
+                queryset = queryset.defer(*deferred)
+        return queryset
+
+
+def collapsed_source(field):
+    # DRF không cho source trùng tên field
+    return field.source if field.source != field.field_name else None
+
+
+class ReferenceField(serializers.Field):
+    # Khoá ngoại tới danh mục/màu/kích thước: tên được đọc từ refdata theo id nên không cần join.
+    # nested = False chỉ trả id. Khi ghi nhận id, kiểm tra trong refdata và trả về instance để gán khoá ngoại.
+    default_error_messages = {
+        'does_not_exist': 'Không tồn tại {kind} có id "{pk_value}".',
+        'incorrect_type': 'Id không hợp lệ, nhận được {data_type}.',
+    }
+
+    def __init__(self, kind, nested = True, **kwargs):
+        self.kind = kind
+        self.nested = nested
+        super().__init__(**kwargs)
+
+    def collapsed(self):
+        return ReferenceField(self.kind, nested = False, read_only = True, source = collapsed_source(self))
+
+    def get_attribute(self, instance):
+        if isinstance(instance, Mapping):
+            # Dữ liệu đã validate (chi tiết đơn hàng lồng nhau trả về sau update) chứa instance từ to_internal_value
+            value = instance.get(self.source)
+            return getattr(value, 'pk', value)
+        return getattr(instance, instance._meta.get_field(self.source).attname)
+
+    def to_representation(self, pk):
+        if not self.nested:
+            return pk
+        row = refdata.row(self.kind, pk)
+        return {'id': pk, 'name': row['name']} if row else None
+
+    def to_internal_value(self, data):
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type = type(data).__name__)
+        obj = refdata.instance(self.kind, pk)
+        if obj is None:
+            self.fail('does_not_exist', kind = self.kind, pk_value = pk)
+        return obj
+
+
+class ReferenceListField(serializers.Field):
+    # Quan hệ nhiều-nhiều tới màu/kích thước: chỉ prefetch id (reference_prefetch), tên lấy từ refdata
+    def __init__(self, kind, nested = True, **kwargs):
+        self.kind = kind
+        self.nested = nested
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def collapsed(self):
+        return ReferenceListField(self.kind, nested = False, source = collapsed_source(self))
+
+    def get_attribute(self, instance):
+        return [obj.pk for obj in getattr(instance, self.source).all()]
+
+    def to_representation(self, ids):
+        if not self.nested:
+            return ids
+        rows = [refdata.row(self.kind, pk) for pk in ids]
+        return [{'id': row['id'], 'name': row['name']} for row in rows if row]
+
+
+def reference_prefetch(name, model):
+    return Prefetch(name, queryset = model.objects.only('id'))
 
 
 #
@@ -27,6 +200,8 @@ class UserSerializer(ModelSerializer):
 
     def get_image(self, user):
         if user.avatar:
+            if self.context.get('avatar_url'):  # ảnh đã được upload sẵn (async_views)
+                return self.context['avatar_url']
             request = self.context.get('request')
             response = cloudinary.uploader.upload(user.avatar)
             return response['url']
@@ -60,6 +235,8 @@ class BusinessSerializer(ModelSerializer):
     #         return request.build_absolute_uri('/static/%s' % business.avatar.name) if request else ''
     def get_image(self, user):
         if user.avatar:
+            if self.context.get('avatar_url'):  # ảnh đã được upload sẵn (async_views)
+                return self.context['avatar_url']
             request = self.context.get('request')
             response = cloudinary.uploader.upload(user.avatar)
             return response['url']
@@ -68,6 +245,7 @@ class BusinessSerializer(ModelSerializer):
         data = validated_data.copy()
         group = Group.objects.get(name = 'Business')
         data.pop('groups', None)
+        data.pop('user_permissions', None)
         data.update({'is_active': True})
         u = Business(**data)
         u.set_password(u.password)
@@ -102,33 +280,63 @@ class SizeSerializer(ModelSerializer):
         fields = "__all__"
 
 
+class ConfirmedBusinessField(serializers.PrimaryKeyRelatedField):
+    # Kiểm tra doanh nghiệp đã xác nhận qua BusinessProfile (đọc theo khoá chính, không join bảng kế thừa Business);
+    # Shop.business chỉ cần id nên trả về Business chỉ có khoá chính
+    def to_internal_value(self, data):
+        profile = super().to_internal_value(data)
+        return Business(pk = profile.pk)
+
+
 class ShopSerializer(ModelSerializer):
-    business = serializers.PrimaryKeyRelatedField(
-        queryset = Business.objects.filter(is_active = True, status = 'confirmed'))
+    business = ConfirmedBusinessField(
+        queryset = BusinessProfile.objects.filter(status = 'confirmed', is_active = True))
 
     class Meta:
         model = Shop
-        fields = "__all__"
+        exclude = ['search_key']
         extra_kwargs = {
             'business': {'write_only': True},
         }
 
 
-class ProductSerializer(ModelSerializer):
+def product_rating_annotation():
+    rating = ProductReview.objects.filter(product = OuterRef('pk')).order_by().values('product') \
+        .annotate(avg = Avg('rating')).values('avg')
+    return {'avg_rating': Subquery(rating, output_field = FloatField())}
+
+
+def product_liked_annotation():
+    liked = Like.objects.filter(product_id = OuterRef('pk'), active = True).order_by().values('product_id') \
+        .annotate(total = Count('id')).values('total')
+    return {'liked_count': Coalesce(Subquery(liked, output_field = IntegerField()), 0)}
+
+
+class ProductSerializer(DynamicFieldsMixin, ModelSerializer):
     # image = serializers.SerializerMethodField(source = 'thumbnail')
     thumbnail = serializers.ImageField(use_url = False)
-    colors = ColorSerializer(many = True, required = False)
-    sizes = SizeSerializer(many = True, required = False)
-    category = CategorySerializer(required = False)
+    colors = ReferenceListField('colors')
+    sizes = ReferenceListField('sizes')
+    category = ReferenceField('categories', read_only = True)
     rating = serializers.SerializerMethodField()
     total_liked = serializers.SerializerMethodField()
     shop = ShopSerializer(required = False)
 
+    expandable_fields = ('shop', 'category', 'colors', 'sizes')
+    related_fields = {'shop': 'shop'}
+    prefetch_fields = {'colors': reference_prefetch('colors', Color), 'sizes': reference_prefetch('sizes', Size)}
+    annotated_fields = {'rating': product_rating_annotation, 'total_liked': product_liked_annotation}
+    deferred_fields = ('description',)
+
     def get_rating(self, obj):
+        if hasattr(obj, 'avg_rating'):
+            return obj.avg_rating
         product_rating = ProductReview.objects.filter(product = obj).aggregate(Avg('rating'))['rating__avg']
         return product_rating
 
     def get_total_liked(self, obj):
+        if hasattr(obj, 'liked_count'):
+            return obj.liked_count
         total_like = Like.objects.filter(product_id = obj, active = True).count()
         return total_like
 
@@ -143,9 +351,12 @@ class ProductSerializer(ModelSerializer):
                   "category", 'rating', 'total_liked']
 
 
-class ProductReviewSerializer(ModelSerializer):
+class ProductReviewSerializer(DynamicFieldsMixin, ModelSerializer):
     user = UserSerializer()
 
+    expandable_fields = ('user',)
+    related_fields = {'user': ('user', Prefetch('user__groups'), Prefetch('user__user_permissions'))}
+
     class Meta:
         model = ProductReview
         fields = "__all__"
@@ -158,12 +369,16 @@ class AuthorizeProductDetailSerializer(ProductSerializer):
 
     def get_liked(self, product):
         request = self.context.get('request')
-        if request:
-            return product.liked.filter(user_id = request.user).exists()
+        if request and request.user.is_authenticated:
+            # Context dùng chung cho mọi sản phẩm của trang nên tập id chỉ được nạp một lần
+            if 'liked_ids' not in self.context:
+                self.context['liked_ids'] = liked_product_ids(request.user)
+            return product.id in self.context['liked_ids']
+        return False
 
     def create(self, validated_data):
-        sizes = validated_data.pop("sizes")
-        colors = validated_data.pop("colors")
+        sizes = validated_data.pop("sizes", [])
+        colors = validated_data.pop("colors", [])
         product = Product.objects.create(**validated_data)
         for color_data in colors:
             color, _ = Color.objects.get_or_create(**color_data)
@@ -186,30 +401,53 @@ class GroupSerializer(ModelSerializer):
 
 
 class OrderDetailSerializer(ModelSerializer):
-    sizes = serializers.PrimaryKeyRelatedField(queryset = Size.objects.all())
-    colors = serializers.PrimaryKeyRelatedField(queryset = Color.objects.all())
-    product = serializers.PrimaryKeyRelatedField(queryset = Product.objects.filter(active = True))
+    sizes = ReferenceField('sizes', nested = False)
+    colors = ReferenceField('colors', nested = False)
+    # Shop được tải cùng sản phẩm khi validate để snapshot dòng đơn không cần truy vấn thêm
+    product = serializers.PrimaryKeyRelatedField(queryset = Product.objects.filter(active = True)
+                                                 .select_related('shop'))
 
     class Meta:
         model = OrderDetail
-        fields = "__all__"
+        exclude = snapshots.SNAPSHOT_FIELDS
 
 
 class OrderDetailDeserializer(ModelSerializer):
-    sizes = SizeSerializer()
-    colors = ColorSerializer()
-    product = ProductSerializer()
+    # Dòng đơn đọc từ snapshot lúc đặt (OrderDetail hoặc ArchivedOrderDetail): không join sang sản phẩm/shop
+    product = serializers.SerializerMethodField()
+    sizes = serializers.SerializerMethodField()
+    colors = serializers.SerializerMethodField()
+
+    def get_product(self, line):
+        return {'id': line.product_id, 'name': line.product_name, 'thumbnail': line.product_thumbnail,
+                'price': line.price, 'discount': line.discount, 'shop': {'name': line.shop_name}}
+
+    def get_sizes(self, line):
+        return {'id': line.sizes_id, 'name': line.size_name}
+
+    def get_colors(self, line):
+        return {'id': line.colors_id, 'name': line.color_name}
 
     class Meta:
         model = OrderDetail
-        fields = "__all__"
+        exclude = snapshots.SNAPSHOT_FIELDS
 
 
-class OrderSerializer(ModelSerializer):
+class OrderSerializer(DynamicFieldsMixin, ModelSerializer):
     order_details = OrderDetailSerializer(many = True, required = False)
     payment_method = serializers.CharField(write_only = True)
     payment_status = serializers.CharField(write_only = True)
 
+    # Chi tiết đơn hàng chỉ được trả về khi gọi ?expand=order_details
+    expandable_fields = ('order_details',)
+    collapsed_by_default = ('order_details',)
+    related_fields = {'order_details': Prefetch('order_detail')}
+
+    def get_expanded_field(self, name):
+        if name == 'order_details':
+            return OrderDetailDeserializer(many = True, read_only = True, source = 'order_detail')
+        return None
+
     class Meta:
         model = Order
         fields = "__all__"
@@ -218,10 +456,17 @@ class OrderSerializer(ModelSerializer):
         }
 
 
-class CartDetailSerializer(ModelSerializer):
+def cart_product_prefetch():
+    return Prefetch('product', queryset = ProductSerializer.setup_queryset(Product.objects.all()))
+
+
+class CartDetailSerializer(DynamicFieldsMixin, ModelSerializer):
     product = ProductSerializer()
-    colors = ColorSerializer()
-    sizes = SizeSerializer()
+    colors = ReferenceField('colors')
+    sizes = ReferenceField('sizes')
+
+    expandable_fields = ('product', 'colors', 'sizes')
+    related_fields = {'product': cart_product_prefetch}
 
     class Meta:
         model = CartDetail
@@ -0,0 +1,43 @@
+from . import refdata
+from .models import OrderDetail, Product
+
+# Ghi thông tin sản phẩm vào dòng đơn lúc đặt hàng (OrderLineSnapshotMixin): tên, ảnh, tên shop, tên kích thước và
+# màu. Đọc lịch sử/chi tiết đơn (OrderDetailDeserializer) chỉ dùng các cột này, không join sang catalog.
+SNAPSHOT_FIELDS = ['product_name', 'product_thumbnail', 'shop_id', 'shop_name', 'size_name', 'color_name']
+
+
+def reference_name(kind, pk, max_length):
+    row = refdata.row(kind, pk)
+    return row['name'][:max_length] if row else ''
+
+
+def snapshot_fields(product_name, thumbnail, shop_id, shop_name, size_id, color_id):
+    return {
+        'product_name': (product_name or '')[:255],
+        'product_thumbnail': str(thumbnail or '')[:255],
+        'shop_id': shop_id,
+        'shop_name': (shop_name or '')[:255],
+        'size_name': reference_name('sizes', size_id, 25),
+        'color_name': reference_name('colors', color_id, 255),
+    }
+
+
+def fill(lines):
+    # lines: các OrderDetail chưa lưu. Sản phẩm đã được tải sẵn cùng shop (serializer dùng select_related) thì dùng
+    # luôn, còn lại đọc chung một truy vấn; kích thước và màu lấy từ refdata
+    products = {}
+    for line in lines:
+        product = line.product if OrderDetail.product.is_cached(line) else None
+        if product is not None and (product.shop_id is None or Product.shop.is_cached(product)):
+            products[product.pk] = (product.name, product.thumbnail, product.shop_id,
+                                    product.shop.name if product.shop_id else None)
+    missing = {line.product_id for line in lines} - set(products) - {None}
+    if missing:
+        products.update((pk, row) for pk, *row in Product.objects.filter(id__in = missing)
+                        .values_list('id', 'name', 'thumbnail', 'shop_id', 'shop__name'))
+    for line in lines:
+        name, thumbnail, shop_id, shop_name = products.get(line.product_id, (None, None, None, None))
+        for field, value in snapshot_fields(name, thumbnail, shop_id, shop_name, line.sizes_id,
+                                            line.colors_id).items():
+            setattr(line, field, value)
+    return lines
@@ -1,3 +1,2020 @@
-from django.test import TestCase
+import csv
+import importlib
+import io
+import json
+import os
+import socketserver
+import tempfile
+import threading
+import time
+import zipfile
+from unittest import mock
+from xml.etree import ElementTree
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.wsgi import LimitedStream
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.db.migrations.executor import MigrationExecutor
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.utils import timezone
+from oauth2_provider.models import AccessToken
+from PIL import Image
+from rest_framework.test import APIClient
+
+from .backends.mysql_pool import base as mysql_pool_base
+from .backends.mysql_pool.base import DatabaseWrapper as PooledMySQLWrapper
+from .backends.pool import ConnectionPool, PoolTimeout
+from .datagen import DataGenerator, scaled_counts
+from .metrics import QueryRecorder
+from .middleware import InstrumentationMiddleware, ReplicaRoutingMiddleware
+from .models import (Product, User, Business, Shop, Category, Color, Size, Cart, CartDetail, Order, OrderDetail,
+                     Payment, Like, ProductReview, PaymentCallback, OrderNotification, ArchivedOrder,
+                     ArchivedOrderDetail, ArchivedPayment, Job, BusinessProfile, SearchToken)
+from .perms import IsBusiness, IsBusinessOwner
+from .routers import PrimaryReplicaRouter
+from .renderers import iter_json_array
+from .serializers import BusinessSerializer, CategorySerializer, ProductSerializer, UserSerializer
+from .urls import router
+from . import (archive, bulkupdate, checks, images, indexadvisor, jobs, metrics, payments, refdata, renderers,
+               search, throttling, typeahead)
+
+
+@override_settings(DATABASE_REPLICAS = ['replica'], REPLICA_STICKY_SECONDS = 30)
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.router = PrimaryReplicaRouter()
+        self.user = User(pk = 42, username = 'buyer')
+
+    def route(self, request, user = None, status = 200):
+        # Giả lập một view: xác thực user (như DRF) rồi ghi lại DB mà router chọn cho truy vấn đọc
+        seen = {}
+
+        def view(req):
+            if user is not None:
+                req.user = user
+            seen['read'] = self.router.db_for_read(Product)
+            seen['token'] = self.router.db_for_read(AccessToken)
+            seen['write'] = self.router.db_for_write(Product)
+            return HttpResponse(status = status)
+
+        response = ReplicaRoutingMiddleware(view)(request)
+        return seen, response
+
+    def test_safe_requests_read_from_replica(self):
+        seen, _ = self.route(self.factory.get('/products/'))
+        self.assertEqual(seen['read'], 'replica')
+        self.assertEqual(seen['write'], 'default')
+
+    def test_excluded_apps_read_from_primary(self):
+        seen, _ = self.route(self.factory.get('/products/'))
+        self.assertEqual(seen['token'], 'default')
+
+    def test_writes_use_primary_and_pin_the_client(self):
+        seen, response = self.route(self.factory.post('/order/'), user = self.user, status = 201)
+        self.assertEqual(seen['read'], 'default')
+        self.assertIn('primary_pin', response.cookies)
+
+        request = self.factory.get('/order/get-user-order/')
+        request.COOKIES['primary_pin'] = '1'
+        seen, _ = self.route(request)
+        self.assertEqual(seen['read'], 'default')
+
+    def test_user_reads_stick_to_primary_after_write(self):
+        self.route(self.factory.post('/products/1/like/'), user = self.user, status = 200)
+        seen, _ = self.route(self.factory.get('/products/'), user = self.user)
+        self.assertEqual(seen['read'], 'default')
+
+        other = User(pk = 7, username = 'other')
+        seen, _ = self.route(self.factory.get('/products/'), user = other)
+        self.assertEqual(seen['read'], 'replica')
+
+    def test_failed_writes_do_not_pin(self):
+        _, response = self.route(self.factory.post('/order/'), user = self.user, status = 400)
+        self.assertNotIn('primary_pin', response.cookies)
+        seen, _ = self.route(self.factory.get('/products/'), user = self.user)
+        self.assertEqual(seen['read'], 'replica')
+
+    def test_outside_request_uses_primary(self):
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_streaming_content_keeps_request_route(self):
+        from django.http import StreamingHttpResponse
+
+        def view(req):
+            return StreamingHttpResponse(self.router.db_for_read(Product) for _ in range(2))
+
+        response = ReplicaRoutingMiddleware(view)(self.factory.get('/order-detail/'))
+        self.assertEqual(list(response.streaming_content), [b'replica', b'replica'])
+
+
+def routed_actions():
+    # Mọi cặp (action, method) mà router trong shopping/urls.py công bố, dạng "ProductViewSet.list GET"
+    actions = set()
+    for prefix, viewset, basename in router.registry:
+        for route in router.get_routes(viewset):
+            for method, action in route.mapping.items():
+                if hasattr(viewset, action):
+                    actions.add('%s.%s %s' % (viewset.__name__, action, method.upper()))
+    return actions
+
+
+def routed_key(key):
+    # "ProductViewSet.list GET [authenticated]" là biến thể của "ProductViewSet.list GET"
+    return key.split(' [')[0]
+
+
+def image_file(name = 'image.png'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (4, 4)).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type = 'image/png')
+
+
+def product_payload(ctx):
+    return {'name': 'Renamed', 'quantity': 5, 'price': 1000, 'discount': 0, 'category': ctx['category'].id,
+            'thumbnail': image_file()}
+
+
+def shop_payload(ctx):
+    return {'name': 'Seller shop', 'business': ctx['seller'].id, 'email': 'shop@example.com'}
+
+
+def order_payload(ctx):
+    line = ctx['line']
+    return {'name': 'Buyer', 'email': 'buyer@example.com', 'phone': '0900000000', 'address': 'TP.HCM',
+            'total_amount': line['price'], 'payment_method': 'COD', 'payment_status': 'FAIL',
+            'order_details': [line]}
+
+
+# Số truy vấn tối đa cho mỗi action. Số truy vấn còn phải không đổi khi dữ liệu lớn lên.
+QUERY_BUDGETS = {
+    'CategoryViewSet.list GET': 0,
+    'ColorsViewSet.list GET': 0,
+    'SizesViewSet.list GET': 0,
+    'ProductViewSet.list GET': 4,
+    'ProductViewSet.list GET [authenticated]': 5,
+    'ProductViewSet.create POST': 16,
+    'ProductViewSet.retrieve GET': 3,
+    'ProductViewSet.retrieve GET [authenticated]': 4,
+    'ProductViewSet.batch GET': 3,
+    'ProductViewSet.batch GET [authenticated]': 4,
+    'ProductViewSet.update PUT': 7,
+    'ProductViewSet.bulk_update POST': 6,
+    'ProductViewSet.partial_update PATCH': 10,
+    'ProductViewSet.add_to_cart POST': 5,
+    'ProductViewSet.like POST': 4,
+    'ProductViewSet.get_like GET': 1,
+    'ProductViewSet.review POST': 4,
+    'ProductViewSet.list_review GET': 5,
+    'UserViewSet.list GET': 3,
+    'UserViewSet.create POST': 9,
+    'UserViewSet.retrieve GET': 3,
+    'UserViewSet.current_user GET': 2,
+    'UserViewSet.current_user PUT': 3,
+    'UserViewSet.logout POST': 0,
+    'OrderViewSet.list GET': 1,
+    'OrderViewSet.create POST': 7,
+    'OrderViewSet.retrieve GET': 1,
+    'OrderViewSet.update PUT': 6,
+    'OrderViewSet.partial_update PATCH': 5,
+    'OrderViewSet.get_user_order GET': 2,
+    'OrderViewSet.get_order_detail GET': 2,
+    'OrderViewSet.get_order_payment GET': 1,
+    'OrderViewSet.export GET': 4,
+    'CartViewSet.list GET': 5,
+    'CartViewSet.get_cart_detail GET': 5,
+    'CartDetailViewSet.list GET': 4,
+    'CartDetailViewSet.update PUT': 1,
+    'CartDetailViewSet.partial_update PATCH': 8,
+    'CartDetailViewSet.destroy DELETE': 2,
+    'ProductReviewViewSet.update PUT': 2,
+    'ProductReviewViewSet.partial_update PATCH': 5,
+    'ProductReviewViewSet.destroy DELETE': 5,
+    'OrderDetailViewSet.list GET': 1,
+    'OrderDetailViewSet.create POST': 3,
+    'BusinessViewSet.list GET': 3,
+    'BusinessViewSet.create POST': 9,
+    'BusinessViewSet.retrieve GET': 3,
+    'BusinessViewSet.current_business GET': 3,
+    'BusinessViewSet.current_business PUT': 6,
+    'BusinessViewSet.get_shop GET': 1,
+    'ShopViewSet.list GET': 1,
+    'ShopViewSet.create POST': 6,
+    'ShopViewSet.retrieve GET': 1,
+    'ShopViewSet.update PUT': 6,
+    'ShopViewSet.partial_update PATCH': 4,
+    'ShopViewSet.destroy DELETE': 5,
+    'ShopViewSet.get_products GET': 4,
+    'StatsViewSet.stats_count GET': 4,
+    'StatsViewSet.order_by_month GET': 2,
+}
+
+# action -> hàm dựng request từ dữ liệu mẫu: (method, path, data, user, format)
+ACTION_REQUESTS = {
+    'CategoryViewSet.list GET': lambda c: ('get', '/categories/', None, None, None),
+    'ColorsViewSet.list GET': lambda c: ('get', '/colors/', None, None, None),
+    'SizesViewSet.list GET': lambda c: ('get', '/sizes/', None, None, None),
+    'ProductViewSet.list GET': lambda c: ('get', '/products/', None, None, None),
+    'ProductViewSet.list GET [authenticated]': lambda c: ('get', '/products/', None, c['buyer'], None),
+    'ProductViewSet.create POST': lambda c: (
+        'post', '/products/', dict(product_payload(c), colors = ['Đỏ', 'Màu %d' % c['size']],
+                                   sizes = ['M', 'Size %d' % c['size']]), c['seller'], 'multipart'),
+    'ProductViewSet.retrieve GET': lambda c: ('get', '/products/%d/' % c['product'].id, None, None, None),
+    'ProductViewSet.retrieve GET [authenticated]': lambda c: ('get', '/products/%d/' % c['product'].id, None,
+                                                              c['buyer'], None),
+    'ProductViewSet.batch GET': lambda c: ('get', '/products/batch/', {'ids': c['batch_ids']}, None, None),
+    'ProductViewSet.batch GET [authenticated]': lambda c: ('get', '/products/batch/', {'ids': c['batch_ids']},
+                                                           c['buyer'], None),
+    'ProductViewSet.bulk_update POST': lambda c: (
+        'post', '/products/bulk-update/', {'items': [{'id': pk, 'discount': 20} for pk in c['product_ids']]},
+        c['seller'], 'json'),
+    'ProductViewSet.update PUT': lambda c: (
+        'put', '/products/%d/' % c['product'].id, product_payload(c), c['seller'], 'multipart'),
+    'ProductViewSet.partial_update PATCH': lambda c: (
+        'patch', '/products/%d/' % c['product'].id, {'name': 'Renamed'}, c['seller'], 'multipart'),
+    'ProductViewSet.add_to_cart POST': lambda c: (
+        'post', '/products/%d/add-to-cart/' % c['product'].id,
+        {'quantity': 1, 'size': c['line']['sizes'], 'color': c['line']['colors']}, c['buyer'], 'multipart'),
+    'ProductViewSet.like POST': lambda c: ('post', '/products/%d/like/' % c['product'].id, {}, c['buyer'],
+                                           'multipart'),
+    'ProductViewSet.get_like GET': lambda c: ('get', '/products/%d/get-like/' % c['product'].id, None, c['buyer'],
+                                              None),
+    'ProductViewSet.review POST': lambda c: (
+        'post', '/products/%d/review/' % c['product'].id, {'rating': 5, 'comment': 'Tốt'}, c['buyer'], 'multipart'),
+    'ProductViewSet.list_review GET': lambda c: ('get', '/products/%d/list-review/' % c['product'].id, None, None,
+                                                 None),
+    'UserViewSet.list GET': lambda c: ('get', '/users/', None, None, None),
+    'UserViewSet.create POST': lambda c: (
+        'post', '/users/', {'username': 'new-user-%d' % c['size'], 'password': 'secret-123', 'avatar': image_file()},
+        None, 'multipart'),
+    'UserViewSet.retrieve GET': lambda c: ('get', '/users/%d/' % c['buyer'].id, None, None, None),
+    'UserViewSet.current_user GET': lambda c: ('get', '/users/current-user/', None, c['buyer'], None),
+    'UserViewSet.current_user PUT': lambda c: ('put', '/users/current-user/', {'first_name': 'Tên'}, c['buyer'],
+                                               'multipart'),
+    'UserViewSet.logout POST': lambda c: ('post', '/users/logout/', {}, c['buyer'], 'multipart'),
+    'OrderViewSet.list GET': lambda c: ('get', '/order/', None, None, None),
+    'OrderViewSet.create POST': lambda c: ('post', '/order/', order_payload(c), c['buyer'], 'json'),
+    'OrderViewSet.retrieve GET': lambda c: ('get', '/order/%d/' % c['order'].id, None, None, None),
+    'OrderViewSet.update PUT': lambda c: ('put', '/order/%d/' % c['order'].id, order_payload(c), c['buyer'], 'json'),
+    'OrderViewSet.partial_update PATCH': lambda c: (
+        'patch', '/order/%d/' % c['order'].id, {'status': 'confirm'}, c['buyer'], 'json'),
+    'OrderViewSet.get_user_order GET': lambda c: ('get', '/order/get-user-order/', None, c['buyer'], None),
+    'OrderViewSet.get_order_detail GET': lambda c: ('get', '/order/%d/order-detail/' % c['order'].id, None,
+                                                    c['buyer'], None),
+    'OrderViewSet.get_order_payment GET': lambda c: ('get', '/order/%d/get-order-payment/' % c['order'].id, None,
+                                                     c['buyer'], None),
+    'OrderViewSet.export GET': lambda c: ('get', '/order/export/', None, c['seller'], None),
+    'CartViewSet.list GET': lambda c: ('get', '/cart/', None, None, None),
+    'CartViewSet.get_cart_detail GET': lambda c: ('get', '/cart/cart-detail/', None, c['buyer'], None),
+    'CartDetailViewSet.list GET': lambda c: ('get', '/cart-detail/', None, None, None),
+    'CartDetailViewSet.update PUT': lambda c: ('put', '/cart-detail/%d/' % c['cart_line'].id, {'quantity': 3},
+                                               c['buyer'], 'json'),
+    'CartDetailViewSet.partial_update PATCH': lambda c: (
+        'patch', '/cart-detail/%d/' % c['cart_line'].id, {'quantity': 3}, c['buyer'], 'json'),
+    'CartDetailViewSet.destroy DELETE': lambda c: ('delete', '/cart-detail/%d/' % c['spare_cart_line'].id, None,
+                                                   c['buyer'], None),
+    'ProductReviewViewSet.update PUT': lambda c: ('put', '/product-review/%d/' % c['review'].id, {'comment': 'x'},
+                                                  c['buyer'], 'json'),
+    'ProductReviewViewSet.partial_update PATCH': lambda c: (
+        'patch', '/product-review/%d/' % c['review'].id, {'comment': 'x'}, c['buyer'], 'json'),
+    'ProductReviewViewSet.destroy DELETE': lambda c: ('delete', '/product-review/%d/' % c['spare_review'].id, None,
+                                                      c['buyer'], None),
+    'OrderDetailViewSet.list GET': lambda c: ('get', '/order-detail/', None, None, None),
+    'OrderDetailViewSet.create POST': lambda c: ('post', '/order-detail/', dict(c['line'], order = c['order'].id),
+                                                 c['buyer'], 'json'),
+    'BusinessViewSet.list GET': lambda c: ('get', '/business/', None, None, None),
+    'BusinessViewSet.create POST': lambda c: (
+        'post', '/business/', {'username': 'new-business-%d' % c['size'], 'password': 'secret-123',
+                               'avatar': image_file(), 'business_name': 'DN', 'address': 'HN', 'phone': '0911111111',
+                               'tax_code': '0101'}, None, 'multipart'),
+    'BusinessViewSet.retrieve GET': lambda c: ('get', '/business/%d/' % c['seller'].id, None, None, None),
+    'BusinessViewSet.current_business GET': lambda c: ('get', '/business/current-business/', None, c['seller'],
+                                                       None),
+    'BusinessViewSet.current_business PUT': lambda c: (
+        'put', '/business/current-business/', {'address': 'Đà Nẵng'}, c['seller'], 'multipart'),
+    'BusinessViewSet.get_shop GET': lambda c: ('get', '/business/%d/get-shop/' % c['seller'].id, None, None, None),
+    'ShopViewSet.list GET': lambda c: ('get', '/shop/', None, None, None),
+    'ShopViewSet.create POST': lambda c: (
+        'post', '/shop/', {'name': 'Shop mới', 'business': c['new_seller'].id, 'email': 'new@example.com'},
+        c['new_seller'], 'json'),
+    'ShopViewSet.retrieve GET': lambda c: ('get', '/shop/%d/' % c['shop'].id, None, None, None),
+    'ShopViewSet.update PUT': lambda c: ('put', '/shop/%d/' % c['shop'].id, shop_payload(c), c['seller'], 'json'),
+    'ShopViewSet.partial_update PATCH': lambda c: ('patch', '/shop/%d/' % c['shop'].id, shop_payload(c),
+                                                   c['seller'], 'json'),
+    'ShopViewSet.destroy DELETE': lambda c: ('delete', '/shop/%d/' % c['spare_shop'].id, None, None, None),
+    'ShopViewSet.get_products GET': lambda c: ('get', '/shop/%d/get-products/' % c['shop'].id, None, None, None),
+    'StatsViewSet.stats_count GET': lambda c: ('get', '/stats/stats-count/', None, c['buyer'], None),
+    'StatsViewSet.order_by_month GET': lambda c: ('get', '/stats/order-by-month/', None, c['buyer'], None),
+}
+
+
+@mock.patch('cloudinary.uploader.upload', return_value = {'url': 'https://res.cloudinary.com/demo/image.png'})
+class QueryBudgetTests(TestCase):
+    # Chạy mọi action của router trên hai cỡ dữ liệu: số truy vấn phải không đổi và nằm trong QUERY_BUDGETS
+    SIZES = (2, 6)
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Ảnh upload (avatar, thumbnail) được ghi vào thư mục tạm thay vì MEDIA_ROOT thật
+        media = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(media.cleanup)
+        cls.enterClassContext(override_settings(MEDIA_ROOT = media.name))
+
+    def build(self, size):
+        cache.clear()
+        refdata.reset()
+        DataGenerator(scaled_counts(0, users = size * 3, businesses = 1, products = size * 4, likes = size * 6,
+                                    reviews = size * 4, carts = size, orders = size * 2), seed = size).run()
+        ctx = {'size': size}
+        if not hasattr(self, 'buyer'):
+            self.buyer = User.objects.create_user(username = 'buyer', password = 'secret')
+            self.seller = Business.objects.create(username = 'seller', business_name = 'Seller', address = 'HCM',
+                                                  phone = '0900000001', tax_code = '1', status = 'confirmed')
+            self.seller.groups.add(Group.objects.get(name = 'Business'))
+            self.shop = Shop.objects.create(name = 'Seller shop', business = self.seller, email = 'shop@example.com')
+            self.cart = Cart.objects.create(user = self.buyer)
+        new_seller = Business.objects.create(username = 'new-seller-%d' % size, business_name = 'New',
+                                             address = 'HCM', phone = '0900000002', tax_code = '2',
+                                             status = 'confirmed')
+        new_seller.groups.add(Group.objects.get(name = 'Business'))
+
+        category = Category.objects.first()
+        colors = list(Color.objects.all()[:size])
+        sizes = list(Size.objects.all()[:size])
+        products = []
+        for i in range(size):
+            product = Product.objects.create(name = 'Budget product %d-%d' % (size, i), quantity = 100, price = 1000,
+                                             discount = 10, category = category, shop = self.shop,
+                                             thumbnail = 'shopping/x.jpg')
+            product.colors.set(colors)
+            product.sizes.set(sizes)
+            products.append(product)
+        product = products[0]
+        Like.objects.create(user_id = self.buyer, product_id = product)
+        for other in products:
+            Like.objects.get_or_create(user_id = self.buyer, product_id = other)
+            ProductReview.objects.create(user = self.buyer, product = product, rating = 4, comment = 'ok')
+            CartDetail.objects.create(cart = self.cart, product = other, sizes = sizes[0], colors = colors[0],
+                                      quantity = 1)
+        order = Order.objects.create(user = self.buyer, name = 'Buyer', email = 'b@example.com', phone = '09',
+                                     address = 'HCM', total_amount = 1000 * size)
+        for other in products:
+            OrderDetail.objects.create(order = order, product = other, price = 1000, discount = 10, quantity = 1,
+                                       sizes = sizes[0], colors = colors[0])
+        Payment.objects.create(order = order, user = self.buyer, total_amount = order.total_amount)
+
+        ctx.update({
+            'buyer': self.buyer, 'seller': self.seller, 'new_seller': new_seller, 'shop': self.shop,
+            'spare_shop': Shop.objects.create(name = 'Spare', email = 'spare@example.com'),
+            'category': category, 'product': product, 'order': order,
+            'batch_ids': ','.join(str(p.id) for p in reversed(products)) + ',0',
+            'product_ids': [p.id for p in products],
+            'cart_line': CartDetail.objects.filter(cart = self.cart).last(),
+            'spare_cart_line': CartDetail.objects.create(cart = self.cart, product = product, sizes = sizes[0],
+                                                         colors = colors[0], quantity = 1),
+            'review': ProductReview.objects.filter(user = self.buyer).last(),
+            'spare_review': ProductReview.objects.create(user = self.buyer, product = product, comment = 'xoá'),
+            'line': {'product': product.id, 'price': 1000, 'discount': 10, 'quantity': 1,
+                     'sizes': sizes[0].id, 'colors': colors[0].id},
+        })
+        return ctx
+
+    def measure(self, key, ctx):
+        method, path, data, user, fmt = ACTION_REQUESTS[key](ctx)
+        client = APIClient()
+        client.raise_request_exception = False
+        if user is not None:
+            client.force_authenticate(user)
+        # Mỗi process giữ sẵn refdata, chỉ nạp lại khi có ghi: nạp trước để không tính vào request
+        refdata.snapshot()
+        recorder = QueryRecorder()
+        # TestCase không commit, chạy các callback on_commit (xoá cache) như khi request thật kết thúc
+        with self.captureOnCommitCallbacks(execute = True), recorder.capture():
+            response = getattr(client, method)(path, data, format = fmt)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 500, '%s trả về %s' % (key, response.status_code))
+        return recorder
+
+    def describe(self, recorder):
+        return '\n'.join('    %3d x %s' % (count, shape) for shape, count in recorder.shapes.most_common())
+
+    def test_every_routed_action_has_a_budget(self, upload):
+        missing = routed_actions() - {routed_key(key) for key in QUERY_BUDGETS}
+        self.assertFalse(missing, 'Thiếu QUERY_BUDGETS/ACTION_REQUESTS cho: %s' % sorted(missing))
+        self.assertEqual(set(QUERY_BUDGETS), set(ACTION_REQUESTS))
+
+    def test_query_counts_are_constant_and_within_budget(self, upload):
+        routed = routed_actions()
+        actions = sorted(key for key in QUERY_BUDGETS if routed_key(key) in routed)
+        results = {key: [] for key in actions}
+        for size in self.SIZES:
+            ctx = self.build(size)
+            for key in actions:
+                results[key].append(self.measure(key, ctx))
+
+        failures = []
+        for key in actions:
+            small, large = results[key]
+            budget = QUERY_BUDGETS[key]
+            if large.count != small.count:
+                failures.append('%s: %d truy vấn với dữ liệu nhỏ, %d với dữ liệu lớn\n%s' % (
+                    key, small.count, large.count, self.describe(large)))
+            elif large.count > budget:
+                failures.append('%s: %d truy vấn, vượt budget %d\n%s' % (
+                    key, large.count, budget, self.describe(large)))
+        if failures:
+            self.fail('\n\n'.join(failures))
+
+
+class LikeToggleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username = 'liker', password = 'secret')
+        category = Category.objects.create(name = 'Áo')
+        self.products = [Product.objects.create(name = 'P%d' % i, quantity = 1, price = 1000, discount = 0,
+                                                category = category, thumbnail = 'shopping/x.jpg') for i in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def liked_flags(self):
+        response = self.client.get('/products/')
+        return {item['id']: item['liked'] for item in response.data['results']}
+
+    def toggle(self, product):
+        with self.captureOnCommitCallbacks(execute = True):
+            return self.client.post('/products/%d/like/' % product.id).data['active']
+
+    def test_toggle_keeps_one_row_and_refreshes_liked_flags(self):
+        first, second = self.products[:2]
+        self.assertEqual(self.liked_flags(), {p.id: False for p in self.products})
+
+        self.assertTrue(self.toggle(first))
+        self.assertTrue(self.toggle(second))
+        self.assertFalse(self.toggle(second))
+        self.assertEqual(Like.objects.filter(user_id = self.user, product_id = second).count(), 1)
+        self.assertEqual(self.liked_flags(), {first.id: True, second.id: False, self.products[2].id: False})
+
+
+class ProductBatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name = 'Giày')
+        self.products = [Product.objects.create(name = 'P%d' % i, quantity = 1, price = 1000, discount = 0,
+                                                category = category, thumbnail = 'shopping/x.jpg') for i in range(3)]
+        self.client = APIClient()
+
+    def batch(self, ids):
+        return self.client.get('/products/batch/', {'ids': ','.join(str(pk) for pk in ids)})
+
+    def test_batch_keeps_order_reports_missing_and_sees_updates(self):
+        first, second, third = self.products
+        response = self.batch([third.id, 0, first.id])
+        self.assertEqual([item['id'] for item in response.data['results']], [third.id, first.id])
+        self.assertEqual(response.data['missing'], [0])
+
+        with self.assertNumQueries(0):
+            self.batch([first.id, third.id])
+        with self.captureOnCommitCallbacks(execute = True):
+            third.name = 'Đổi tên'
+            third.save()
+        self.assertEqual(self.batch([third.id]).data['results'][0]['name'], 'Đổi tên')
+
+    def test_batch_rejects_too_many_ids(self):
+        with override_settings(PRODUCT_BATCH_MAX_IDS = 2):
+            self.assertEqual(self.batch([p.id for p in self.products]).status_code, 400)
+
+
+class DynamicFieldsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        refdata.reset()
+        self.category = Category.objects.create(name = 'Áo')
+        self.shop = Shop.objects.create(name = 'Shop A', email = 'shop@example.com')
+        self.colors = [Color.objects.create(name = name) for name in ('Đỏ', 'Xanh')]
+        self.add_products(2)
+        refdata.snapshot()
+
+    def add_products(self, count):
+        for i in range(count):
+            product = Product.objects.create(name = 'P%d' % i, quantity = 1, price = 1000, discount = 0,
+                                             category = self.category, shop = self.shop, thumbnail = 'shopping/x.jpg')
+            product.colors.set(self.colors)
+
+    def products(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            results = APIClient().get('/products/', params).data['results']
+        return results, queries
+
+    def test_fields_trims_payload_and_ignores_unknown_names(self):
+        results, _ = self.products(fields = 'id,name,nope')
+        self.assertEqual([set(row) for row in results], [{'id', 'name'}] * 2)
+        results, _ = self.products(fields = 'id,colors')
+        self.assertEqual(results[0]['colors'], [{'id': color.id, 'name': color.name} for color in self.colors])
+
+    def test_expand_lists_nested_relations_and_collapses_the_rest(self):
+        results, _ = self.products(expand = 'shop')
+        self.assertEqual((results[0]['shop']['name'], results[0]['category']), ('Shop A', self.category.id))
+        self.assertEqual(results[0]['colors'], [color.id for color in self.colors])
+        results, queries = self.products(expand = '')
+        self.assertEqual((results[0]['shop'], results[0]['category']), (self.shop.id, self.category.id))
+        self.assertFalse(any('"shopping_shop"' in query['sql'] for query in queries))
+
+    def test_query_count_does_not_grow_with_rows(self):
+        # Mặc định: đếm, sản phẩm + shop, màu, kích thước; chỉ id/tên thì không prefetch. Mở rộng hay không, số truy
+        # vấn không đổi khi thêm sản phẩm
+        expected = [({}, 4), ({'expand': 'shop'}, 4), ({'expand': ''}, 4), ({'fields': 'id,name'}, 2)]
+        for added in (0, 4):
+            self.add_products(added)
+            for params, count in expected:
+                with self.subTest(params = params, products = 2 + added), self.assertNumQueries(count):
+                    self.assertEqual(len(APIClient().get('/products/', params).data['results']), 2 + added)
+
+
+class StreamingJSONTests(TestCase):
+    def setUp(self):
+        self.categories = [Category.objects.create(name = 'Danh mục "%d"' % i) for i in range(5)]
+
+    def stream(self, queryset, chunk_size):
+        parts = list(iter_json_array(queryset, CategorySerializer, chunk_size = chunk_size))
+        return json.loads(b''.join(parts)), len(parts)
+
+    def expected(self, queryset):
+        return json.loads(json.dumps(CategorySerializer(queryset, many = True).data))
+
+    def test_output_matches_serializer_at_chunk_boundaries(self):
+        ordered = Category.objects.order_by('id')
+        for rows, chunk_size, parts in [(0, 2, 2), (4, 2, 4), (5, 2, 5), (4, 4, 3), (5, 4, 4)]:
+            with self.subTest(rows = rows, chunk_size = chunk_size):
+                queryset = ordered[:rows] if rows else ordered.none()
+                # Mảnh mở đầu, mỗi chunk một mảnh, mảnh đóng
+                self.assertEqual(self.stream(queryset, chunk_size), (self.expected(queryset), parts))
+
+    def test_list_of_querysets_is_one_array(self):
+        first, second = Category.objects.filter(id__lte = self.categories[1].id), Category.objects.filter(
+            id__gt = self.categories[1].id)
+        data, _ = self.stream([first.order_by('id'), second.order_by('id')], 2)
+        self.assertEqual(data, self.expected(Category.objects.order_by('id')))
+        self.assertEqual(self.stream([Category.objects.none(), first.order_by('id')], 2)[0], self.expected(first))
+
+    def test_falls_back_to_json_without_orjson(self):
+        with mock.patch.object(renderers, 'orjson', None):
+            data, _ = self.stream(Category.objects.order_by('id'), 2)
+        self.assertEqual(data, self.expected(Category.objects.order_by('id')))
+        self.assertEqual(renderers.dumps({'name': 'Áo'}), '{"name":"Áo"}'.encode('utf-8'))
+
+
+@override_settings(INSTRUMENTATION_SAMPLE_RATE = 1.0, INSTRUMENTATION_N_PLUS_ONE_THRESHOLD = 5)
+class InstrumentationMiddlewareTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.categories = [Category.objects.create(name = 'Danh mục %d' % i) for i in range(6)]
+
+    def names(self, count):
+        # N+1 đã biết: đọc từng danh mục một
+        return [Category.objects.get(pk = category.pk).name for category in self.categories[:count]]
+
+    def endpoint(self):
+        return metrics.snapshot()['endpoints']['<unmatched>']
+
+    def test_repeated_query_shape_is_reported(self):
+        middleware = InstrumentationMiddleware(lambda request: HttpResponse(','.join(self.names(6))))
+        with self.assertLogs('shopping.instrumentation', 'WARNING') as logs:
+            middleware(RequestFactory().get('/n-plus-one/'))
+        endpoint = self.endpoint()
+        self.assertEqual((endpoint['n_plus_one'], endpoint['query_count']['sum']), (1, 6))
+        self.assertEqual([row['count'] for row in endpoint['repeated_shapes']], [6])
+        self.assertIn('6 x', logs.output[0])
+
+        InstrumentationMiddleware(lambda request: HttpResponse(','.join(self.names(4))))(RequestFactory().get('/'))
+        self.assertEqual((self.endpoint()['requests'], self.endpoint()['n_plus_one']), (2, 1))
+
+    def test_streaming_response_is_recorded_when_consumed(self):
+        def content():
+            for name in self.names(6):
+                time.sleep(0.01)
+                yield name.encode('utf-8')
+
+        response = InstrumentationMiddleware(lambda request: StreamingHttpResponse(content()))(
+            RequestFactory().get('/'))
+        self.assertEqual(metrics.snapshot()['endpoints'], {})
+        with self.assertLogs('shopping.instrumentation', 'WARNING'):
+            body = b''.join(response.streaming_content)
+        self.assertTrue(body.startswith('Danh mục 0'.encode('utf-8')))
+        endpoint = self.endpoint()
+        self.assertEqual((endpoint['requests'], endpoint['n_plus_one'], endpoint['query_count']['sum']), (1, 1, 6))
+        self.assertGreaterEqual(endpoint['latency_ms']['sum'], 60)
+
+
+class IndexAdvisorTests(TestCase):
+    def shape(self, queryset, total_ms = 100.0, count = 10):
+        sql, params = queryset.query.sql_with_params()
+        return {'sql': sql, 'params': list(params), 'count': count, 'total_ms': total_ms, 'alias': 'default'}
+
+    def advise(self, *querysets):
+        shapes = {'shape-%d' % i: self.shape(qs, total_ms = 100.0 * (len(querysets) - i))
+                  for i, qs in enumerate(querysets)}
+        return indexadvisor.advise(shapes)
+
+    def test_pattern_separates_equality_range_and_order(self):
+        sql, params = Product.objects.filter(shop_id = 1, quantity__gt = 0).order_by('-created_date') \
+            .query.sql_with_params()
+        self.assertEqual(dict(indexadvisor.QueryPattern(sql, params).tables),
+                         {'shopping_product': {'equality': ['shop_id'], 'range': ['quantity'],
+                                               'order': ['created_date']}})
+
+        # Cờ boolean không có toán tử, LIKE 'ao%' là range còn LIKE '%ao%' không dùng được index
+        sql, params = Product.objects.filter(active = True, name__startswith = 'ao').query.sql_with_params()
+        self.assertEqual(indexadvisor.QueryPattern(sql, params).tables['shopping_product'],
+                         {'equality': ['active'], 'range': ['name'], 'order': []})
+        sql, params = Product.objects.filter(name__contains = 'ao', quantity = 2).query.sql_with_params()
+        self.assertEqual(indexadvisor.QueryPattern(sql, params).tables['shopping_product'],
+                         {'equality': ['quantity'], 'range': [], 'order': []})
+
+    def test_subquery_alias_resolves_to_its_table(self):
+        queryset = Product.objects.filter(id__in = Like.objects.filter(active = True, user_id = 3)
+                                          .values('product_id'))
+        sql, params = queryset.query.sql_with_params()
+        pattern = indexadvisor.QueryPattern(sql, params)
+        self.assertEqual(sorted(pattern.tables['shopping_like']['equality']), ['active', 'user_id_id'])
+        # Lọc theo khoá chính thì không cần đề xuất
+        self.assertEqual(pattern.candidate_columns('shopping_product', 'id'), ([], []))
+
+    def test_proposes_meta_index_for_uncovered_filter(self):
+        report, proposals = self.advise(Product.objects.filter(shop_id = 1, quantity__gt = 0)
+                                        .order_by('-created_date'))
+        self.assertEqual([(p.model, p.fields) for p in proposals], [(Product, ['shop', 'created_date'])])
+        proposal = proposals[0]
+        self.assertEqual((proposal.weight_ms, proposal.count, proposal.shapes), (100.0, 10, ['shape-0']))
+        self.assertEqual(proposal.meta_snippet(),
+                         "models.Index(fields = ['shop', 'created_date'], name = '%s')" % proposal.index.name)
+        self.assertTrue(proposal.index.name.startswith('shopping_pr_shop_id_'))
+        self.assertEqual(report[0]['proposals'], [proposal])
+        self.assertTrue(report[0]['plan'])
+
+    def test_existing_index_is_not_proposed_again(self):
+        report, proposals = self.advise(
+            Product.objects.filter(active = True, category_id = 1).order_by('price'),
+            Job.objects.filter(queue = 'default', state = Job.JobState.PENDING, run_at__lte = timezone.now()),
+            Product.objects.filter(shop_id = 1),
+            Product.objects.filter(pk = 1))
+        self.assertEqual(proposals, [])
+        self.assertEqual([item['proposals'] for item in report], [[], [], [], []])
+
+    def test_prefix_is_merged_into_wider_proposal(self):
+        report, proposals = self.advise(Product.objects.filter(quantity = 3).order_by('price'),
+                                        Product.objects.filter(quantity = 3),
+                                        Like.objects.filter(active = True, user_id = 3))
+        self.assertEqual([(p.model, p.fields) for p in proposals],
+                         [(Product, ['quantity', 'price']), (Like, ['active', 'user_id'])])
+        self.assertEqual((proposals[0].weight_ms, proposals[0].count, proposals[0].shapes),
+                         (500.0, 20, ['shape-0', 'shape-1']))
+
+    def test_merge_prefixes_keeps_other_models_apart(self):
+        narrow, wide = indexadvisor.Proposal(Product, ['quantity']), indexadvisor.Proposal(Product, ['quantity', 'price'])
+        other = indexadvisor.Proposal(Order, ['status'])
+        wider_other = indexadvisor.Proposal(Order, ['phone', 'status'])
+        narrow.weight_ms, wide.weight_ms, other.weight_ms, wider_other.weight_ms = 300.0, 50.0, 200.0, 100.0
+        narrow.scan = True
+        merged = indexadvisor.merge_prefixes([narrow, other, wider_other, wide])
+        self.assertEqual([(p.model, p.fields, p.weight_ms) for p in merged],
+                         [(Product, ['quantity', 'price'], 350.0), (Order, ['status'], 200.0),
+                          (Order, ['phone', 'status'], 100.0)])
+        self.assertTrue(merged[0].scan)
+
+
+class ReferenceDataTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        refdata.reset()
+        self.red = Color.objects.create(name = 'Đỏ')
+        self.client = APIClient()
+
+    def test_list_uses_etag_and_sees_writes(self):
+        response = self.client.get('/colors/')
+        etag = response['ETag']
+        self.assertEqual(response.data, [{'id': self.red.id, 'name': 'Đỏ'}])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/colors/', HTTP_IF_NONE_MATCH = etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute = True):
+            Color.objects.create(name = 'Xanh')
+        response = self.client.get('/colors/', HTTP_IF_NONE_MATCH = etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual([row['name'] for row in response.data], ['Đỏ', 'Xanh'])
+
+    def test_reference_fields_collapse_to_ids(self):
+        category = Category.objects.create(name = 'Áo')
+        product = Product.objects.create(name = 'P', quantity = 1, price = 1000, discount = 0, category = category,
+                                         thumbnail = 'shopping/x.jpg')
+        product.colors.add(self.red)
+        # Chỉ mở rộng shop: danh mục và màu trả về id
+        data = ProductSerializer(product, expand = {'shop'}).data
+        self.assertEqual((data['category'], data['colors']), (category.id, [self.red.id]))
+
+    def test_resolve_names_creates_only_new_names(self):
+        with self.captureOnCommitCallbacks(execute = True):
+            ids = refdata.resolve_names('colors', ['Đỏ', 'Vàng', 'Đỏ', ''])
+        self.assertEqual(ids[0], self.red.id)
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(refdata.row('colors', ids[1])['name'], 'Vàng')
+        self.assertEqual(Color.objects.count(), 2)
+
+    def test_unknown_id_reloads_only_when_it_exists(self):
+        self.assertEqual(refdata.row('colors', self.red.id)['name'], 'Đỏ')
+        # bulk_create không gửi signal nên phiên bản không đổi: bản nhớ vừa nạp vẫn phải thấy dòng mới
+        blue = Color.objects.bulk_create([Color(name = 'Xanh')])[0]
+        self.assertEqual(refdata.row('colors', blue.id)['name'], 'Xanh')
+        with self.assertNumQueries(1):
+            self.assertIsNone(refdata.row('colors', 999))
+
+
+@override_settings(ADMIN_EXACT_COUNT_LIMIT = 2, ADMIN_EXPORT_CHUNK_SIZE = 2)
+class LargeTableAdminTests(TestCase):
+    def setUp(self):
+        admin = User.objects.create_superuser(username = 'admin', password = 'secret', email = 'admin@example.com')
+        self.orders = [Order.objects.create(user = admin, name = 'Khách %d' % i, email = 'k%d@example.com' % i,
+                                            phone = '09%08d' % i, address = 'HCM', total_amount = 1000 * i)
+                       for i in range(5)]
+        self.client.force_login(admin)
+
+    def test_changelist_counts_are_estimated_or_capped(self):
+        with mock.patch('shopping.paginators.estimated_row_count', return_value = 5000000):
+            response = self.client.get('/admin/shopping/order/')
+            self.assertEqual(response.context['cl'].result_count, 5000000)
+            response = self.client.get('/admin/shopping/order/', {'status__exact': 'created'})
+            self.assertEqual(response.context['cl'].result_count, 2)
+        response = self.client.get('/admin/shopping/order/', {'q': str(self.orders[3].id)})
+        self.assertIn(self.orders[3], list(response.context['cl'].result_list))
+        self.assertEqual(self.client.get('/admin/shopping/order/', {'q': 'khong-co'}).status_code, 200)
+
+    def test_export_streams_every_row_in_chunks(self):
+        response = self.client.post('/admin/shopping/order/', {'action': 'export_as_csv', 'select_across': '1',
+                                                               '_selected_action': [self.orders[0].id]})
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertEqual([line.split(',')[1] for line in lines[1:]], ['Khách %d' % i for i in range(5)])
+
+
+class ResizedImageTests(SimpleTestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT = media.name, IMAGE_CACHE_DIR = os.path.join(media.name, 'cache'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        os.makedirs(os.path.join(media.name, 'shopping'))
+        Image.new('RGB', (400, 200), 'red').save(os.path.join(media.name, 'shopping', 'x.jpg'), 'JPEG')
+        metrics.reset()
+
+    def get(self, name = 'shopping/x.jpg', **params):
+        return self.client.get('/images/%s' % name, params)
+
+    def test_serves_cached_variant_with_long_lived_headers(self):
+        response = self.get(w = 128, fmt = 'webp')
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(Image.open(io.BytesIO(b''.join(response.streaming_content))).size, (128, 64))
+        self.assertEqual(self.client.get('/images/shopping/x.jpg', {'w': 128, 'fmt': 'webp'},
+                                         HTTP_IF_NONE_MATCH = response['ETag']).status_code, 304)
+        self.assertEqual(metrics.snapshot()['counters'], {'image_cache.miss': 1, 'image_cache.hit': 1})
+
+        self.assertEqual(self.get(w = 100).status_code, 400)
+        self.assertEqual(self.get(w = 128, fmt = 'gif').status_code, 400)
+        self.assertEqual(self.get('shopping/../../etc/passwd', w = 128).status_code, 404)
+
+    def test_concurrent_requests_resize_once(self):
+        statuses = []
+
+        def fetch():
+            statuses.append(self.get(w = 256).status_code)
+
+        with mock.patch('shopping.images.resize', wraps = images.resize) as resize:
+            threads = [threading.Thread(target = fetch) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(statuses, [200] * 8)
+        self.assertEqual(resize.call_count, 1)
+
+    def test_least_recently_used_variants_are_evicted(self):
+        size = len(b''.join(self.get(w = 64).streaming_content))
+        with override_settings(IMAGE_CACHE_MAX_BYTES = size * 3):
+            for width in (128, 256, 320, 480):
+                self.get(w = width)
+            self.get(w = 64)
+        counters = metrics.snapshot()['counters']
+        self.assertGreater(counters['image_cache.evicted'], 0)
+        # Biến thể dùng lâu nhất đã bị xoá nên phải resize lại
+        self.assertEqual(counters['image_cache.miss'], 6)
+
+
+class FakeGateway:
+    # Cổng thanh toán giả: ký và gửi callback tới webhook, sinh file đối soát
+    def __init__(self, client, name = 'MOMO', secret = 'momo-secret'):
+        self.client = client
+        self.name = name
+        self.secret = secret
+        self.sequence = 0
+
+    def callback(self, order_id, amount, status = 'SUCCESS', event_id = None, secret = None):
+        self.sequence += 1
+        body = json.dumps({'event_id': event_id or 'evt-%d' % self.sequence, 'order_id': order_id,
+                           'amount': amount, 'status': status}).encode()
+        return self.client.post('/payments/webhook/%s/' % self.name.lower(), body, content_type = 'application/json',
+                                HTTP_X_SIGNATURE = payments.sign(secret or self.secret, body))
+
+    def settlement(self, rows):
+        file = tempfile.NamedTemporaryFile('w', suffix = '.csv', delete = False, newline = '')
+        with file:
+            file.write('order_id,amount,status\n')
+            for row in rows:
+                file.write('%s,%s,%s\n' % row)
+        return file.name
+
+
+@override_settings(PAYMENT_WEBHOOK_SECRETS = {'MOMO': 'momo-secret'})
+class PaymentCallbackTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username = 'payer', password = 'secret')
+        self.orders = []
+        for amount in (1000, 2000, 3000):
+            order = Order.objects.create(user = self.user, name = 'Payer', email = 'p@example.com', phone = '09',
+                                         address = 'HCM', total_amount = amount)
+            Payment.objects.create(order = order, user = self.user, total_amount = amount,
+                                   payment_method = Payment.PaymentMethod.MOMO)
+            self.orders.append(order)
+        self.gateway = FakeGateway(self.client)
+
+    def test_webhook_verifies_and_deduplicates(self):
+        order = self.orders[0]
+        with self.assertNumQueries(1):
+            self.assertEqual(self.gateway.callback(order.id, 1000, event_id = 'a').status_code, 200)
+        self.assertEqual(self.gateway.callback(order.id, 1000, event_id = 'a').status_code, 200)
+        self.assertEqual(self.gateway.callback(order.id, 1000, secret = 'wrong').status_code, 401)
+        self.assertEqual(FakeGateway(self.client, 'ZALOPAY').callback(order.id, 1000).status_code, 404)
+        self.assertEqual(PaymentCallback.objects.count(), 1)
+
+    def test_worker_applies_transitions_in_batches(self):
+        first, second, third = self.orders
+        self.gateway.callback(first.id, 1000)
+        self.gateway.callback(second.id, 999)
+        self.gateway.callback(0, 1000)
+        self.gateway.callback(third.id, 3000, status = 'FAIL')
+        # Đọc callback, đọc Payment + Order, 3 bulk_update, ghi outbox và 4 savepoint: không phụ thuộc số callback
+        with self.assertNumQueries(10):
+            count, stats = payments.process_batch()
+        self.assertEqual((count, stats), (4, {'applied': 2, 'failed': 2, 'payments': 1, 'orders': 1}))
+        first.refresh_from_db()
+        self.assertEqual(first.status, 'paid')
+        self.assertEqual(Payment.objects.get(order = first).payment_status, Payment.PaymentStatus.IS_SUCCESS)
+        self.assertEqual(Payment.objects.get(order = second).payment_status, Payment.PaymentStatus.IS_FAIL)
+
+        # Callback FAIL gửi lại sau không hạ trạng thái thanh toán đã thành công
+        self.gateway.callback(first.id, 1000, status = 'FAIL')
+        call_command('process_payment_callbacks', once = True, stdout = io.StringIO())
+        self.assertEqual(Payment.objects.get(order = first).payment_status, Payment.PaymentStatus.IS_SUCCESS)
+        self.assertFalse(PaymentCallback.objects.filter(status = PaymentCallback.CallbackStatus.PENDING).exists())
+
+    def test_reconciliation_reports_differences(self):
+        first, second, third = self.orders
+        self.gateway.callback(first.id, 1000)
+        payments.process_batch()
+        path = self.gateway.settlement([(first.id, 1000, 'SUCCESS'), (second.id, 2500, 'SUCCESS'),
+                                        (third.id, 3000, 'SUCCESS'), (0, 10, 'SUCCESS')])
+        self.addCleanup(os.unlink, path)
+        out = io.StringIO()
+        call_command('reconcile_payments', path, gateway = 'MOMO', chunk_size = 2, stdout = out,
+                     stderr = io.StringIO())
+        self.assertEqual(out.getvalue().splitlines()[1:], [
+            '%d,amount_mismatch,2500,2000' % second.id,
+            '%d,status_mismatch,SUCCESS,FAIL' % third.id,
+            '0,missing_payment,10,',
+        ])
+
+
+    def test_reconciliation_checks_archived_orders_and_missing_settlements(self):
+        first, second, third = self.orders
+        for order in (first, second):
+            self.gateway.callback(order.id, order.total_amount)
+        payments.process_batch()
+        Order.objects.filter(pk = first.pk).update(status = 'delivered')
+        OrderNotification.objects.update(state = OrderNotification.DeliveryState.SENT)
+        self.assertEqual(archive.run(cutoff = timezone.now() + timezone.timedelta(days = 1), pause = 0), 1)
+        path = self.gateway.settlement([(first.id, 1000, 'SUCCESS'), (third.id, 3000, 'FAIL')])
+        self.addCleanup(os.unlink, path)
+        out = io.StringIO()
+        call_command('reconcile_payments', path, gateway = 'MOMO', chunk_size = 1, stdout = out,
+                     stderr = io.StringIO())
+        # Đơn đã lưu trữ vẫn khớp; thanh toán thành công của second không có trong file
+        self.assertEqual(out.getvalue().splitlines()[1:], ['%d,missing_settlement,,2000' % second.id])
+
+        # Kỳ đối soát chỉ gồm ngày hôm qua: không có thanh toán nào để so chiều ngược lại
+        out = io.StringIO()
+        yesterday = (timezone.localdate() - timezone.timedelta(days = 1)).isoformat()
+        call_command('reconcile_payments', path, '--since', yesterday, '--until', yesterday, gateway = 'MOMO',
+                     stdout = out, stderr = io.StringIO())
+        self.assertEqual(out.getvalue().splitlines()[1:], [])
+
+
+class LocalSMTPServer(socketserver.ThreadingTCPServer):
+    # SMTP tối giản chạy local: đếm kết nối và email nhận được, từ chối `reject` lệnh MAIL đầu tiên
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.connections = 0
+        self.messages = []
+        self.reject = 0
+        threading.Thread(target = self.serve_forever, daemon = True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost')
+        while True:
+            line = self.rfile.readline().decode().strip()
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 bye')
+                return
+            if command == 'MAIL' and self.server.reject:
+                self.server.reject -= 1
+                self.reply('451 try again later')
+            elif command == 'DATA':
+                self.reply('354 end with .')
+                data = []
+                for raw in iter(self.rfile.readline, b''):
+                    if raw.rstrip(b'\r\n') == b'.':
+                        break
+                    data.append(raw)
+                self.server.messages.append(b''.join(data))
+                self.reply('250 queued')
+            else:
+                self.reply('250 ok')
+
+
+@override_settings(EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend',
+                   EMAIL_HOST = '127.0.0.1', EMAIL_USE_TLS = False, EMAIL_HOST_USER = '', EMAIL_HOST_PASSWORD = '')
+class OrderNotificationTests(TestCase):
+    def setUp(self):
+        self.server = LocalSMTPServer()
+        self.addCleanup(self.server.stop)
+        settings = override_settings(EMAIL_PORT = self.server.server_address[1])
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user(username = 'buyer', password = 'secret')
+
+    def create_order(self, i):
+        return Order.objects.create(user = self.user, name = 'Buyer', email = 'b%d@example.com' % i, phone = '09',
+                                    address = 'HCM', total_amount = 1000)
+
+    def send(self):
+        call_command('send_order_notifications', once = True, stdout = io.StringIO())
+
+    def test_status_changes_are_written_once_per_order_and_status(self):
+        order = self.create_order(0)
+        order.save()
+        order.status = 'paid'
+        order.save()
+        self.assertEqual(list(OrderNotification.objects.filter(order = order).values_list('status', flat = True)
+                              .order_by('id')), ['created', 'paid'])
+
+    def test_worker_sends_batch_over_one_connection(self):
+        for i in range(3):
+            self.create_order(i)
+        self.send()
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertEqual(OrderNotification.objects.filter(state = OrderNotification.DeliveryState.SENT).count(), 3)
+        self.send()
+        self.assertEqual(len(self.server.messages), 3)
+
+    def test_failures_are_retried_with_backoff(self):
+        first, second = self.create_order(0), self.create_order(1)
+        self.server.reject = 1
+        self.send()
+        failed = OrderNotification.objects.get(order = first)
+        self.assertEqual((failed.state, failed.attempts), (OrderNotification.DeliveryState.PENDING, 1))
+        self.assertGreater(failed.next_attempt_date, timezone.now())
+        self.assertEqual(OrderNotification.objects.get(order = second).state, OrderNotification.DeliveryState.SENT)
+        # Kết nối bị đóng sau lỗi và được mở lại cho email tiếp theo
+        self.assertEqual(self.server.connections, 2)
+
+        OrderNotification.objects.filter(pk = failed.pk).update(next_attempt_date = timezone.now())
+        self.send()
+        failed.refresh_from_db()
+        self.assertEqual((failed.state, failed.attempts), (OrderNotification.DeliveryState.SENT, 2))
+        self.assertEqual(len(self.server.messages), 2)
+
+
+@override_settings(THROTTLE_RATES = {
+    'like': {'user': '2/min', 'ip': '5/min'},
+    'register': {'ip': '2/hour', 'endpoint': '5/hour'},
+    'token': {'user': '2/min', 'ip': '100/min'},
+})
+class ThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        category = Category.objects.create(name = 'Áo')
+        self.product = Product.objects.create(name = 'P', quantity = 1, price = 1000, discount = 0,
+                                              category = category, thumbnail = 'shopping/x.jpg')
+        self.users = [User.objects.create_user(username = 'u%d' % i, password = 'secret') for i in range(2)]
+
+    def like(self, user, ip = '10.0.0.1'):
+        client = APIClient(REMOTE_ADDR = ip)
+        client.force_authenticate(user)
+        return client.post('/products/%d/like/' % self.product.id)
+
+    def test_user_limit_is_per_user_and_sets_retry_after(self):
+        first, second = self.users
+        self.assertEqual([self.like(first).status_code for _ in range(2)], [200, 200])
+        response = self.like(first, ip = '10.0.0.2')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(self.like(second).status_code, 200)
+        self.assertEqual(metrics.snapshot()['counters']['throttle.like.user.rejected'], 1)
+
+    def test_ip_limit_rejects_before_authentication(self):
+        for i in range(2):
+            self.assertNotEqual(APIClient(REMOTE_ADDR = '10.0.0.1').post('/users/', {}).status_code, 429)
+        with self.assertNumQueries(0):
+            response = APIClient(REMOTE_ADDR = '10.0.0.1').post('/users/', {})
+        self.assertEqual(response.status_code, 429)
+        self.assertNotEqual(APIClient(REMOTE_ADDR = '10.0.0.2').post('/users/', {}).status_code, 429)
+
+    def test_flooding_ip_does_not_use_up_shared_buckets(self):
+        # Request bị bucket cụ thể hơn chặn không trừ lượt của bucket chung
+        codes = [APIClient(REMOTE_ADDR = '10.0.0.1').post('/users/', {}).status_code for _ in range(20)]
+        self.assertEqual(codes.count(429), 18)
+        self.assertNotEqual(APIClient(REMOTE_ADDR = '10.0.0.2').post('/users/', {}).status_code, 429)
+        first, second = self.users
+        self.assertEqual([self.like(first).status_code for _ in range(10)].count(429), 8)
+        self.assertEqual(self.like(second).status_code, 200)
+
+    def test_warns_when_cache_is_not_shared(self):
+        with override_settings(DEBUG = False), self.assertLogs('shopping.checks', 'WARNING'):
+            checks.warn_local_caches()
+        self.assertEqual([error.id for error in checks.shared_cache_check(None)], ['shopping.W001'])
+        with override_settings(DEBUG = False, CACHES = {'default': {
+                'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache:6379'}}):
+            self.assertEqual(checks.local_cache_aliases(), [])
+
+    def test_cache_failure_falls_back_to_local_counter(self):
+        broken = mock.Mock()
+        broken.hit.side_effect = ConnectionError('cache down')
+        with mock.patch.object(throttling, 'shared_store', return_value = broken), \
+                mock.patch.object(throttling, '_local', throttling.LocalStore()):
+            self.assertEqual([self.like(self.users[0]).status_code for _ in range(3)], [200, 200, 429])
+        self.assertGreater(metrics.snapshot()['counters']['throttle.fallback'], 0)
+
+    def test_token_endpoint_is_limited_per_username(self):
+        codes = [APIClient(REMOTE_ADDR = '10.0.1.%d' % i).post('/o/token/', {
+            'grant_type': 'password', 'username': 'u0', 'password': 'wrong'}).status_code for i in range(3)]
+        self.assertNotIn(429, codes[:2])
+        self.assertEqual(codes[2], 429)
+
+
+class OrderExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        refdata.reset()
+        self.buyer = User.objects.create_user(username = 'buyer', password = 'secret')
+        self.owner = Business.objects.create_user(username = 'seller', password = 'secret', business_name = 'B',
+                                                  address = 'HCM', phone = '09', tax_code = '1')
+        self.staff = User.objects.create_user(username = 'staff', password = 'secret', is_staff = True)
+        category = Category.objects.create(name = 'Áo')
+        size, color = Size.objects.create(name = 'M'), Color.objects.create(name = 'Đỏ')
+        self.shops = [Shop.objects.create(name = 'S%d' % i, business = self.owner if i == 0 else None,
+                                          email = 's%d@example.com' % i) for i in range(2)]
+        products = [Product.objects.create(name = 'P%d' % i, quantity = 1, price = 1000, discount = 0,
+                                           category = category, shop = shop, thumbnail = 'shopping/x.jpg')
+                    for i, shop in enumerate(self.shops)]
+        for i in range(3):
+            order = Order.objects.create(user = self.buyer, name = 'Người mua, "A"', email = 'b@example.com',
+                                         phone = '09', address = 'HCM', total_amount = 2000,
+                                         status = 'paid' if i else 'created')
+            Payment.objects.create(order = order, user = self.buyer, total_amount = 2000)
+            for product in products:
+                OrderDetail.objects.create(order = order, product = product, price = 1000, discount = 0,
+                                           quantity = 1, sizes = size, colors = color)
+
+    def export(self, user, **params):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get('/order/export/', params)
+
+    def csv_rows(self, response):
+        content = b''.join(response.streaming_content).decode('utf-8-sig')
+        return list(csv.reader(io.StringIO(content)))
+
+    def test_staff_exports_csv_in_chunks_with_filters(self):
+        with override_settings(ORDER_EXPORT_CHUNK_SIZE = 2):
+            response = self.export(self.staff, status = 'paid')
+            refdata.snapshot()
+            # Mỗi chunk 2 dòng: một truy vấn dòng + một truy vấn thanh toán, thêm một truy vấn rỗng ở cuối mỗi bảng
+            # (đơn đang hoạt động, đơn lưu trữ)
+            with self.assertNumQueries(6):
+                rows = self.csv_rows(response)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[1][4], 'Người mua, "A"')
+        self.assertEqual(rows[1][13:15], ['M', 'Đỏ'])
+        self.assertEqual(rows[1][-2:], ['COD', 'FAIL'])
+
+    def test_business_only_exports_own_shops(self):
+        rows = self.csv_rows(self.export(self.owner))
+        self.assertEqual({row[10] for row in rows[1:]}, {'S0'})
+        self.assertEqual(self.export(self.owner, shop = self.shops[1].id).status_code, 403)
+        self.assertEqual(self.export(self.buyer).status_code, 403)
+        self.assertEqual(self.export(self.staff, **{'from': '2024-13-01'}).status_code, 400)
+
+    def test_shop_column_and_filter_use_the_shop_at_order_time(self):
+        # Sản phẩm của S0 chuyển sang S1 sau khi đặt: đơn cũ vẫn thuộc S0
+        Product.objects.filter(shop = self.shops[0]).update(shop = self.shops[1])
+        rows = self.csv_rows(self.export(self.staff, shop = self.shops[0].id))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual({(row[9], row[10]) for row in rows[1:]}, {(str(self.shops[0].id), 'S0')})
+        self.assertEqual({row[10] for row in self.csv_rows(self.export(self.owner))[1:]}, {'S0'})
+
+    @override_settings(ORDER_ARCHIVE_PAUSE_SECONDS = 0)
+    def test_archived_orders_are_exported_after_live_ones(self):
+        order = Order.objects.order_by('id').first()
+        old = timezone.now() - timezone.timedelta(days = 400)
+        Order.objects.filter(id = order.id).update(status = 'delivered', created_date = old, updated_date = old)
+        OrderNotification.objects.update(state = OrderNotification.DeliveryState.SENT)
+        self.assertEqual(archive.run(), 1)
+        rows = self.csv_rows(self.export(self.staff))
+        self.assertEqual(len(rows), 7)
+        self.assertEqual([(row[0], row[2], row[-2]) for row in rows[-2:]], [(str(order.id), 'delivered', 'COD')] * 2)
+        # Bộ lọc shop/trạng thái áp dụng cả cho đơn đã lưu trữ
+        rows = self.csv_rows(self.export(self.owner, status = 'delivered'))
+        self.assertEqual([(row[0], row[10]) for row in rows[1:]], [(str(order.id), 'S0')])
+
+    def test_xlsx_is_a_valid_workbook(self):
+        response = self.export(self.staff, fmt = 'xlsx', shop = self.shops[0].id)
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as archive:
+            self.assertIn('xl/workbook.xml', archive.namelist())
+            sheet = ElementTree.fromstring(archive.read('xl/worksheets/sheet1.xml'))
+        ns = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+        self.assertEqual(len(sheet.findall('%ssheetData/%srow' % (ns, ns))), 4)
+
+    def test_command_writes_file(self):
+        with tempfile.NamedTemporaryFile(suffix = '.csv', delete = False) as f:
+            self.addCleanup(os.unlink, f.name)
+        call_command('export_orders', output = f.name, shop = str(self.shops[1].id), stderr = io.StringIO())
+        with open(f.name, encoding = 'utf-8-sig') as f:
+            self.assertEqual(len(list(csv.reader(f))), 4)
+
+
+@override_settings(ORDER_ARCHIVE_PAUSE_SECONDS = 0)
+class OrderArchiveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        refdata.reset()
+        self.user = User.objects.create_user(username = 'buyer', password = 'secret')
+        category = Category.objects.create(name = 'Áo')
+        size, color = Size.objects.create(name = 'M'), Color.objects.create(name = 'Đỏ')
+        product = Product.objects.create(name = 'P', quantity = 1, price = 1000, discount = 0, category = category,
+                                         thumbnail = 'shopping/x.jpg')
+        old = timezone.now() - timezone.timedelta(days = 400)
+        self.orders = []
+        for i, order_status in enumerate(['delivered', 'cancelled', 'delivered', 'created']):
+            order = Order.objects.create(user = self.user, name = 'B', email = 'b@example.com', phone = '09',
+                                         address = 'HCM', total_amount = 1000 * (i + 1), status = order_status)
+            OrderDetail.objects.create(order = order, product = product, price = 1000, discount = 0, quantity = 1,
+                                       sizes = size, colors = color)
+            Payment.objects.create(order = order, user = self.user, total_amount = order.total_amount)
+            self.orders.append(order)
+        OrderNotification.objects.update(state = OrderNotification.DeliveryState.SENT)
+        for i, order in enumerate(self.orders):
+            created = old - timezone.timedelta(days = i)
+            # Đơn thứ ba cũng cũ nhưng vừa được cập nhật: chưa được lưu trữ
+            Order.objects.filter(id = order.id).update(created_date = created,
+                                                       updated_date = timezone.now() if i == 2 else created)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def stats(self):
+        return self.client.get('/stats/stats-count/').data, self.client.get('/stats/order-by-month/').data
+
+    def test_archives_closed_orders_in_restartable_batches(self):
+        before = self.stats()
+        first, second = self.orders[:2]
+        first_created = Order.objects.get(id = first.id).created_date
+        self.assertEqual(archive.run(batch_size = 1, max_batches = 1), 1)
+        self.assertEqual(archive.run(batch_size = 1), 1)
+        self.assertEqual(archive.run(), 0)
+        self.assertEqual(set(ArchivedOrder.objects.values_list('id', flat = True)), {first.id, second.id})
+        self.assertEqual(set(Order.objects.values_list('id', flat = True)), {o.id for o in self.orders[2:]})
+        self.assertEqual(ArchivedOrderDetail.objects.count(), 2)
+        self.assertEqual(ArchivedPayment.objects.count(), 2)
+        self.assertFalse(Payment.objects.filter(order_id__in = [first.id, second.id]).exists())
+        self.assertEqual(ArchivedOrder.objects.get(id = first.id).created_date, first_created)
+        self.assertEqual(self.stats(), before)
+
+    def test_history_reads_hot_and_archived_orders(self):
+        first = self.orders[0]
+        call_command('archive_orders', stdout = io.StringIO())
+        history = json.loads(b''.join(self.client.get('/order/get-user-order/').streaming_content))
+        self.assertEqual([o['id'] for o in history], [self.orders[i].id for i in (1, 0, 3, 2)])
+        lines = self.client.get('/order/%d/order-detail/' % first.id)
+        self.assertEqual([line['order'] for line in lines.data], [first.id])
+        self.assertEqual(self.client.get('/order/%d/get-order-payment/' % first.id).data['total_amount'], 1000)
+
+    def test_pending_notifications_keep_order_hot(self):
+        OrderNotification.objects.filter(order = self.orders[0]).update(state = OrderNotification.DeliveryState.PENDING)
+        call_command('archive_orders', stdout = io.StringIO())
+        self.assertEqual(list(ArchivedOrder.objects.values_list('id', flat = True)), [self.orders[1].id])
+
+
+class OrderLineSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        refdata.reset()
+        self.user = User.objects.create_user(username = 'buyer', password = 'secret')
+        self.shop = Shop.objects.create(name = 'Shop A', email = 'shop@example.com')
+        self.size, self.color = Size.objects.create(name = 'M'), Color.objects.create(name = 'Đỏ')
+        self.product = Product.objects.create(name = 'Áo thun', quantity = 5, price = 1000, discount = 10,
+                                              category = Category.objects.create(name = 'Áo'), shop = self.shop,
+                                              thumbnail = 'shopping/ao.jpg')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def place_order(self):
+        line = {'product': self.product.id, 'price': 1000, 'discount': 10, 'quantity': 2, 'sizes': self.size.id,
+                'colors': self.color.id}
+        response = self.client.post('/order/', {
+            'name': 'Buyer', 'email': 'b@example.com', 'phone': '09', 'address': 'HCM', 'total_amount': 1800,
+            'payment_method': 'COD', 'payment_status': 'FAIL', 'order_details': [line]}, format = 'json')
+        return response.data['id']
+
+    def test_order_detail_keeps_purchase_time_product(self):
+        order_id = self.place_order()
+        self.product.name, self.product.price = 'Áo thun mới', 2000
+        self.product.save()
+        Shop.objects.filter(pk = self.shop.pk).update(name = 'Shop B')
+        refdata.snapshot()
+        with self.assertNumQueries(2):
+            lines = self.client.get('/order/%d/order-detail/' % order_id).data
+        self.assertEqual(lines[0]['product'], {'id': self.product.id, 'name': 'Áo thun', 'thumbnail': 'shopping/ao.jpg',
+                                               'price': 1000, 'discount': 10, 'shop': {'name': 'Shop A'}})
+        self.assertEqual((lines[0]['sizes']['name'], lines[0]['colors']['name']), ('M', 'Đỏ'))
+
+        # Sản phẩm bị xoá: dòng đơn vẫn còn tên, lịch sử (?expand=order_details) cũng đọc từ snapshot
+        self.product.delete()
+        history = json.loads(b''.join(self.client.get('/order/get-user-order/',
+                                                      {'expand': 'order_details'}).streaming_content))
+        self.assertEqual(history[0]['order_details'][0]['product']['name'], 'Áo thun')
+        self.assertIsNone(history[0]['order_details'][0]['product']['id'])
+
+    def test_backfill_migration_fills_existing_lines(self):
+        order = Order.objects.create(user = self.user, name = 'B', email = 'b@example.com', phone = '09',
+                                     address = 'HCM', total_amount = 1000)
+        OrderDetail.objects.bulk_create([OrderDetail(order = order, product = self.product, price = 1000,
+                                                     discount = 0, quantity = 1, sizes = self.size,
+                                                     colors = self.color)])
+        self.assertEqual(OrderDetail.objects.get().product_name, '')
+        migration = importlib.import_module('shopping.migrations.0029_order_line_snapshots')
+        migration.backfill_snapshots(django_apps, None)
+        line = OrderDetail.objects.get()
+        self.assertEqual((line.product_name, line.shop_name, line.size_name, line.color_name),
+                         ('Áo thun', 'Shop A', 'M', 'Đỏ'))
+        OrderDetail.objects.update(shop_id = None)
+        migration = importlib.import_module('shopping.migrations.0032_order_line_shop_id')
+        migration.backfill_shop_ids(django_apps, None)
+        self.assertEqual(OrderDetail.objects.get().shop_id, self.shop.id)
+
+
+@override_settings(TYPEAHEAD_CHECK_INTERVAL = 0)
+class TypeaheadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        typeahead.reset()
+        metrics.reset()
+        self.user = User.objects.create_user(username = 'liker', password = 'secret')
+        self.category = Category.objects.create(name = 'Áo')
+        self.shop = Shop.objects.create(name = 'Thun Việt', email = 'shop@example.com')
+        self.products = [Product.objects.create(name = name, quantity = 1, price = 1000, discount = 0,
+                                                category = self.category, shop = self.shop,
+                                                thumbnail = 'shopping/x.jpg')
+                         for name in ('Áo thun trắng', 'Áo khoác', 'Quần short')]
+        Like.objects.create(user_id = self.user, product_id = self.products[1])
+
+    def suggest(self, q, **params):
+        response = self.client.get('/suggest/', dict(params, q = q))
+        return [(item['type'], item['label']) for item in response.json()['results']]
+
+    def test_prefix_matches_any_word_without_accents_ranked_by_popularity(self):
+        self.assertEqual(self.suggest('ao', type = 'product'), [('product', 'Áo khoác'), ('product', 'Áo thun trắng')])
+        # Cùng điểm: tên bắt đầu bằng từ đang gõ được xếp trước
+        self.assertEqual(self.suggest('THUN'), [('shop', 'Thun Việt'), ('product', 'Áo thun trắng')])
+        self.assertEqual(self.suggest('áo t'), [('product', 'Áo thun trắng')])
+        self.assertEqual(self.suggest('xyz'), [])
+        with self.assertNumQueries(0):
+            self.suggest('quan')
+
+    def test_writes_update_index_without_rebuild(self):
+        self.suggest('ao')
+        with self.captureOnCommitCallbacks(execute = True):
+            Product.objects.create(name = 'Áo len', quantity = 1, price = 1000, discount = 0,
+                                   category = self.category, thumbnail = 'shopping/x.jpg')
+        with self.captureOnCommitCallbacks(execute = True):
+            self.products[0].active = False
+            self.products[0].save()
+        self.assertEqual(self.suggest('ao', type = 'product'), [('product', 'Áo khoác'), ('product', 'Áo len')])
+        self.assertEqual(metrics.snapshot()['counters']['typeahead.rebuilds'], 1)
+
+    def test_writes_are_reloaded_together_by_the_next_suggest(self):
+        self.suggest('ao')
+        with self.captureOnCommitCallbacks() as callbacks:
+            for product in self.products:
+                product.name += ' mới'
+                product.save(update_fields = ['name'])
+        # Callback sau commit của request ghi chỉ đánh dấu chỉ mục, không truy vấn
+        with self.assertNumQueries(0):
+            for callback in callbacks:
+                callback()
+        # Ba mục nạp lại cùng lúc: sản phẩm, lượt thích, số lượng đã bán
+        with self.assertNumQueries(3):
+            self.assertEqual(len(self.suggest('moi')), 3)
+        self.assertEqual(metrics.snapshot()['counters']['typeahead.rebuilds'], 1)
+
+    def test_changes_from_other_processes_are_applied_incrementally(self):
+        self.suggest('ao')
+        local = typeahead._index
+        # Process khác ghi: chỉ có thay đổi trong cache dùng chung, chỉ mục của process này chưa biết
+        typeahead._index = None
+        with self.captureOnCommitCallbacks(execute = True):
+            self.shop.name = 'Áo đẹp'
+            self.shop.save()
+        typeahead._index = local
+        self.assertIn(('shop', 'Áo đẹp'), self.suggest('ao dep'))
+        self.assertEqual(self.suggest('thun', type = 'shop'), [])
+        self.assertEqual(metrics.snapshot()['counters']['typeahead.rebuilds'], 1)
+
+    @override_settings(TYPEAHEAD_SCAN_LIMIT = 2)
+    def test_long_prefix_range_is_ranked_as_a_whole(self):
+        for name in ('Áo a', 'Áo b'):
+            Product.objects.create(name = name, quantity = 1, price = 1000, discount = 0, category = self.category,
+                                   shop = self.shop, thumbnail = 'shopping/x.jpg')
+        # 'Áo khoác' (được thích) đứng sau hai từ khoá đầu của khoảng "ao" nhưng vẫn được xếp trước
+        self.assertEqual(self.suggest('ao', type = 'product', limit = 2)[0], ('product', 'Áo khoác'))
+        self.assertEqual(list(typeahead._index.top), ['ao'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('ao', type = 'category,product', limit = 2),
+                             [('category', 'Áo'), ('product', 'Áo khoác')])
+        with self.captureOnCommitCallbacks(execute = True):
+            self.products[1].active = False
+            self.products[1].save()
+        self.assertEqual(typeahead._index.dirty, {('product', self.products[1].id)})
+        self.assertNotIn(('product', 'Áo khoác'), self.suggest('ao', type = 'product'))
+        self.assertEqual((typeahead._index.dirty, list(typeahead._index.top)), (set(), ['ao']))
+
+    def test_inactive_shops_are_not_suggested(self):
+        Shop.objects.create(name = 'Thun ẩn', email = 'hidden@example.com', active = False)
+        self.assertEqual(self.suggest('thun', type = 'shop'), [('shop', 'Thun Việt')])
+        with self.captureOnCommitCallbacks(execute = True):
+            self.shop.active = False
+            self.shop.save()
+        self.assertEqual(self.suggest('thun', type = 'shop'), [])
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name = 'Áo')
+        self.shop = Shop.objects.create(name = 'Thời trang Việt', email = 'shop@example.com')
+        self.products = {name: Product.objects.create(name = name, quantity = 1, price = 1000, discount = 0,
+                                                      category = category, shop = shop,
+                                                      thumbnail = 'shopping/x.jpg')
+                         for name, shop in (('Áo thun trắng', None), ('Quần jean', None), ('Mũ len', self.shop))}
+
+    def search(self, kw):
+        response = APIClient().get('/products/', {'kw': kw})
+        return {item['name'] for item in response.data['results']}
+
+    def test_matches_without_accents_and_with_typos(self):
+        self.assertEqual(Product.objects.get(name = 'Áo thun trắng').search_key, 'ao thun trang')
+        self.assertEqual(self.search('ao thun'), {'Áo thun trắng'})
+        self.assertEqual(self.search('ÁO   THUN'), {'Áo thun trắng'})
+        self.assertEqual(self.search('ao thunn'), {'Áo thun trắng'})
+        self.assertEqual(self.search('viet'), {'Mũ len'})
+        self.assertEqual(self.search('xyz'), set())
+
+    def test_substring_inside_a_word_does_not_match(self):
+        # Khác icontains trước đây: "hun" chỉ có 2/4 token trong "thun", dưới SEARCH_MIN_TOKEN_RATIO
+        self.assertEqual(self.search('hun'), set())
+        self.assertEqual(self.search('thu'), {'Áo thun trắng'})
+        with override_settings(SEARCH_MIN_TOKEN_RATIO = 0.5):
+            self.assertEqual(self.search('hun'), {'Áo thun trắng'})
+
+    def test_product_and_shop_matches_are_one_union_subquery(self):
+        queryset = Product.objects.filter(search.product_filter('len'))
+        sql = str(queryset.query)
+        self.assertEqual((sql.count(' UNION '), sql.count(' OR ')), (1, 0))
+        self.assertEqual({p.name for p in Product.objects.filter(search.product_filter('viet'))}, {'Mũ len'})
+        self.assertEqual({p.name for p in queryset}, {'Mũ len'})
+
+    def test_renames_and_bulk_writes_are_reindexed(self):
+        product = self.products['Quần jean']
+        product.name = 'Quần kaki'
+        product.save(update_fields = ['name'])
+        self.assertEqual(self.search('kaki'), {'Quần kaki'})
+        self.assertEqual(self.search('jean'), set())
+
+        Product.objects.bulk_create([Product(name = 'Giày thể thao', quantity = 1, price = 1000, discount = 0,
+                                             category = product.category, thumbnail = 'shopping/x.jpg')])
+        self.assertEqual(self.search('giay'), set())
+        call_command('backfill_search_keys', stdout = io.StringIO())
+        self.assertEqual(self.search('giay the thao'), {'Giày thể thao'})
+
+    def test_migration_indexes_existing_rows(self):
+        Product.objects.update(search_key = '')
+        SearchToken.objects.all().delete()
+        self.assertEqual(self.search('ao thun'), set())
+        migration = importlib.import_module('shopping.migrations.0027_search_keys')
+        migration.backfill_search_keys(django_apps, None)
+        self.assertEqual(Product.objects.get(name = 'Áo thun trắng').search_key, 'ao thun trang')
+        self.assertEqual((self.search('ao thun'), self.search('viet')), ({'Áo thun trắng'}, {'Mũ len'}))
+
+
+class ProductBulkUpdateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category, other_category = Category.objects.create(name = 'Áo'), Category.objects.create(name = 'Quần')
+        self.seller = Business.objects.create(username = 'seller', business_name = 'Seller', address = 'HCM',
+                                              phone = '0900000001', tax_code = '1', status = 'confirmed')
+        self.seller.groups.add(Group.objects.get_or_create(name = 'Business')[0])
+        self.shop = Shop.objects.create(name = 'Seller shop', business = self.seller, email = 'shop@example.com')
+        self.products = [Product.objects.create(name = 'Sản phẩm %d' % i, quantity = 10, price = 1000, discount = 0,
+                                                category = self.category if i % 2 else other_category,
+                                                shop = self.shop, thumbnail = 'shopping/x.jpg') for i in range(6)]
+        self.foreign = Product.objects.create(name = 'Shop khác', quantity = 1, price = 1000, discount = 0,
+                                              category = self.category, thumbnail = 'shopping/x.jpg')
+
+    def post(self, data):
+        client = APIClient()
+        client.force_authenticate(self.seller)
+        with self.captureOnCommitCallbacks(execute = True):
+            return client.post('/products/bulk-update/', data, format = 'json')
+
+    @override_settings(PRODUCT_BULK_UPDATE_CHUNK_SIZE = 2)
+    def test_items_are_written_in_chunks_and_invalidate_caches(self):
+        first = self.products[0]
+        APIClient().get('/products/%d/' % first.id)
+        self.assertIsNotNone(cache.get('shopping:product:%d' % first.id))
+        items = [{'id': p.id, 'discount': 30} for p in self.products] + [{'id': first.id, 'price': 900}]
+        response = self.post({'items': items})
+        self.assertEqual(response.data, {'updated': 6})
+        self.assertEqual(sorted(Product.objects.filter(shop = self.shop).values_list('discount', flat = True)), [30] * 6)
+        first.refresh_from_db()
+        self.assertEqual((first.price, first.discount), (900, 30))
+        self.assertIsNone(cache.get('shopping:product:%d' % first.id))
+        self.assertEqual(APIClient().get('/products/%d/' % first.id).data['price'], 900)
+
+    def test_filter_and_set_updates_matching_products(self):
+        response = self.post({'filter': {'category': self.category.id}, 'set': {'discount': 15, 'active': False}})
+        self.assertEqual(response.data, {'updated': 3})
+        self.assertEqual(set(Product.objects.filter(active = False).values_list('id', flat = True)),
+                         {p.id for p in self.products[1::2]})
+        self.assertEqual(Product.objects.get(pk = self.foreign.pk).discount, 0)
+
+    def test_foreign_products_and_invalid_values_are_rejected(self):
+        response = self.post({'items': [{'id': self.products[0].id, 'price': 1}, {'id': self.foreign.id,
+                                                                                  'price': 1}]})
+        self.assertEqual((response.status_code, response.data['ids']), (403, [self.foreign.id]))
+        response = self.post({'items': [{'id': self.products[0].id, 'discount': 120, 'name': 'x'}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.data['errors']), 2)
+        self.assertFalse(Product.objects.filter(price = 1).exists())
+
+# Task dùng trong JobQueueTests: ghi lại các lần chạy, lỗi khi được yêu cầu
+job_calls = []
+
+
+@jobs.task(name = 'tests.record', max_attempts = 2)
+def record_job(value, fail = False):
+    job_calls.append(value)
+    if fail:
+        raise ValueError('lỗi %s' % value)
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        job_calls.clear()
+
+    def run_worker(self):
+        call_command('run_jobs', once = True, workers = 1, stats_interval = 0, stdout = io.StringIO())
+
+    def test_worker_runs_due_jobs_and_skips_scheduled_ones(self):
+        jobs.enqueue(record_job, args = [1])
+        jobs.enqueue('tests.record', kwargs = {'value': 2})
+        later = jobs.enqueue(record_job, args = [3], delay = 3600)
+        self.assertEqual(jobs.depth()['default'], {'pending': 3, 'due': 2, 'running': 0, 'dead': 0,
+                                                  'lag_seconds': jobs.depth()['default']['lag_seconds']})
+        self.run_worker()
+        self.assertEqual(sorted(job_calls), [1, 2])
+        # Việc xong bị xoá, việc hẹn giờ còn chờ
+        self.assertEqual(list(Job.objects.values_list('id', flat = True)), [later.id])
+        with self.assertRaises(ValueError):
+            jobs.enqueue('tests.unknown')
+
+    def test_failures_back_off_then_dead_letter(self):
+        job = jobs.enqueue(record_job, args = ['x'], kwargs = {'fail': True})
+        self.assertEqual(jobs.process_batch(), (1, {'retried': 1}))
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.attempts), (Job.JobState.PENDING, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('ValueError', job.last_error)
+        self.assertEqual(jobs.process_batch(), (0, {}))
+
+        Job.objects.filter(pk = job.pk).update(run_at = timezone.now())
+        self.assertEqual(jobs.process_batch(), (1, {'dead': 1}))
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.attempts), (Job.JobState.DEAD, 2))
+        self.assertEqual(jobs.depth()['default']['dead'], 1)
+
+        self.assertEqual(jobs.requeue_dead(queue = 'default'), 1)
+        Job.objects.filter(pk = job.pk).update(payload = {'args': ['x'], 'kwargs': {}})
+        self.assertEqual(jobs.process_batch(), (1, {'succeeded': 1}))
+        self.assertEqual(job_calls, ['x', 'x', 'x'])
+
+    def test_expired_lease_is_reclaimed_once(self):
+        job = jobs.enqueue(record_job, args = [1])
+        claimed = jobs.claim(['default'], 10)
+        self.assertEqual([j.state for j in claimed], [Job.JobState.RUNNING])
+        # Đang trong lease: worker khác không nhận được
+        self.assertEqual(jobs.claim(['default'], 10), [])
+        # Worker đầu chết: hết lease thì việc được nhận lại, kết quả của worker cũ không ghi đè
+        Job.objects.filter(pk = job.pk).update(run_at = timezone.now())
+        reclaimed = jobs.claim(['default'], 10)
+        self.assertEqual(reclaimed[0].attempts, 2)
+        self.assertEqual(jobs.run_job(claimed[0]), 'succeeded')
+        self.assertTrue(Job.objects.filter(pk = job.pk).exists())
+        self.assertEqual(jobs.run_job(reclaimed[0]), 'succeeded')
+        self.assertFalse(Job.objects.filter(pk = job.pk).exists())
+
+
+class BusinessProfileTests(TestCase):
+    def setUp(self):
+        self.seller = Business.objects.create(username = 'seller', business_name = 'Seller', address = 'HCM',
+                                              phone = '0900000001', tax_code = '1', status = 'confirmed')
+        self.pending = Business.objects.create(username = 'pending', business_name = 'Pending', address = 'HN',
+                                               phone = '0900000002', tax_code = '2')
+        self.shop = Shop.objects.create(name = 'Seller shop', business = self.seller, email = 'shop@example.com')
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def test_save_keeps_profile_in_sync(self):
+        profile = BusinessProfile.objects.get(pk = self.pending.pk)
+        self.assertEqual((profile.business_name, profile.status), ('Pending', 'unconfirmed'))
+        self.pending.status, self.pending.address = 'confirmed', 'Đà Nẵng'
+        self.pending.save()
+        profile.refresh_from_db()
+        self.assertEqual((profile.address, profile.status), ('Đà Nẵng', 'confirmed'))
+        # Doanh nghiệp có từ trước khi có bảng hồ sơ: save() tạo lại hồ sơ
+        BusinessProfile.objects.filter(pk = self.pending.pk).delete()
+        self.pending.save()
+        self.assertTrue(BusinessProfile.objects.filter(pk = self.pending.pk).exists())
+        self.assertFalse(BusinessProfile.objects.filter(pk = User.objects.create_user(username = 'buyer').pk).exists())
+
+    def test_queryset_update_keeps_profile_in_sync(self):
+        Business.objects.filter(pk__in = [self.seller.pk, self.pending.pk]).update(status = 'unconfirmed',
+                                                                                 address = 'Huế')
+        self.assertEqual(sorted(BusinessProfile.objects.values_list('pk', 'status', 'address')),
+                         [(self.seller.pk, 'unconfirmed', 'Huế'), (self.pending.pk, 'unconfirmed', 'Huế')])
+        # Khoá tài khoản qua User (queryset hoặc save()) cũng tới hồ sơ
+        User.objects.filter(pk = self.seller.pk).update(is_active = False)
+        self.assertFalse(BusinessProfile.objects.get(pk = self.seller.pk).is_active)
+        user = User.objects.get(pk = self.seller.pk)
+        user.is_active = True
+        user.save()
+        self.assertTrue(BusinessProfile.objects.get(pk = self.seller.pk).is_active)
+        with self.assertNumQueries(1):
+            User.objects.filter(pk = self.seller.pk).update(first_name = 'A')
+
+    def test_shop_business_must_be_active_without_user_join(self):
+        self.pending.status = 'confirmed'
+        self.pending.save()
+        Business.objects.filter(pk = self.pending.pk).update(is_active = False)
+        client = self.client_for(self.pending)
+        data = {'name': 'Shop mới', 'business': self.pending.pk, 'email': 'new@example.com'}
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(client.post('/shop/', data, format = 'json').status_code, 400)
+        self.assertFalse([q['sql'] for q in queries.captured_queries if 'shopping_user' in q['sql']])
+        User.objects.filter(pk = self.pending.pk).update(is_active = True)
+        self.assertEqual(client.post('/shop/', data, format = 'json').status_code, 201)
+
+    def test_business_permission_follows_profile_not_group(self):
+        request = RequestFactory().get('/')
+        # Doanh nghiệp tạo trong admin, chưa vào nhóm 'Business'
+        self.assertFalse(self.pending.groups.exists())
+        request.user = self.pending
+        self.assertTrue(IsBusiness().has_permission(request, None))
+        member = User.objects.create_user(username = 'member')
+        member.groups.add(Group.objects.create(name = 'Business'))
+        request.user = member
+        self.assertFalse(IsBusiness().has_permission(request, None))
+
+    def test_migration_copies_existing_businesses(self):
+        BusinessProfile.objects.all().delete()
+        migration = importlib.import_module('shopping.migrations.0030_business_profile')
+        migration.copy_profiles(django_apps, None)
+        self.assertEqual(sorted(BusinessProfile.objects.values_list('pk', 'status')),
+                         [(self.seller.pk, 'confirmed'), (self.pending.pk, 'unconfirmed')])
+        BusinessProfile.objects.filter(pk = self.seller.pk).delete()
+        User.objects.filter(pk = self.seller.pk).update(is_active = False)
+        BusinessProfile.objects.create(user_id = self.seller.pk, business_name = 'Seller', address = 'HCM',
+                                       phone = '0900000001', tax_code = '1', status = 'confirmed')
+        migration = importlib.import_module('shopping.migrations.0031_business_profile_is_active')
+        migration.copy_inactive_users(django_apps, None)
+        self.assertEqual(sorted(BusinessProfile.objects.values_list('pk', 'is_active')),
+                         [(self.seller.pk, False), (self.pending.pk, True)])
+
+    def test_shop_owner_check_is_single_query(self):
+        request = RequestFactory().put('/shop/%d/' % self.shop.pk)
+        view = mock.Mock(kwargs = {'pk': self.shop.pk})
+        for user, allowed in [(self.seller, True), (self.pending, False)]:
+            request.user = user
+            with self.assertNumQueries(1):
+                self.assertEqual(IsBusinessOwner().has_permission(request, view), allowed)
+            with self.assertNumQueries(1):
+                self.assertTrue(IsBusiness().has_permission(request, view))
+        request.user = User.objects.create_user(username = 'buyer')
+        self.assertFalse(IsBusiness().has_permission(request, view))
+
+    def test_shop_requires_confirmed_business(self):
+        client = self.client_for(self.pending)
+        response = client.post('/shop/', {'name': 'Shop mới', 'business': self.pending.pk,
+                                          'email': 'new@example.com'}, format = 'json')
+        self.assertEqual(response.status_code, 400)
+        self.pending.status = 'confirmed'
+        self.pending.save()
+        response = client.post('/shop/', {'name': 'Shop mới', 'business': self.pending.pk,
+                                          'email': 'new@example.com'}, format = 'json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Shop.objects.get(name = 'Shop mới').business_id, self.pending.pk)
+        self.assertEqual(self.client.get('/business/%d/get-shop/' % self.pending.pk).data['name'], 'Shop mới')
+        self.assertEqual(self.client.get('/business/%d/get-shop/' % (self.pending.pk + 100)).status_code, 404)
+
+
+class PaymentOrderMigrationTests(TransactionTestCase):
+    # 0020: Payment.order từ ManyToMany thành ForeignKey, Order.user được điền từ payment hoặc email
+    before = [('shopping', '0019_alter_shop_address_alter_shop_email_alter_shop_phone')]
+    after = [('shopping', '0020_sync_models_with_schema')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return MigrationExecutor(connection).loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_links_and_users_are_kept(self):
+        old = self.migrate(self.before)
+        User, Order, Payment = (old.get_model('shopping', name) for name in ('User', 'Order', 'Payment'))
+        buyer = User.objects.create(username = 'buyer', email = 'buyer@example.com')
+        other = User.objects.create(username = 'other', email = 'other@example.com')
+        paid, unpaid = [Order.objects.create(name = 'B', email = email, phone = '09', address = 'HCM',
+                                             total_amount = 1000) for email in ('x@example.com', 'other@example.com')]
+        payment = Payment.objects.create(user = buyer, total_amount = 1000)
+        payment.order.add(paid)
+
+        new = self.migrate(self.after)
+        Order, Payment = new.get_model('shopping', 'Order'), new.get_model('shopping', 'Payment')
+        self.assertEqual(Payment.objects.get(pk = payment.pk).order_id, paid.pk)
+        self.assertEqual(dict(Order.objects.values_list('pk', 'user_id')), {paid.pk: buyer.pk, unpaid.pk: other.pk})
+
+    def test_stops_when_an_order_has_no_user(self):
+        old = self.migrate(self.before)
+        order = old.get_model('shopping', 'Order').objects.create(name = 'B', email = 'nobody@example.com',
+                                                                  phone = '09', address = 'HCM', total_amount = 1000)
+        with self.assertRaisesMessage(RuntimeError, '1 đơn hàng'):
+            self.migrate(self.after)
+        order.delete()
+
+
+class FakeConnection:
+    def __init__(self, number):
+        self.number = number
+        self.closed = self.broken = self.rollback_fails = False
+        self.rollbacks = 0
+
+    def close(self):
+        self.closed = True
+
+    def rollback(self):
+        if self.rollback_fails:
+            raise ConnectionError('mất kết nối')
+        self.rollbacks += 1
+
+
+def ping_fake(connection):
+    if connection.broken:
+        raise ConnectionError('mất kết nối')
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def make_pool(self, **options):
+        self.opened = []
+
+        def connect():
+            self.opened.append(FakeConnection(len(self.opened) + 1))
+            return self.opened[-1]
+
+        return ConnectionPool(connect, ping = ping_fake, **options)
+
+    def test_overflow_connections_are_closed_and_exhaustion_times_out(self):
+        pool = self.make_pool(size = 1, max_overflow = 1, timeout = 0.05)
+        first, second = pool.checkout(), pool.checkout()
+        with self.assertRaises(PoolTimeout):
+            pool.checkout()
+        self.assertEqual(pool.stats()['timeouts'], 1)
+        pool.release(first)
+        pool.release(second)
+        # Chỉ giữ lại size kết nối rảnh, kết nối overflow bị đóng
+        self.assertEqual((first.closed, second.closed), (False, True))
+        self.assertIs(pool.checkout(), first)
+
+    def test_waiting_checkout_gets_released_connection(self):
+        pool = self.make_pool(size = 1, max_overflow = 0, timeout = 5)
+        held = pool.checkout()
+        threading.Timer(0.05, pool.release, [held]).start()
+        self.assertIs(pool.checkout(), held)
+        self.assertEqual(pool.stats()['timeouts'], 0)
+
+    def test_old_connection_is_recycled(self):
+        clock = [0.0]
+        with mock.patch('shopping.backends.pool.time.monotonic', lambda: clock[0]):
+            pool = self.make_pool(size = 1, max_overflow = 0, recycle = 60)
+            first = pool.checkout()
+            clock[0] = 30
+            pool.release(first)
+            self.assertIs(pool.checkout(), first)
+            pool.release(first)
+            clock[0] = 90
+            second = pool.checkout()
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+        self.assertEqual((pool.stats()['connects'], pool.stats()['discarded']), (2, 1))
+
+    def test_broken_connection_is_discarded_on_pre_ping(self):
+        pool = self.make_pool(size = 2, max_overflow = 0)
+        first = pool.checkout()
+        pool.release(first)
+        first.broken = True
+        second = pool.checkout()
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+        self.assertEqual(pool.stats()['opened'], 1)
+
+    def test_failed_connect_frees_the_slot(self):
+        pool = ConnectionPool(mock.Mock(side_effect = ConnectionError('từ chối')), size = 1, max_overflow = 0,
+                              timeout = 0.01)
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                pool.checkout()
+        self.assertEqual(pool.stats()['opened'], 0)
+
+    def backend(self, pool):
+        wrapper = PooledMySQLWrapper({'ENGINE': 'shopping.backends.mysql_pool', 'NAME': 'test', 'POOL': {},
+                                      'OPTIONS': {}, 'TIME_ZONE': None, 'AUTOCOMMIT': True, 'CONN_MAX_AGE': 0,
+                                      'CONN_HEALTH_CHECKS': False, 'ATOMIC_REQUESTS': False})
+        wrapper.connection, wrapper._pool = pool.checkout(), pool
+        return wrapper
+
+    def test_connection_goes_back_to_pool_when_request_raises(self):
+        pool = self.make_pool(size = 1, max_overflow = 0)
+        wrapper = self.backend(pool)
+        connection = wrapper.connection
+        try:
+            raise ValueError('lỗi trong view')
+        except ValueError:
+            wrapper.autocommit = False
+            wrapper._close()
+        # Transaction dở được rollback rồi kết nối quay về pool để dùng lại
+        self.assertEqual((connection.rollbacks, connection.closed), (1, False))
+        self.assertEqual(pool.stats()['idle'], 1)
+
+        wrapper = self.backend(pool)
+        wrapper.autocommit = False
+        wrapper.connection.rollback_fails = True
+        wrapper._close()
+        self.assertTrue(connection.closed)
+        self.assertEqual((pool.stats()['idle'], pool.stats()['opened']), (0, 0))
+
+        wrapper = self.backend(pool)
+        wrapper.in_atomic_block = True
+        wrapper._close()
+        self.assertTrue(wrapper.connection.closed)
+        self.assertEqual(pool.stats()['in_use'], 0)
+
+    def test_bytes_encoder_is_only_removed_when_it_is_the_placeholder(self):
+        def encode_bytes(value, mapping):
+            return value
+
+        for encoders, expected in [({bytes: bytes, str: str}, {str: str}),
+                                   ({bytes: encode_bytes}, {bytes: encode_bytes})]:
+            with mock.patch.object(mysql_pool_base.mysql_base.Database, 'connect',
+                                   return_value = mock.Mock(encoders = dict(encoders))):
+                self.assertEqual(mysql_pool_base._connect({})().encoders, expected)
+
+
+class LimitedAsyncClient(AsyncClient):
+    # Django 4.1: ASGIRequest đọc thẳng FakePayload của client, parser multipart đọc quá cuối body thì lỗi; bọc
+    # bằng LimitedStream như body của server ASGI thật
+    def request(self, **request):
+        if '_body_file' in request:
+            request['_body_file'] = LimitedStream(request['_body_file'], len(request['_body_file']))
+        return super().request(**request)
+
+
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Avatar được lưu vào thư mục tạm thay vì MEDIA_ROOT thật
+        media = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(media.cleanup)
+        cls.enterClassContext(override_settings(MEDIA_ROOT = media.name))
+
+    def setUp(self):
+        cache.clear()
+        refdata.reset()
+        self.category = Category.objects.create(name = 'Áo')
+        self.size, self.color = Size.objects.create(name = 'M'), Color.objects.create(name = 'Đỏ')
+        for name in ('User', 'Business'):
+            Group.objects.get_or_create(name = name)
+        self.seller = Business.objects.create(username = 'seller', business_name = 'Seller', address = 'HCM',
+                                              phone = '0900000001', tax_code = '1', status = 'confirmed')
+        self.shop = Shop.objects.create(name = 'Seller shop', business = self.seller, email = 'shop@example.com')
+        self.buyer = User.objects.create_user(username = 'buyer', password = 'secret')
+        self.product = Product.objects.create(name = 'P', quantity = 10, price = 1000, discount = 0,
+                                              category = self.category, shop = self.shop,
+                                              thumbnail = 'shopping/x.jpg')
+        expires = timezone.now() + timezone.timedelta(hours = 1)
+        for user in (self.seller, self.buyer):
+            AccessToken.objects.create(user = user, token = 'token-%s' % user.username, expires = expires,
+                                       scope = 'read write')
+        self.db_work_started = threading.Event()
+        self.uploads = []
+        patcher = mock.patch('cloudinary.uploader.upload', side_effect = self.upload)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upload(self, file):
+        # Upload chỉ xong khi phần việc DB chạy song song đã bắt đầu: chạy tuần tự thì chờ hết thời gian
+        self.uploads.append(file)
+        self.overlapped = self.db_work_started.wait(2)
+        return {'url': 'https://res.cloudinary.com/demo/%d.png' % len(self.uploads)}
+
+    def db_work(self, func):
+        def wrapped(*args, **kwargs):
+            self.db_work_started.set()
+            return func(*args, **kwargs)
+
+        return wrapped
+
+    def auth(self, user):
+        # AsyncClient của Django 4.1 nhận header theo tên (không có tiền tố HTTP_)
+        return {'AUTHORIZATION': 'Bearer token-%s' % user.username} if user else {}
+
+    def product_form(self, category = None):
+        return {'name': 'Áo mới', 'quantity': 5, 'price': 2000, 'discount': 0, 'thumbnail': image_file(),
+                'category': category or self.category.id, 'colors': ['Đỏ'], 'sizes': ['M']}
+
+    async def test_create_product_uploads_once_after_checking_data(self):
+        # Upload chỉ bắt đầu khi đã kiểm tra xong danh mục/shop
+        uploads_when_checked, original = [], refdata.instance
+
+        def instance(*args):
+            uploads_when_checked.append(len(self.uploads))
+            return original(*args)
+
+        self.db_work_started.set()
+        with mock.patch.object(refdata, 'instance', instance):
+            response = await LimitedAsyncClient().post('/async/products/', self.product_form(),
+                                                       **self.auth(self.seller))
+        self.assertEqual(response.status_code, 201)
+        data = json.loads(response.content)
+        self.assertEqual((data['name'], data['thumbnail']), ('Áo mới', 'https://res.cloudinary.com/demo/1.png'))
+        self.assertEqual((uploads_when_checked, len(self.uploads)), ([0], 1))
+
+    async def test_create_product_rejects_bad_category_and_permissions(self):
+        response = await LimitedAsyncClient().post('/async/products/', self.product_form(category = 999),
+                                                   **self.auth(self.seller))
+        self.assertEqual((response.status_code, json.loads(response.content)),
+                         (400, {'message': 'Danh mục hoặc shop không tồn tại'}))
+        # Chưa đăng nhập: 401; đăng nhập nhưng không phải doanh nghiệp: 403
+        codes = [(await LimitedAsyncClient().post('/async/products/', self.product_form(),
+                                                  **self.auth(user))).status_code
+                 for user in (None, self.buyer)]
+        self.assertEqual(codes, [401, 403])
+        # Request bị từ chối không để lại ảnh nào trên Cloudinary
+        self.assertEqual(self.uploads, [])
+
+    async def test_method_not_allowed_and_parse_errors_are_json(self):
+        response = await LimitedAsyncClient().get('/async/order/')
+        self.assertEqual((response.status_code, response['Content-Type']), (405, 'application/json'))
+        response = await LimitedAsyncClient().post('/async/order/', '{nope', content_type = 'application/json',
+                                                   **self.auth(self.buyer))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('JSON parse error', json.loads(response.content)['detail'])
+
+    async def test_register_uploads_avatar_once_while_saving(self):
+        for path, serializer, extra in [('/async/users/', UserSerializer, {}),
+                                        ('/async/business/', BusinessSerializer,
+                                         {'business_name': 'DN', 'address': 'HN', 'phone': '0911111111',
+                                          'tax_code': '0101'})]:
+            self.uploads, self.db_work_started = [], threading.Event()
+            with self.subTest(path = path), mock.patch.object(serializer, 'create',
+                                                              self.db_work(serializer.create)):
+                response = await LimitedAsyncClient().post(path, dict(extra, password = 'secret-123',
+                                                                      username = 'new-%s' % serializer.__name__,
+                                                                      avatar = image_file()))
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(json.loads(response.content)['image'],
+                                 'https://res.cloudinary.com/demo/1.png')
+                self.assertEqual(len(self.uploads), 1)
+                self.assertTrue(self.overlapped)
+        self.assertTrue(await BusinessProfile.objects.filter(user__username = 'new-BusinessSerializer').aexists())
+
+    def order_payload(self):
+        line = {'product': self.product.id, 'price': 1000, 'discount': 0, 'quantity': 1, 'sizes': self.size.id,
+                'colors': self.color.id}
+        return {'name': 'Buyer', 'email': 'b@example.com', 'phone': '09', 'address': 'HCM', 'total_amount': 1000,
+                'payment_method': 'COD', 'payment_status': 'FAIL', 'order_details': [line]}
+
+    @override_settings(THROTTLE_RATES = {'order': {'user': '1/min'}, 'register': {'ip': '1/hour'}})
+    async def test_async_routes_share_the_throttle_buckets(self):
+        client = LimitedAsyncClient()
+        response = await client.post('/async/order/', self.order_payload(), content_type = 'application/json',
+                                     **self.auth(self.buyer))
+        self.assertEqual(response.status_code, 201)
+        response = await client.post('/async/order/', self.order_payload(), content_type = 'application/json',
+                                     **self.auth(self.buyer))
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        # Bucket dùng chung với endpoint DRF: đặt qua /order/ cũng bị chặn
+        drf = APIClient()
+        drf.force_authenticate(self.buyer)
+        response = await sync_to_async(drf.post)('/order/', self.order_payload(), format = 'json')
+        self.assertEqual(response.status_code, 429)
+
+        # Lượt đăng ký bị trừ trước khi kiểm tra dữ liệu, như endpoint DRF
+        response = await client.post('/async/users/', {'username': 'first'})
+        self.assertEqual(response.status_code, 400)
+        response = await client.post('/async/business/', {'username': 'second'})
+        self.assertEqual(response.status_code, 429)
+
+    @override_settings(INSTRUMENTATION_SAMPLE_RATE = 1.0)
+    async def test_queries_of_async_views_are_recorded(self):
+        # ORM của view async chạy trong thread của sync_to_async, không phải thread của event loop
+        metrics.reset()
+        response = await LimitedAsyncClient().post('/async/order/', self.order_payload(),
+                                                   content_type = 'application/json', **self.auth(self.buyer))
+        self.assertEqual(response.status_code, 201)
+        endpoint = metrics.snapshot()['endpoints']['shopping.async_views.place_order']
+        self.assertEqual(endpoint['sampled'], 1)
+        self.assertGreater(endpoint['query_count']['sum'], 0)
+
+    async def test_place_order(self):
+        line = {'product': self.product.id, 'price': 1000, 'discount': 0, 'quantity': 2, 'sizes': self.size.id,
+                'colors': self.color.id}
+        payload = {'name': 'Buyer', 'email': 'b@example.com', 'phone': '09', 'address': 'HCM', 'total_amount': 2000,
+                   'payment_method': 'COD', 'payment_status': 'FAIL', 'order_details': [line]}
+        response = await LimitedAsyncClient().post('/async/order/', payload, content_type = 'application/json')
+        self.assertEqual(response.status_code, 401)
+        response = await LimitedAsyncClient().post('/async/order/', payload, content_type = 'application/json',
+                                                   **self.auth(self.buyer))
+        self.assertEqual(response.status_code, 201, response.content)
+        order = await Order.objects.aget(pk = json.loads(response.content)['id'])
+        self.assertEqual(order.user_id, self.buyer.id)
+        self.assertEqual(self.uploads, [])
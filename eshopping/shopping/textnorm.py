@@ -0,0 +1,16 @@
+import re
+import unicodedata
+
+# Chuẩn hoá chuỗi để tìm kiếm không phân biệt dấu/hoa thường: "Áo  Thun Đỏ" -> "ao thun do"
+_SPACES = re.compile(r'\s+')
+
+
+def fold(text):
+    text = unicodedata.normalize('NFD', str(text or '')).replace('đ', 'd').replace('Đ', 'D')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return _SPACES.sub(' ', text.lower()).strip()
+
+
+def search_key(text):
+    # Giá trị cột search_key của Product/Shop
+    return fold(text)[:255]
@@ -0,0 +1,256 @@
+import logging
+import math
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from rest_framework.throttling import BaseThrottle
+
+from . import metrics
+
+# Giới hạn tần suất kiểu token bucket (GCRA): mỗi khoá chỉ lưu một mốc thời gian TAT, request được nhận nếu
+# TAT - now không vượt quá một chu kỳ. Trạng thái nằm trong cache dùng chung (THROTTLE_CACHE) để mọi worker
+# cùng đếm; với Redis việc đọc-tính-ghi chạy trong một script Lua (một round trip, nguyên tử), với cache khác
+# là get rồi set (có thể lọt thêm vài request khi nhiều worker cùng ghi một khoá). Cache lỗi thì dùng bộ đếm
+# trong process để request vẫn được giới hạn.
+#
+# THROTTLE_RATES = {scope: {'user' | 'ip' | 'endpoint': 'số request/chu kỳ'}}: 'user' theo user đã đăng nhập
+# (chưa đăng nhập thì theo IP), 'ip' theo IP, 'endpoint' chung cho cả scope. Các bucket của một request được xét
+# cùng lúc, từ cụ thể nhất tới chung nhất, và chỉ bị trừ lượt khi tất cả đều nhận: một IP bị chặn không tiêu hết
+# lượt của bucket 'endpoint' dùng chung. 'ip' và 'endpoint' được xem trước (không trừ lượt) trước khi xác thực nên
+# request bị chặn không tốn truy vấn token OAuth.
+PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+KEY_PREFIX = 'shopping:throttle:%s:%s:%s'
+KINDS = ('user', 'ip', 'endpoint')
+PRE_AUTH_KINDS = ('ip', 'endpoint')
+
+logger = logging.getLogger('shopping.throttling')
+
+# ARGV: now, charge (1/0), rồi interval, period cho từng khoá; trả về số giây phải chờ của từng khoá
+_GCRA_SCRIPT = """
+local now = tonumber(ARGV[1])
+local charge = ARGV[2] == '1'
+local waits, tats, rejected = {}, {}, false
+for i, key in ipairs(KEYS) do
+    local interval = tonumber(ARGV[2 * i + 1])
+    local period = tonumber(ARGV[2 * i + 2])
+    local tat = tonumber(redis.call('GET', key) or '0')
+    if tat < now then tat = now end
+    tats[i] = tat + interval
+    if tats[i] - period > now then
+        waits[i] = tostring(tats[i] - period - now)
+        rejected = true
+    else
+        waits[i] = '0'
+    end
+end
+if charge and not rejected then
+    for i, key in ipairs(KEYS) do
+        redis.call('SET', key, tostring(tats[i]), 'PX', math.ceil((tats[i] - now) * 1000))
+    end
+end
+return waits
+"""
+
+
+def parse_rate(rate):
+    # '30/min' -> (30, 60)
+    count, period = rate.split('/')
+    return int(count), PERIODS[period.strip()]
+
+
+def gcra(tat, now, interval, period):
+    # Trả về (TAT mới hoặc None nếu từ chối, số giây phải chờ)
+    tat = max(tat or now, now)
+    new_tat = tat + interval
+    if new_tat - period > now:
+        return None, new_tat - period - now
+    return new_tat, 0.0
+
+
+def gcra_many(tats, now, buckets):
+    # buckets: [(khoá, interval, period)]; trả về (TAT mới của từng khoá hoặc None nếu có bucket từ chối, các
+    # số giây phải chờ)
+    results = [gcra(tats.get(key), now, interval, period) for key, interval, period in buckets]
+    waits = [wait for _, wait in results]
+    if any(waits):
+        return None, waits
+    return {key: new_tat for (key, _, _), (new_tat, _) in zip(buckets, results)}, waits
+
+
+# Mọi store: hit(buckets, charge) trả về số giây phải chờ của từng bucket; chỉ ghi TAT mới (trừ lượt) khi charge
+# và không bucket nào từ chối
+class LocalStore:
+    # Trong process: dùng khi cache dùng chung lỗi; các khoá đã hết hạn được dọn khi dict quá lớn
+    max_keys = 100000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tats = {}
+
+    def hit(self, buckets, charge = True):
+        now = time.time()
+        with self.lock:
+            new_tats, waits = gcra_many(self.tats, now, buckets)
+            if charge and new_tats:
+                if len(self.tats) >= self.max_keys:
+                    self.tats = {k: v for k, v in self.tats.items() if v > now}
+                self.tats.update(new_tats)
+        return waits
+
+
+class CacheStore:
+    def __init__(self, cache):
+        self.cache = cache
+
+    def hit(self, buckets, charge = True):
+        now = time.time()
+        new_tats, waits = gcra_many(self.cache.get_many([key for key, _, _ in buckets]), now, buckets)
+        if charge and new_tats:
+            for key, new_tat in new_tats.items():
+                self.cache.set(key, new_tat, math.ceil(new_tat - now))
+        return waits
+
+
+class RedisStore:
+    def __init__(self, cache):
+        self.cache = cache
+        self.script = None
+
+    def hit(self, buckets, charge = True):
+        # Cache Redis của Django ghi vào server đầu tiên, mọi khoá nằm cùng một server
+        client = self.cache._cache.get_client(buckets[0][0], write = True)
+        if self.script is None:
+            self.script = client.register_script(_GCRA_SCRIPT)
+        args = [time.time(), 1 if charge else 0]
+        for _, interval, period in buckets:
+            args += [interval, period]
+        waits = self.script(keys = [self.cache.make_key(key) for key, _, _ in buckets], args = args, client = client)
+        return [float(wait) for wait in waits]
+
+
+_local = LocalStore()
+_stores = {}
+
+
+def make_store(cache):
+    is_redis = type(cache).__module__ == 'django.core.cache.backends.redis'
+    return RedisStore(cache) if is_redis else CacheStore(cache)
+
+
+def shared_store(alias = None):
+    alias = alias or getattr(settings, 'THROTTLE_CACHE', 'default')
+    store = _stores.get(alias)
+    if store is None:
+        store = _stores[alias] = make_store(caches[alias])
+    return store
+
+
+def hit(rated_keys, charge = True):
+    # rated_keys: [(khoá, rate)]; trả về số giây phải chờ của từng khoá
+    buckets = []
+    for key, rate in rated_keys:
+        count, period = parse_rate(rate)
+        buckets.append((key, period / count, period))
+    try:
+        return shared_store().hit(buckets, charge)
+    except Exception as e:
+        metrics.increment('throttle.fallback')
+        logger.warning('Cache giới hạn tần suất lỗi, dùng bộ đếm trong process: %s', e)
+        return _local.hit(buckets, charge)
+
+
+def scope_rates(scope):
+    if not getattr(settings, 'THROTTLE_ENABLED', True):
+        return {}
+    return getattr(settings, 'THROTTLE_RATES', {}).get(scope, {})
+
+
+def check(scope, idents, charge = True):
+    # idents: {loại: định danh}; trả về số giây phải chờ lâu nhất, 0 nếu được nhận. charge = False chỉ xem, không
+    # trừ lượt
+    rates = scope_rates(scope)
+    kinds = [kind for kind in KINDS if kind in rates and idents.get(kind) is not None]
+    if not kinds:
+        return 0.0
+    waits = hit([(KEY_PREFIX % (scope, kind, idents[kind]), rates[kind]) for kind in kinds], charge)
+    for kind, kind_wait in zip(kinds, waits):
+        if kind_wait:
+            metrics.increment('throttle.%s.%s.rejected' % (scope, kind))
+    return max(waits)
+
+
+class BucketThrottle(BaseThrottle):
+    def __init__(self, scope, kinds, charge = True):
+        self.scope = scope
+        self.kinds = kinds
+        self.charge = charge
+        self.wait_seconds = None
+
+    def identify(self, request, kind):
+        if kind == 'endpoint':
+            return 'all'
+        if kind == 'user':
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                return 'u%s' % user.pk
+        return self.get_ident(request)
+
+    def allow_request(self, request, view):
+        self.wait_seconds = check(self.scope, {kind: self.identify(request, kind) for kind in self.kinds},
+                                  self.charge)
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class ThrottledActionsMixin:
+    # throttled_actions = {action: scope}: chỉ các action này bị giới hạn
+    throttled_actions = {}
+
+    def throttle_scope_for_action(self):
+        return self.throttled_actions.get(getattr(self, 'action', None))
+
+    def initial(self, request, *args, **kwargs):
+        scope = self.throttle_scope_for_action()
+        if scope is not None:
+            # Xem trước theo IP/endpoint khi chưa xác thực (request.user chưa được đọc), chưa trừ lượt
+            throttle = BucketThrottle(scope, PRE_AUTH_KINDS, charge = False)
+            if not throttle.allow_request(request, self):
+                self.throttled(request, throttle.wait())
+        super().initial(request, *args, **kwargs)
+
+    def get_throttles(self):
+        scope = self.throttle_scope_for_action()
+        throttles = super().get_throttles()
+        if scope is not None:
+            # Sau xác thực: trừ lượt cùng lúc ở mọi bucket
+            throttles.append(BucketThrottle(scope, KINDS))
+        return throttles
+
+
+def throttle_view(scope, user_field = None):
+    # Cho view Django thường (ví dụ /o/token/): user_field là trường POST dùng làm định danh 'user'
+    # (tên đăng nhập), để đoán mật khẩu của một tài khoản từ nhiều IP vẫn bị giới hạn
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            ident = BaseThrottle().get_ident(request)
+            idents = {'endpoint': 'all', 'ip': ident}
+            if user_field is not None and request.method == 'POST':
+                idents['user'] = request.POST.get(user_field) or None
+            wait = check(scope, idents)
+            if wait:
+                response = JsonResponse({'message': 'Quá nhiều request, thử lại sau %d giây' % math.ceil(wait)},
+                                        status = 429)
+                response['Retry-After'] = str(math.ceil(wait))
+                return response
+            return view(request, *args, **kwargs)
+
+        return wrapped
+
+    return decorator
@@ -0,0 +1,299 @@
+import bisect
+import heapq
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+
+from . import metrics
+from .models import Category, Like, OrderDetail, Product, Shop
+from .textnorm import fold
+
+# Gợi ý khi gõ (/suggest/?q=...) cho tên sản phẩm, shop và danh mục. Mỗi process giữ một mảng đã sắp xếp các cặp
+# (từ khoá, mục): mỗi mục có một từ khoá cho mỗi vị trí bắt đầu từ trong tên đã bỏ dấu, nên "thun" khớp
+# "Áo thun". Tìm tiền tố bằng bisect rồi xếp theo độ phổ biến (lượt thích + số lượng đã bán của sản phẩm, tổng
+# của các sản phẩm trong shop, số sản phẩm của danh mục).
+#
+# Mảng được dựng lần đầu khi cần từ vài truy vấn values(). Mỗi lần ghi Product/Shop/Category chỉ ghi thay đổi vào
+# cache dùng chung (bộ đếm phiên bản + khoá cho từng phiên bản) và đánh dấu mục đó trong chỉ mục của process ghi;
+# lần gợi ý sau nạp lại một lần mọi mục đã đánh dấu, request ghi không phải chạy truy vấn nào. Process khác kiểm tra
+# định kỳ và chỉ nạp lại các mục đã đổi. Chỉ mục được dựng lại toàn bộ khi thiếu thay đổi trong cache hoặc sau
+# TYPEAHEAD_REBUILD_SECONDS (để cập nhật điểm phổ biến).
+VERSION_CACHE_KEY = 'shopping:typeahead:version'
+CHANGE_CACHE_KEY = 'shopping:typeahead:changes:%d'
+KINDS = ('product', 'shop', 'category')
+MAX_WORDS = 8
+
+
+def typeahead_setting(name, default):
+    return getattr(settings, 'TYPEAHEAD_%s' % name, default)
+
+
+def terms(label):
+    words = fold(label).split(' ')[:MAX_WORDS]
+    return {' '.join(words[i:]) for i in range(len(words)) if words[i]}
+
+
+def shared_version():
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        cache.add(VERSION_CACHE_KEY, 0, None)
+        version = cache.get(VERSION_CACHE_KEY)
+    return version
+
+
+def load_entries(kind, ids = None):
+    # (kind, id) -> (nhãn, điểm); ids = None: toàn bộ
+    if kind == 'product':
+        queryset = Product.objects.filter(active = True)
+        if ids is not None:
+            queryset = queryset.filter(id__in = ids)
+        rows = list(queryset.values_list('id', 'name'))
+        likes = Like.objects.filter(active = True)
+        sold = OrderDetail.objects.all()
+        if ids is not None:
+            likes, sold = likes.filter(product_id__in = ids), sold.filter(product_id__in = ids)
+        scores = dict(likes.values('product_id').annotate(n = Count('id')).values_list('product_id', 'n'))
+        for product_id, quantity in sold.values('product_id').annotate(n = Sum('quantity')) \
+                .values_list('product_id', 'n'):
+            scores[product_id] = scores.get(product_id, 0) + (quantity or 0)
+        return {('product', pk): (name, scores.get(pk, 0)) for pk, name in rows}
+    if kind == 'shop':
+        # Cùng điều kiện với danh sách shop (ShopViewSet): shop bị ẩn không được gợi ý
+        queryset = Shop.objects.filter(active = True)
+        if ids is not None:
+            queryset = queryset.filter(id__in = ids)
+        # Điểm của shop: số lượng đã bán của các sản phẩm trong shop
+        rows = queryset.annotate(score = Sum('products__orderdetail__quantity')).values_list('id', 'name', 'score')
+        return {('shop', pk): (name, score or 0) for pk, name, score in rows}
+    queryset = Category.objects.filter(active = True)
+    if ids is not None:
+        queryset = queryset.filter(id__in = ids)
+    rows = queryset.annotate(score = Count('product', filter = Q(product__active = True))) \
+        .values_list('id', 'name', 'score')
+    return {('category', pk): (name, score) for pk, name, score in rows}
+
+
+def make_entries(rows):
+    # (nhãn, điểm) -> (nhãn, điểm, nhãn đã bỏ dấu)
+    return {key: (label, score, fold(label)) for key, (label, score) in rows.items()}
+
+
+def rank(prefix, window, entries):
+    # Xếp hạng mọi mục có từ khoá trong window: điểm phổ biến, rồi khớp từ đầu tên được ưu tiên hơn khớp giữa tên,
+    # rồi tên ngắn hơn
+    found = {}
+    for term, key in window:
+        found[key] = found.get(key, False) or entries[key][2].startswith(prefix)
+    return sorted(found, key = lambda k: (-entries[k][1], not found[k], len(entries[k][0]), k))
+
+
+class Index:
+    def __init__(self, version):
+        self.version = version
+        self.lock = threading.Lock()
+        self.entries = {}
+        for kind in KINDS:
+            self.entries.update(make_entries(load_entries(kind)))
+        self.terms = sorted((term, key) for key, entry in self.entries.items() for term in terms(entry[0]))
+        # Tiền tố khớp quá TYPEAHEAD_SCAN_LIMIT từ khoá -> top TYPEAHEAD_MAX_LIMIT mục đã xếp hạng của từng loại
+        self.top = {}
+        # Tăng mỗi lần chỉ mục đổi: top xếp hạng ngoài lock chỉ được lưu khi chỉ mục không đổi trong lúc xếp hạng
+        self.generation = 0
+        # Các mục process này vừa ghi, chờ nạp lại ở lần gợi ý sau
+        self.dirty = set()
+        self.built_at = self.checked_at = time.monotonic()
+
+    def mark_dirty(self, keys, version):
+        with self.lock:
+            self.dirty.update(keys)
+            if self.version == version - 1:
+                self.version = version
+
+    def reload_dirty(self):
+        with self.lock:
+            keys, self.dirty = self.dirty, set()
+        if keys:
+            reload_keys(self, keys)
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for term in terms(entry[0]):
+            i = bisect.bisect_left(self.terms, (term, key))
+            if i < len(self.terms) and self.terms[i] == (term, key):
+                del self.terms[i]
+
+    def replace(self, keys, entries):
+        # keys: các mục cần nạp lại; mục không còn trong entries (đã xoá, ẩn) bị bỏ khỏi chỉ mục
+        with self.lock:
+            changed_terms = set()
+            for key in keys:
+                if key in self.entries:
+                    changed_terms |= terms(self.entries[key][0])
+                if key in entries:
+                    changed_terms |= terms(entries[key][0])
+                self.remove(key)
+                if key in entries:
+                    self.entries[key] = entries[key]
+                    for term in terms(entries[key][0]):
+                        bisect.insort(self.terms, (term, key))
+            # Bỏ top đã tính của các tiền tố có từ khoá đổi, lần tìm sau xếp hạng lại
+            for prefix in [p for p in self.top if any(term.startswith(p) for term in changed_terms)]:
+                del self.top[prefix]
+            self.generation += 1
+
+    def search(self, prefix, limit, kinds = KINDS):
+        # Các từ khoá khớp tiền tố nằm liền nhau trong mảng đã sắp xếp. Trong lock chỉ chép khoảng đó (các entry là
+        # tuple không đổi), xếp hạng chạy ngoài lock nên không chặn các lần ghi và lần tìm khác. Tiền tố rất ngắn
+        # ("a") khớp quá TYPEAHEAD_SCAN_LIMIT từ khoá thì cả khoảng chỉ được xếp hạng một lần, giữ top của từng loại
+        # tới khi có mục trong khoảng đổi
+        with self.lock:
+            start = bisect.bisect_left(self.terms, (prefix,))
+            end = bisect.bisect_left(self.terms, (prefix + '\U0010ffff',), start)
+            scan = end - start <= typeahead_setting('SCAN_LIMIT', 5000)
+            top = None if scan else self.top.get(prefix)
+            if top is None:
+                window = self.terms[start:end]
+                entries = {key: self.entries[key] for term, key in window}
+                generation = self.generation
+        if scan:
+            best = [(key, entries[key][0]) for key in rank(prefix, window, entries) if key[0] in kinds][:limit]
+        else:
+            if top is None:
+                # (thứ hạng trong cả khoảng, mục, nhãn): gộp nhiều loại chỉ cần sắp theo thứ hạng
+                top = {kind: [] for kind in KINDS}
+                size = typeahead_setting('MAX_LIMIT', 20)
+                for position, key in enumerate(rank(prefix, window, entries)):
+                    if len(top[key[0]]) < size:
+                        top[key[0]].append((position, key, entries[key][0]))
+                with self.lock:
+                    if self.generation == generation:
+                        self.top[prefix] = top
+            best = [(key, label) for position, key, label in heapq.nsmallest(limit, (item for kind in kinds
+                                                                                     for item in top[kind]))]
+        return [{'type': kind, 'id': pk, 'label': label} for (kind, pk), label in best]
+
+
+_index = None
+_build_lock = threading.Lock()
+
+
+def index():
+    global _index
+    current = _index
+    now = time.monotonic()
+    if current is not None:
+        current.reload_dirty()
+        if now - current.checked_at < typeahead_setting('CHECK_INTERVAL', 5):
+            return current
+        version = shared_version()
+        stale = now - current.built_at > typeahead_setting('REBUILD_SECONDS', 3600)
+        if version == current.version and not stale:
+            current.checked_at = now
+            return current
+        if not stale and apply_changes(current, version):
+            current.checked_at = now
+            return current
+    with _build_lock:
+        if _index is current:
+            # Đọc phiên bản trước khi đọc dữ liệu: lần ghi xen giữa sẽ làm lần kiểm tra sau nạp lại mục đó
+            _index = Index(shared_version())
+            metrics.increment('typeahead.rebuilds')
+        return _index
+
+
+def apply_changes(current, version):
+    # Nạp lại các mục đổi từ phiên bản của chỉ mục tới version; False nếu phải dựng lại toàn bộ
+    if version < current.version or version - current.version > typeahead_setting('MAX_CHANGES', 1000):
+        return False
+    names = [CHANGE_CACHE_KEY % v for v in range(current.version + 1, version + 1)]
+    changes = cache.get_many(names)
+    if len(changes) != len(names):
+        return False
+    reload_keys(current, {tuple(key) for keys in changes.values() for key in keys})
+    current.version = version
+    return True
+
+
+def reload_keys(current, keys):
+    entries = {}
+    for kind in KINDS:
+        ids = [pk for k, pk in keys if k == kind]
+        if ids:
+            entries.update(make_entries(load_entries(kind, ids)))
+    current.replace(keys, entries)
+
+
+def reset():
+    global _index
+    _index = None
+
+
+def changed(kind, pk):
+    changed_many(kind, [pk])
+
+
+def changed_many(kind, pks):
+    # Sau khi commit: ghi thay đổi (một phiên bản cho cả danh sách) cho process khác và đánh dấu các mục trong chỉ mục
+    # của process này; chỉ đọc/ghi cache, việc nạp lại chạy ở lần gợi ý sau
+    keys = [(kind, pk) for pk in pks]
+    if not keys:
+        return
+
+    def apply():
+        try:
+            version = cache.incr(VERSION_CACHE_KEY)
+        except ValueError:
+            shared_version()
+            version = cache.incr(VERSION_CACHE_KEY)
+        cache.set(CHANGE_CACHE_KEY % version, keys, typeahead_setting('CHANGE_TIMEOUT', 3600))
+        current = _index
+        if current is not None:
+            current.mark_dirty(keys, version)
+
+    transaction.on_commit(apply)
+
+
+@receiver(post_save, sender = Product, dispatch_uid = 'shopping.typeahead.product_saved')
+@receiver(post_delete, sender = Product, dispatch_uid = 'shopping.typeahead.product_deleted')
+def product_changed(sender, instance, raw = False, **kwargs):
+    if not raw:
+        changed('product', instance.pk)
+
+
+@receiver(post_save, sender = Shop, dispatch_uid = 'shopping.typeahead.shop_saved')
+@receiver(post_delete, sender = Shop, dispatch_uid = 'shopping.typeahead.shop_deleted')
+def shop_changed(sender, instance, raw = False, **kwargs):
+    if not raw:
+        changed('shop', instance.pk)
+
+
+@receiver(post_save, sender = Category, dispatch_uid = 'shopping.typeahead.category_saved')
+@receiver(post_delete, sender = Category, dispatch_uid = 'shopping.typeahead.category_deleted')
+def category_changed(sender, instance, raw = False, **kwargs):
+    if not raw:
+        changed('category', instance.pk)
+
+
+@require_GET
+def suggest(request):
+    # /suggest/?q=ao th&limit=8&type=product,shop
+    prefix = fold(request.GET.get('q', ''))
+    try:
+        limit = min(max(int(request.GET.get('limit', 8)), 1), typeahead_setting('MAX_LIMIT', 20))
+    except ValueError:
+        limit = 8
+    kinds = tuple(k for k in request.GET.get('type', '').split(',') if k in KINDS) or KINDS
+    results = index().search(prefix, limit, kinds) if len(prefix) >= typeahead_setting('MIN_LENGTH', 1) else []
+    response = JsonResponse({'q': request.GET.get('q', ''), 'results': results})
+    response['Cache-Control'] = 'public, max-age=%d' % typeahead_setting('MAX_AGE', 30)
+    return response
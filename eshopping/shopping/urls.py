@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.urls import path, include
-from . import views
+from . import views, async_views, images, payments, typeahead
 from rest_framework.routers import DefaultRouter
 
 router = DefaultRouter()
@@ -24,4 +24,14 @@ router.register('stats', viewset = views.StatsViewSet, basename = 'stats')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('images/<path:name>', images.resized_image, name = 'resized-image'),
+    path('payments/webhook/<str:gateway>/', payments.payment_webhook),
+    path('suggest/', typeahead.suggest, name = 'suggest'),
+    path('internal/db-pool/', views.db_pool_stats),
+    path('internal/metrics/', views.internal_metrics),
+    # Phiên bản async (ASGI) của các endpoint chờ upload/gửi email
+    path('async/products/', async_views.create_product),
+    path('async/users/', async_views.register_user),
+    path('async/business/', async_views.register_business),
+    path('async/order/', async_views.place_order),
 ]
@@ -1,9 +1,10 @@
 import cloudinary
 from cloudinary import uploader
-from django.db import IntegrityError
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from django.db.models.functions import TruncMonth, TruncYear
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import HttpResponse, Http404, StreamingHttpResponse
 from .models import Category, Product, User, Order, Cart, CartDetail, Like, ProductReview, OrderDetail, Business, Shop, \
     Color, Size, Payment
 from rest_framework import viewsets, permissions, generics, parsers, status, serializers
@@ -12,26 +13,62 @@ from .perms import ReviewOwner, IsBusiness, IsBusinessOwner, IsShopOwner
 from .serializers import CategorySerializer, ProductSerializer, UserSerializer, GroupSerializer, OrderSerializer, \
     CartSerializer, AuthorizeProductDetailSerializer, ProductReviewSerializer, OrderDetailSerializer, \
     BusinessSerializer, ShopSerializer, ColorSerializer, SizeSerializer, CartDetailSerializer, PaymentSerializer, \
-    LikeSerializer, OrderDetailDeserializer, StatsSerializer
+    LikeSerializer, OrderDetailDeserializer, StatsSerializer, query_param_set
 from .paginators import ProductsPagination, CommentPagination
+from .renderers import StreamingJSONResponse, StreamingListMixin
+from .backends.pool import pool_stats
+from .likes import toggle_like, liked_product_ids
+from .cache import cached_products, load_products
+from .textnorm import search_key
+from .throttling import ThrottledActionsMixin
+from . import archive, bulkupdate, exports, jobs, metrics, refdata, search, snapshots, typeahead
 from django.contrib.auth.models import Group
-from rest_framework.decorators import action, api_view
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.views import Response
-from django.db.models import Q, F, Count, Sum
+from django.db.models import Q, F, Count, Sum, Prefetch
 from PIL import Image
 
 
-class CategoryViewSet(viewsets.ViewSet, generics.ListAPIView):
+class ReferenceDataListMixin:
+    # Danh sách danh mục/màu/kích thước lấy từ refdata, không truy vấn DB. ETag là phiên bản refdata:
+    # client gửi lại If-None-Match khớp thì trả 304 không kèm dữ liệu
+    reference_kind = None
+
+    def reference_rows(self):
+        return refdata.rows(self.reference_kind)
+
+    def list(self, request, *args, **kwargs):
+        etag = refdata.etag(self.reference_kind)
+        if request.headers.get('If-None-Match') == etag:
+            return Response(status = status.HTTP_304_NOT_MODIFIED, headers = {'ETag': etag})
+        data = [{'id': row['id'], 'name': row['name']} for row in self.reference_rows()]
+        return Response(data = data, status = status.HTTP_200_OK, headers = {'ETag': etag})
+
+
+def add_product_options(product, size_names, color_names):
+    # Tên kích thước/màu -> id qua refdata (chỉ tên mới mới ghi DB), các dòng liên kết tạo bằng bulk_create
+    Product.sizes.through.objects.bulk_create([Product.sizes.through(product_id = product.pk, size_id = pk)
+                                               for pk in refdata.resolve_names('sizes', size_names)])
+    Product.colors.through.objects.bulk_create([Product.colors.through(product_id = product.pk, color_id = pk)
+                                                for pk in refdata.resolve_names('colors', color_names)])
+
+
+class CategoryViewSet(ReferenceDataListMixin, viewsets.ViewSet, generics.ListAPIView):
     queryset = Category.objects.filter(active = True)
     serializer_class = CategorySerializer
+    reference_kind = 'categories'
 
+    def reference_rows(self):
+        return [row for row in super().reference_rows() if row['active']]
 
-class ProductViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIView, generics.CreateAPIView,
-                     generics.UpdateAPIView):
+
+class ProductViewSet(ThrottledActionsMixin, viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIView,
+                     generics.CreateAPIView, generics.UpdateAPIView):
     queryset = Product.objects.filter(active = True)
     serializer_class = ProductSerializer
     pagination_class = ProductsPagination
     parser_classes = [parsers.MultiPartParser]
+    throttled_actions = {'create': 'product', 'add_to_cart': 'cart', 'like': 'like', 'review': 'review'}
 
     def get_serializer_class(self):
         if self.request.user.is_authenticated:
@@ -39,10 +76,84 @@ class ProductViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAP
 
         return self.serializer_class
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ['list', 'retrieve']:
+            queryset = self.get_serializer_class().setup_queryset(queryset, self.request)
+        return queryset
+
+    def uses_default_representation(self):
+        # Cache theo sản phẩm chỉ lưu biểu diễn mặc định, ?fields=/?expand= thì đọc thẳng từ DB
+        return query_param_set(self.request, 'fields') is None and query_param_set(self.request, 'expand') is None
+
+    def product_representations(self, ids):
+        # id -> dữ liệu sản phẩm: lấy từ cache, phần còn thiếu nạp chung một lần; cờ liked của user đăng nhập
+        # được gắn sau từ tập id đã thích
+        items = cached_products(ids)
+        missing = [pk for pk in ids if pk not in items]
+        if missing:
+            items.update(load_products(missing, ProductSerializer))
+        if self.request.user.is_authenticated:
+            liked = liked_product_ids(self.request.user)
+            items = {pk: dict(item, liked = pk in liked) for pk, item in items.items()}
+        return items
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.uses_default_representation():
+            return super().retrieve(request, *args, **kwargs)
+        try:
+            pk = int(kwargs['pk'])
+        except ValueError:
+            raise Http404
+        item = self.product_representations([pk]).get(pk)
+        if item is None:
+            raise Http404
+        return Response(item)
+
+    @action(methods = ['get'], detail = False, url_path = 'batch')
+    def batch(self, request):
+        # ?ids=3,1,2: trả các sản phẩm theo đúng thứ tự yêu cầu, id không tồn tại hoặc đã ẩn nằm trong "missing"
+        try:
+            ids = list(dict.fromkeys(int(v) for v in request.query_params.get('ids', '').split(',') if v.strip()))
+        except ValueError:
+            return Response(data = {'message': 'ids phải là danh sách id sản phẩm, cách nhau bởi dấu phẩy'},
+                            status = status.HTTP_400_BAD_REQUEST)
+        limit = settings.PRODUCT_BATCH_MAX_IDS
+        if not ids or len(ids) > limit:
+            return Response(data = {'message': 'Cần từ 1 đến %d id sản phẩm' % limit},
+                            status = status.HTTP_400_BAD_REQUEST)
+
+        if self.uses_default_representation():
+            items = self.product_representations(ids)
+            results = [items[pk] for pk in ids if pk in items]
+        else:
+            items = {p.id: p for p in self.get_serializer_class().setup_queryset(
+                Product.objects.filter(active = True, id__in = ids), request)}
+            results = self.get_serializer([items[pk] for pk in ids if pk in items], many = True).data
+        return Response(data = {'results': results, 'missing': [pk for pk in ids if pk not in items]},
+                        status = status.HTTP_200_OK)
+
+    @action(methods = ['post'], detail = False, url_path = 'bulk-update', parser_classes = [parsers.JSONParser])
+    def bulk_update(self, request):
+        # Sửa giá, khuyến mãi, tồn kho, ẩn/hiện cho nhiều sản phẩm của shop trong một request (shopping/bulkupdate.py)
+        shop_id = Shop.objects.filter(business = request.user.id).values_list('id', flat = True).first()
+        if shop_id is None:
+            return Response(data = {'message': 'Tài khoản chưa có shop'}, status = status.HTTP_403_FORBIDDEN)
+        plan, errors = bulkupdate.parse(request.data)
+        if errors:
+            return Response(data = {'message': 'Dữ liệu không hợp lệ', 'errors': errors},
+                            status = status.HTTP_400_BAD_REQUEST)
+        if plan[0] == 'items':
+            foreign = bulkupdate.not_owned(shop_id, plan[1])
+            if foreign:
+                return Response(data = {'message': 'Sản phẩm không thuộc shop', 'ids': foreign},
+                                status = status.HTTP_403_FORBIDDEN)
+        return Response(data = {'updated': bulkupdate.apply(shop_id, plan)}, status = status.HTTP_200_OK)
+
     def get_permissions(self):
         if self.action in ['add_to_cart', 'like', 'review', 'get_like']:
             return [permissions.IsAuthenticated()]
-        elif self.action in ['create']:
+        elif self.action in ['create', 'bulk_update']:
             return [permissions.IsAuthenticated(), IsBusiness()]
         # elif self.action in ['update', 'partial_update']:
         #     return [permissions.IsAuthenticated(), IsBusiness(), IsShopOwner()]
@@ -57,7 +168,8 @@ class ProductViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAP
             max_price = self.request.query_params.get('max_price')
             sort_by = self.request.query_params.get('sort_by')
             if kw:
-                q = q.filter(Q(shop__name__icontains = kw) | Q(name__icontains = kw))
+                # Không phân biệt dấu, chịu được sai vài ký tự (shopping/search.py)
+                q = q.filter(search.product_filter(kw))
             if min_price and max_price:
                 q = q.filter(price__range = (min_price, max_price))
                 q = q.annotate(
@@ -87,7 +199,12 @@ class ProductViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAP
         sizes = data.pop("sizes")
         thumbnail = ''
         image = request.data.get('thumbnail')
-        category = Category.objects.get(id = int(data.get('category')))
+        try:
+            category = refdata.instance('categories', int(data.get('category')))
+        except (TypeError, ValueError):
+            category = None
+        if category is None:
+            return Response(data = {'message': 'Danh mục không tồn tại'}, status = status.HTTP_400_BAD_REQUEST)
         shop = Shop.objects.get(business = request.user.id)
         # kiểm tra ảnh nếu có thì lưu ảnh lên cloudinary
         if image:
@@ -100,13 +217,7 @@ class ProductViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAP
                                          category = category, thumbnail = thumbnail, shop = shop,
                                          description = data.get('description'))
 
-        for size_data in sizes:
-            size, _ = Size.objects.get_or_create(name = size_data)
-            product.sizes.add(size)
-        for color_data in colors:
-            color, _ = Color.objects.get_or_create(name = color_data)
-            product.colors.add(color)
-        product.save()
+        add_product_options(product, sizes, colors)
         return Response(ProductSerializer(product, context = {'request': request}).data,
                         status = status.HTTP_201_CREATED)
 
@@ -151,15 +262,7 @@ class ProductViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAP
 
     @action(methods = ['post'], detail = True, url_path = 'like')
     def like(self, request, pk):
-
-        l, created = Like.objects.get_or_create(user_id = request.user, product_id = self.get_object())
-        if not created:
-            l.active = not l.active
-        l.save()
-        # like = Like.objects.get(user_id = request.user, product_id = pk)
-        # if not like:
-        #     like = Like.objects.create(user = request.user, product = self.get_object(), active = True)
-        #     like.save()
+        l = toggle_like(request.user, self.get_object())
 
         return Response(data = LikeSerializer(l, context = {'request': request}).data, status = status.HTTP_200_OK)
 
@@ -188,7 +291,8 @@ class ProductViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAP
     def list_review(self, request, pk):
         try:
             product = Product.objects.get(id = pk)
-            reviews = ProductReview.objects.filter(active = True, product = product).order_by('-created_date')
+            reviews = ProductReviewSerializer.setup_queryset(
+                ProductReview.objects.filter(active = True, product = product), request).order_by('-created_date')
             paginator = CommentPagination()
             list_review = paginator.paginate_queryset(reviews, request)
 
@@ -215,11 +319,12 @@ class ProductCompareViewSet(viewsets.ViewSet, generics.ListAPIView):
         return q
 
 
-class UserViewSet(viewsets.ViewSet, generics.CreateAPIView,
+class UserViewSet(ThrottledActionsMixin, viewsets.ViewSet, generics.CreateAPIView,
                   generics.RetrieveAPIView, generics.ListAPIView):
-    queryset = User.objects.filter(is_active = True)
+    queryset = User.objects.filter(is_active = True).prefetch_related('groups', 'user_permissions')
     serializer_class = UserSerializer
     parser_classes = [parsers.MultiPartParser, ]
+    throttled_actions = {'create': 'register'}
 
     def get_permissions(self):
         if self.action in ['current_user']:
@@ -246,11 +351,12 @@ class UserViewSet(viewsets.ViewSet, generics.CreateAPIView,
         return Response({'message': 'User logged out successfully.'}, status = status.HTTP_200_OK)
 
 
-class BusinessViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView,
+class BusinessViewSet(ThrottledActionsMixin, viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView,
                       generics.RetrieveAPIView):
-    queryset = Business.objects.filter(is_active = True)
+    queryset = Business.objects.filter(is_active = True).prefetch_related('groups', 'user_permissions')
     serializer_class = BusinessSerializer
     parser_classes = [parsers.MultiPartParser, ]
+    throttled_actions = {'create': 'register'}
 
     def get_permissions(self):
         if self.action in ['current_business']:
@@ -270,8 +376,10 @@ class BusinessViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPI
 
     @action(methods = ['get'], detail = True, url_path = 'get-shop')
     def get_shop(self, request, pk):
-        business = Business.objects.get(pk = pk)
-        shop = Shop.objects.get(business = business)
+        # Tìm theo Shop.business_id (có index), không cần đọc Business
+        shop = Shop.objects.filter(business_id = pk).first()
+        if shop is None:
+            raise Http404
         return Response(ShopSerializer(shop, context = {'request': request}).data, status = status.HTTP_200_OK)
 
 
@@ -280,29 +388,55 @@ class BusinessViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPI
 #     serializer_class = GroupSerializer
 
 
-class OrderViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView, generics.RetrieveAPIView,
-                   generics.UpdateAPIView):
+def create_order(user, validated_data):
+    # Tạo đơn hàng, thanh toán và chi tiết đơn trong một transaction (dùng chung với async_views.place_order)
+    order_data = validated_data.copy()
+    order_details_data = order_data.pop('order_details')
+    payment_method = order_data.pop('payment_method')
+    payment_status = order_data.pop('payment_status')
+
+    with transaction.atomic():
+        order = Order.objects.create(**order_data, user = user)
+        Payment.objects.create(order = order, user = user, payment_method = payment_method,
+                               payment_status = payment_status, total_amount = order.total_amount)
+        # Dòng đơn kèm snapshot sản phẩm (một truy vấn cho mọi sản phẩm), ghi bằng một câu INSERT
+        OrderDetail.objects.bulk_create(snapshots.fill([OrderDetail(order_id = order.id, **order_detail_data)
+                                                        for order_detail_data in order_details_data]))
+    return order
+
+
+class OrderViewSet(ThrottledActionsMixin, viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView,
+                   generics.RetrieveAPIView, generics.UpdateAPIView):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    throttled_actions = {'create': 'order'}
 
     def get_permissions(self):
-        if self.action in ['get_order_detail', 'create', 'get_user_order', 'partial_update', 'get_order_payment']:
+        if self.action in ['get_order_detail', 'create', 'get_user_order', 'partial_update', 'get_order_payment',
+                           'export']:
             return [permissions.IsAuthenticated()]
 
         return [permissions.AllowAny()]
 
+    def perform_update(self, serializer):
+        # Thông báo đổi trạng thái (signal post_save của Order) được ghi cùng transaction với đơn hàng
+        with transaction.atomic():
+            serializer.save()
+
     @action(methods = ['get'], detail = False, url_path = 'get-user-order')
     def get_user_order(self, request):
-        user = request.user
-        order = Order.objects.filter(user = user).order_by('created_date')
-        return Response(OrderSerializer(order, many = True, context = {'request': request}).data,
-                        status = status.HTTP_200_OK)
+        # Gồm cả đơn đã lưu trữ (shopping/archive.py)
+        orders = archive.user_orders(lambda queryset: OrderSerializer.setup_queryset(queryset, request), request.user)
+        return StreamingJSONResponse(orders, OrderSerializer, context = {'request': request})
 
     @action(methods = ['get'], detail = True, url_path = 'order-detail')
     def get_order_detail(self, request, pk):
-        order = Order.objects.get(pk = pk)
+        order = archive.find_order(pk)
+        if order is None:
+            raise Http404
         try:
-            order_details = OrderDetail.objects.filter(order = order).order_by('created_date')
+            # Chỉ đọc bảng dòng đơn: thông tin sản phẩm là snapshot lúc đặt hàng
+            order_details = archive.order_lines(order).order_by('created_date')
             if order_details:
                 return Response(
                     OrderDetailDeserializer(order_details, many = True, context = {'request': request}).data,
@@ -311,9 +445,31 @@ class OrderViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIVie
         except Exception:
             return Response(data = {"message": "Có lỗi xảy ra"}, status = status.HTTP_502_BAD_GATEWAY)
 
+    @action(methods = ['get'], detail = False, url_path = 'export')
+    def export(self, request):
+        # /order/export/?fmt=csv|xlsx&shop=1,2&from=2024-01-01&to=2024-01-31&status=paid,shipped
+        # Admin xuất được mọi shop, doanh nghiệp chỉ xuất được các shop của mình
+        fmt = request.query_params.get('fmt', 'csv')
+        filters, errors = exports.parse_filters(request.query_params)
+        if fmt not in exports.FORMATS:
+            errors['fmt'] = 'Định dạng phải thuộc %s' % list(exports.FORMATS)
+        if errors:
+            return Response(data = {"message": errors}, status = status.HTTP_400_BAD_REQUEST)
+        if not request.user.is_staff:
+            owned = set(Shop.objects.filter(business_id = request.user.id).values_list('id', flat = True))
+            if not owned or not set(filters.get('shops', owned)) <= owned:
+                return Response(data = {"message": "Không có quyền xuất đơn hàng của shop này"},
+                                status = status.HTTP_403_FORBIDDEN)
+            filters['shops'] = sorted(filters.get('shops', owned))
+        response = StreamingHttpResponse(exports.iter_export(fmt, filters), content_type = exports.FORMATS[fmt])
+        response['Content-Disposition'] = 'attachment; filename="%s"' % exports.export_filename(fmt)
+        return response
+
     @action(methods = ['get'], detail = True, url_path = 'get-order-payment')
     def get_order_payment(self, request, pk):
-        payment = Payment.objects.get(order = pk)
+        payment = archive.order_payment(pk)
+        if payment is None:
+            raise Http404
         return Response(PaymentSerializer(payment, context = {'request': request}).data, status = status.HTTP_200_OK)
 
 
@@ -322,19 +478,7 @@ class OrderViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIVie
             serializer = self.get_serializer(data = request.data)
             serializer.is_valid(raise_exception = True)
 
-            order_data = serializer.validated_data.copy()
-            order_details_data = order_data.pop('order_details')
-            payment_method = order_data.pop('payment_method')
-            payment_status = order_data.pop('payment_status')
-
-            order = Order.objects.create(**order_data, user = request.user)
-            order.save()
-
-            payment = Payment.objects.create(order = order, user = request.user, payment_method = payment_method,
-                                             payment_status = payment_status, total_amount = order.total_amount)
-            payment.save()
-            for order_detail_data in order_details_data:
-                OrderDetail.objects.create(order_id = order.id, **order_detail_data)
+            order = create_order(request.user, serializer.validated_data)
 
             # serializer = self.get_serializer(order)
             # headers = self.get_success_headers(serializer.data)
@@ -346,13 +490,14 @@ class OrderViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIVie
             return Response(data = {"message": "Có lỗi xảy ra"}, status = status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class OrderDetailViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView):
+class OrderDetailViewSet(StreamingListMixin, viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView):
     queryset = OrderDetail.objects.all()
     serializer_class = OrderDetailSerializer
 
 
 class CartViewSet(viewsets.ViewSet, generics.ListAPIView):
-    queryset = Cart.objects.all()
+    queryset = Cart.objects.prefetch_related(
+        Prefetch('cart_detail', queryset = CartDetailSerializer.setup_queryset(CartDetail.objects.all())))
     serializer_class = CartSerializer
 
     def get_permissions(self):
@@ -363,15 +508,22 @@ class CartViewSet(viewsets.ViewSet, generics.ListAPIView):
     @action(methods = ['get'], detail = False, url_path = "cart-detail")
     def get_cart_detail(self, request):
         cart = Cart.objects.get(user = request.user)
-        cart_detail = CartDetail.objects.filter(cart = cart)
+        cart_detail = CartDetailSerializer.setup_queryset(CartDetail.objects.filter(cart = cart), request)
         return Response(data = CartDetailSerializer(cart_detail, many = True, context = {'request': request}).data,
                         status = status.HTTP_200_OK)
 
 
-class CartDetailViewSet(viewsets.ViewSet, generics.ListAPIView, generics.UpdateAPIView, generics.DestroyAPIView):
+class CartDetailViewSet(StreamingListMixin, viewsets.ViewSet, generics.ListAPIView, generics.UpdateAPIView,
+                        generics.DestroyAPIView):
     queryset = CartDetail.objects.all()
     serializer_class = CartDetailSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ['list']:
+            queryset = CartDetailSerializer.setup_queryset(queryset, self.request)
+        return queryset
+
     def get_permissions(self):
         if self.action in ['destroy', 'update']:
             return [permissions.IsAuthenticated()]
@@ -407,9 +559,8 @@ class ShopViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.ListAPIView
                                 status = status.HTTP_406_NOT_ACCEPTABLE)
 
             else:
-                business = Business.objects.get(id = request.user.id)
                 shop = Shop.objects.create(**shop_data)
-                shop.business = business
+                shop.business_id = request.user.id
                 shop.is_active = True
                 shop.save()
                 return Response(data = {"message": "Success"}, status = status.HTTP_201_CREATED)
@@ -425,8 +576,15 @@ class ShopViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.ListAPIView
             serializer.is_valid(raise_exception = True)
             shop_data = serializer.validated_data.copy()
 
-            business = Business.objects.get(id = request.user.id)
-            shop = Shop.objects.update(**shop_data, business = business)
+            shop_data.pop('business', None)
+            shop_data['business_id'] = request.user.id
+            # update() không qua save(): tự ghi khoá/token tìm kiếm và báo chỉ mục gợi ý
+            if 'name' in shop_data:
+                shop_data['search_key'] = search_key(shop_data['name'])
+            shop = Shop.objects.filter(pk = kwargs['pk']).update(**shop_data)
+            if 'name' in shop_data:
+                search.write_tokens('shop', [(kwargs['pk'], shop_data['search_key'])])
+            typeahead.changed('shop', int(kwargs['pk']))
             # shop.is_active = True
             # shop.save()
             return Response(data = {"message": "Success"}, status = status.HTTP_201_CREATED)
@@ -440,10 +598,8 @@ class ShopViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.ListAPIView
     @action(methods = ['get'], detail = True, url_path = 'get-products')
     def get_products(self, request, pk):
         shop = Shop.objects.get(pk = pk)
-        products = Product.objects.filter(shop = shop)
-        serializer = ProductSerializer(products)
-        return Response(ProductSerializer(products, many = True, context = {'request': request}).data,
-                        status = status.HTTP_200_OK)
+        products = ProductSerializer.setup_queryset(Product.objects.filter(shop = shop), request)
+        return StreamingJSONResponse(products, ProductSerializer, context = {'request': request})
 
 
 class StatsViewSet(viewsets.ViewSet):
@@ -453,10 +609,9 @@ class StatsViewSet(viewsets.ViewSet):
     @action(detail = False, methods = ['get'], url_path = 'stats-count')
     def stats_count(self, request):
         valid_statuses = ['created', 'confirm', 'shipped', 'delivered']
-        total_amount = Order.objects.filter(status__in = valid_statuses).aggregate(Sum('total_amount'))[
-                           'total_amount__sum'] or 0
+        # Gồm cả đơn đã lưu trữ
+        total_amount, order_count = archive.order_totals(valid_statuses)
         user_count = User.objects.count()
-        order_count = Order.objects.count()
         product_count = Product.objects.count()
         data = {
             'total_amount': total_amount, 'user_count': user_count, 'order_count': order_count,
@@ -467,26 +622,22 @@ class StatsViewSet(viewsets.ViewSet):
 
     @action(detail = False, methods = ['get'], url_path = 'order-by-month')
     def order_by_month(self, request):
-        order_by_month = Order.objects.annotate(month = TruncMonth('created_date')) \
-            .values('month') \
-            .annotate(total_amount = Sum('total_amount', filter = ~Q(status = 'cancelled')),
-                      total_orders = Count('id', filter = ~Q(status = 'cancelled')),
-                      canceled_orders = Count('id', filter = Q(status = 'cancelled')), ) \
-            .order_by('month')
         response_data = {
-            'data': list(order_by_month),
+            'data': archive.orders_by_month(),
         }
         return Response(data = response_data, status = status.HTTP_200_OK)
 
 
-class ColorsViewSet(viewsets.ViewSet, generics.ListAPIView):
+class ColorsViewSet(ReferenceDataListMixin, viewsets.ViewSet, generics.ListAPIView):
     queryset = Color.objects.all()
     serializer_class = ColorSerializer
+    reference_kind = 'colors'
 
 
-class SizesViewSet(viewsets.ViewSet, generics.ListAPIView):
+class SizesViewSet(ReferenceDataListMixin, viewsets.ViewSet, generics.ListAPIView):
     queryset = Size.objects.all()
     serializer_class = SizeSerializer
+    reference_kind = 'sizes'
 
 
 class PaymentViewSet(viewsets.ViewSet):
@@ -494,4 +645,16 @@ class PaymentViewSet(viewsets.ViewSet):
     serializer_class = PaymentSerializer
 
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def db_pool_stats(request):
+    return Response(data = pool_stats(), status = status.HTTP_200_OK)
+
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def internal_metrics(request):
+    data = metrics.snapshot()
+    data['db_pool'] = pool_stats()
+    data['jobs'] = jobs.depth()
+    return Response(data = data, status = status.HTTP_200_OK)
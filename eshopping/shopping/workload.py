@@ -0,0 +1,110 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.backends.signals import connection_created
+
+from .metrics import query_shape
+
+# Chỉ các câu lệnh có WHERE / ORDER BY mới hưởng lợi từ index
+CAPTURED_STATEMENTS = ('SELECT', 'UPDATE', 'DELETE')
+
+
+class WorkloadRecorder:
+    # Ghi lại mọi truy vấn của process theo hình dạng: số lần chạy, tổng thời gian và một câu SQL mẫu kèm
+    # tham số để advise_indexes chạy EXPLAIN. Mỗi process ghi file riêng workload-<pid>.json trong thư mục capture.
+    def __init__(self, directory, flush_interval = 30):
+        self.directory = str(directory)
+        self.flush_interval = flush_interval
+        self.path = os.path.join(self.directory, 'workload-%d.json' % os.getpid())
+        self.shapes = {}
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if not many and sql.lstrip()[:6].upper() in CAPTURED_STATEMENTS:
+                self.record(context['connection'].alias, sql, params, (time.perf_counter() - start) * 1000)
+
+    def record(self, alias, sql, params, elapsed_ms):
+        shape = query_shape(sql)
+        with self.lock:
+            entry = self.shapes.get(shape)
+            if entry is None:
+                entry = self.shapes[shape] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'alias': alias,
+                                              'sql': sql, 'params': list(params or ())}
+            entry['count'] += 1
+            entry['total_ms'] += elapsed_ms
+            if elapsed_ms > entry['max_ms']:
+                # Giữ câu mẫu chậm nhất, EXPLAIN của nó đại diện tốt nhất cho hình dạng này
+                entry.update(max_ms = elapsed_ms, sql = sql, params = list(params or ()), alias = alias)
+            due = time.monotonic() - self.last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            self.last_flush = time.monotonic()
+            data = json.dumps({'pid': os.getpid(), 'shapes': self.shapes}, cls = DjangoJSONEncoder)
+        os.makedirs(self.directory, exist_ok = True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+
+
+_recorder = None
+
+
+def capture_directory():
+    return getattr(settings, 'WORKLOAD_CAPTURE_DIR', os.path.join(settings.BASE_DIR, 'workload'))
+
+
+def install():
+    # Gắn recorder vào mọi kết nối DB được mở sau lời gọi này (gọi trong ShoppingConfig.ready khi bật capture)
+    global _recorder
+    if _recorder is not None:
+        return _recorder
+    _recorder = WorkloadRecorder(capture_directory(), getattr(settings, 'WORKLOAD_FLUSH_INTERVAL', 30))
+    connection_created.connect(_attach, dispatch_uid = 'shopping.workload')
+    atexit.register(_recorder.flush)
+    return _recorder
+
+
+def _attach(sender, connection, **kwargs):
+    # Kết nối có thể được mở bên trong một connection.execute_wrapper() tạm thời, context đó
+    # pop() phần tử cuối khi thoát nên recorder phải nằm đầu danh sách
+    if _recorder not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _recorder)
+
+
+def load(directory = None):
+    # Gộp workload của mọi process đã ghi vào thư mục capture
+    shapes = {}
+    for path in sorted(glob.glob(os.path.join(directory or capture_directory(), 'workload-*.json'))):
+        with open(path) as f:
+            data = json.load(f)
+        for shape, entry in data['shapes'].items():
+            merged = shapes.get(shape)
+            if merged is None:
+                shapes[shape] = dict(entry)
+                continue
+            merged['count'] += entry['count']
+            merged['total_ms'] += entry['total_ms']
+            if entry['max_ms'] > merged['max_ms']:
+                merged.update(max_ms = entry['max_ms'], sql = entry['sql'], params = entry['params'],
+                              alias = entry['alias'])
+    return shapes
+
+
+def reset(directory = None):
+    for path in glob.glob(os.path.join(directory or capture_directory(), 'workload-*.json')):
+        os.remove(path)